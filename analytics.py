@@ -1,13 +1,21 @@
+import argparse
+import hashlib
+import json
 import os
+import shutil
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-import pandas as pd
-from sqlalchemy import create_engine
-import matplotlib.pyplot as plt
-import plotly.express as px
-from openpyxl import load_workbook
-from openpyxl.formatting.rule import ColorScaleRule
-from openpyxl.utils import get_column_letter
-from config import DB_URI
+# pandas / matplotlib / openpyxl / pyarrow импортируются внутри функций тех
+# этапов, которым они нужны: запуск, где всё берётся из кэша или этап
+# пропускается, не платит за их загрузку (см. python bench.py importtime)
+from config import get_engine, print_pool_status
+from chart_sql import count_sql, grid2d_sql, grid_from_cells, histogram_from_bins, histogram_sql
+import instrumentation
+import profiling
+import query_cache
+import rollups
 
 BASE = Path(__file__).resolve().parent
 CHARTS = BASE / "charts"
@@ -18,8 +26,9 @@ def ensure_dirs():
     CHARTS.mkdir(parents=True, exist_ok=True)
     EXPORTS.mkdir(parents=True, exist_ok=True)
 
-def engine():
-    return create_engine(DB_URI)
+def engine(workers: int = 4):
+    # пул ровно под число параллельных запросов; аналитика читает с реплики
+    return get_engine("reader", pool_size=workers)
 
 def load_queries(sql_path: Path) -> dict:
     """Читает файл SQL и собирает запросы по маркерам -- name: <id>.
@@ -34,7 +43,8 @@ def load_queries(sql_path: Path) -> dict:
         body = []
         for ln in lines:
             if ln.lower().startswith("-- name:"):
-                qname = ln.split(":", 1)[1].strip()
+                # "q1_users_by_country(Pie Chart)" -> "q1_users_by_country"
+                qname = ln.split(":", 1)[1].split("(")[0].strip()
             else:
                 body.append(ln)
         if not qname:
@@ -43,133 +53,567 @@ def load_queries(sql_path: Path) -> dict:
         queries[qname] = "\n".join(body).strip()
     return queries
 
-def save_fig(fig, path: Path, title: str, rows: int, what: str):
-    fig.savefig(path, bbox_inches="tight", dpi=150)
-    plt.close(fig)
-    print(f"[OK] Saved {path.name} | rows={rows} | {what}")
+def run_queries(e, queries: dict, workers: int = 4) -> dict:
+    """Выполняет каждый запрос ровно один раз, параллельно на пуле соединений.
+       Возвращает {имя: DataFrame} в порядке файла; упавшие запросы пропускаются."""
+    def read(qname, sql):
+        with instrumentation.query_name(qname), profiling.item("queries", qname) as info:
+            df = query_cache.read_sql(sql, e)
+            info["rows"] = len(df)
+            if profiling.active():
+                info["result_mb"] = round(df.memory_usage(deep=True).sum() / 2**20, 2)
+            return df
 
-def pie_chart(df, labels_col, values_col, fname, title):
-    fig, ax = plt.subplots()
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(read, qname, sql): qname
+                   for qname, sql in queries.items()}
+        for fut in as_completed(futures):
+            qname = futures[fut]
+            try:
+                results[qname] = fut.result()
+                print(f"[SQL] {qname}: {len(results[qname])} rows")
+            except Exception as ex:
+                print(f"[ERROR] query {qname}: {ex}")
+    return {q: results[q] for q in queries if q in results}
+
+# --- рисование на готовой оси: одна функция на тип графика ---
+
+def draw_pie(ax, df, labels_col, values_col):
     ax.pie(df[values_col], labels=df[labels_col], autopct="%1.1f%%", startangle=90)
     ax.axis("equal")
-    ax.set_title(title)
-    save_fig(fig, CHARTS / fname, title, len(df), f"pie: {title}")
 
-def bar_chart(df, x, y, fname, title):
-    fig, ax = plt.subplots()
+def draw_bar(ax, df, x, y):
     ax.bar(df[x], df[y])
-    ax.set_title(title); ax.set_xlabel(x); ax.set_ylabel(y)
+    ax.set_xlabel(x); ax.set_ylabel(y)
     ax.tick_params(axis='x', rotation=30)
-    save_fig(fig, CHARTS / fname, title, len(df), f"bar: {title}")
 
-def barh_chart(df, y, x, fname, title):
-    fig, ax = plt.subplots()
+def draw_barh(ax, df, y, x):
     ax.barh(df[y], df[x])
-    ax.set_title(title); ax.set_xlabel(x); ax.set_ylabel(y)
-    save_fig(fig, CHARTS / fname, title, len(df), f"barh: {title}")
+    ax.set_xlabel(x); ax.set_ylabel(y)
 
-def line_chart(df, x, y, fname, title):
-    fig, ax = plt.subplots()
+def draw_line(ax, df, x, y):
     ax.plot(df[x], df[y], marker="o")
-    ax.set_title(title); ax.set_xlabel(x); ax.set_ylabel(y)
+    ax.set_xlabel(x); ax.set_ylabel(y)
     ax.tick_params(axis='x', rotation=30)
-    save_fig(fig, CHARTS / fname, title, len(df), f"line: {title}")
 
-def hist_chart(df, col, bins, fname, title):
-    fig, ax = plt.subplots()
+def draw_hist(ax, df, col, bins):
     ax.hist(df[col].dropna(), bins=bins)
-    ax.set_title(title); ax.set_xlabel(col); ax.set_ylabel("count")
-    save_fig(fig, CHARTS / fname, title, len(df), f"hist: {title}")
+    ax.set_xlabel(col); ax.set_ylabel("count")
+
+def draw_hist_binned(ax, df, col, bins):
+    # df — уже посчитанные в SQL корзины (chart_sql.histogram_sql)
+    edges, counts = histogram_from_bins(df, bins)
+    ax.hist(edges[:-1], bins=edges, weights=counts)
+    ax.set_xlabel(col); ax.set_ylabel("count")
+
+# выше порога scatter рисует не точки, а плотность (или выборку)
+SCATTER_THRESHOLD = 20_000
+SCATTER_GRIDSIZE = 80
+
+def reservoir_sample(chunks, x, y, k, seed=0):
+    """Равномерная выборка k пар (x, y) из потока DataFrame-кусков (алгоритм R),
+       векторизованно по куску. Память — O(k) независимо от длины потока."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    sample = np.empty((k, 2))
+    filled = seen = 0
+    for chunk in chunks:
+        pts = chunk[[x, y]].to_numpy(dtype=float)
+        take = min(k - filled, len(pts))
+        sample[filled:filled + take] = pts[:take]
+        filled += take
+        rest = pts[take:]
+        if len(rest):
+            # строка с глобальным номером j заменяет слот r ~ U[0, j], если r < k
+            j = np.arange(seen + take, seen + len(pts))
+            r = rng.integers(0, j + 1)
+            hit = np.nonzero(r < k)[0]
+            # при повторах слота побеждает более поздняя строка, как в последовательном алгоритме
+            slots, last = np.unique(r[hit][::-1], return_index=True)
+            sample[slots] = rest[hit[::-1][last]]
+        seen += len(pts)
+    return sample[:filled, 0], sample[:filled, 1]
+
+def draw_scatter(ax, df, x, y, mode="auto", threshold=SCATTER_THRESHOLD):
+    """mode: points | density (hexbin, лог-шкала) | sample (reservoir) | auto —
+       points до threshold строк, дальше density. Время рендера density не
+       зависит от числа точек: рисуется фиксированная сетка шестиугольников."""
+    if mode == "auto":
+        mode = "points" if len(df) <= threshold else "density"
+    if mode == "density":
+        hb = ax.hexbin(df[x], df[y], gridsize=SCATTER_GRIDSIZE, bins="log", mincnt=1, cmap="viridis")
+        ax.figure.colorbar(hb, ax=ax, label="points")
+    elif mode == "sample":
+        xs, ys = reservoir_sample([df], x, y, threshold)
+        ax.scatter(xs, ys, s=4, alpha=0.5)
+    else:
+        ax.scatter(df[x], df[y])
+    ax.set_xlabel(x); ax.set_ylabel(y)
+
+def draw_scatter_binned(ax, df, x, y, gridsize=SCATTER_GRIDSIZE):
+    # df — непустые ячейки, посчитанные в SQL (chart_sql.grid2d_sql)
+    import numpy as np
+    from matplotlib.colors import LogNorm
+
+    xedges, yedges, counts = grid_from_cells(df, gridsize)
+    mesh = ax.pcolormesh(xedges, yedges, np.ma.masked_equal(counts, 0), norm=LogNorm(), cmap="viridis")
+    ax.figure.colorbar(mesh, ax=ax, label="points")
+    ax.set_xlabel(x); ax.set_ylabel(y)
+
+DRAWERS = {
+    "pie": draw_pie,
+    "bar": draw_bar,
+    "barh": draw_barh,
+    "line": draw_line,
+    "hist": draw_hist,
+    "hist_binned": draw_hist_binned,
+    "scatter": draw_scatter,
+    "scatter_binned": draw_scatter_binned,
+}
+
+# одна фигура на процесс: clf() дешевле, чем создавать Figure на каждый график
+_FIG = None
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")  # отчёт только пишет PNG, окна не нужны (и их нет на сервере)
+    import matplotlib.pyplot as plt
+    return plt
+
+def render_chart(job) -> tuple:
+    """job = (kind, df, params, path, title). Работает и в главном процессе,
+       и в воркере пула. Возвращает (path, rows, kind, title, wall_s, cpu_s) для лога
+       и профиля (время меряется там, где график рисуется)."""
+    global _FIG
+    wall, cpu = time.perf_counter(), time.process_time()
+    kind, df, params, path, title = job
+    if _FIG is None:
+        _FIG = _pyplot().figure()
+    _FIG.clf()
+    ax = _FIG.add_subplot()
+    DRAWERS[kind](ax, df, **params)
+    ax.set_title(title)
+    _FIG.savefig(path, bbox_inches="tight", dpi=150)
+    return path, len(df), kind, title, time.perf_counter() - wall, time.process_time() - cpu
+
+# каждый spawn-воркер заново импортирует matplotlib (~0.5 с), а небольшой график
+# рисуется за ~0.1 с: пул окупается только на десятках графиков
+RENDER_POOL_MIN_CHARTS = 32
+
+def render_charts(jobs: list, workers: int = 1):
+    """Рендерит графики последовательно (workers <= 1) или в пуле процессов (Agg).
+       workers = 0 — сам выбирает: пул на все ядра от RENDER_POOL_MIN_CHARTS графиков."""
+    if workers == 0:
+        workers = (os.cpu_count() or 1) if len(jobs) >= RENDER_POOL_MIN_CHARTS else 1
+    if workers <= 1 or len(jobs) <= 1:
+        results = list(map(render_chart, jobs))
+    else:
+        workers = min(workers, len(jobs))
+        chunk = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(render_chart, jobs, chunksize=chunk))
+    for path, rows, kind, title, wall_s, cpu_s in results:
+        profiling.record("render", Path(path).stem, wall_s, cpu_s, rows=rows, kind=kind)
+        print(f"[OK] Saved {Path(path).name} | rows={rows} | {kind}: {title}")
+
+def pie_chart(df, labels_col, values_col, fname, title):
+    render_charts([("pie", df, dict(labels_col=labels_col, values_col=values_col), CHARTS / fname, title)])
+
+def bar_chart(df, x, y, fname, title):
+    render_charts([("bar", df, dict(x=x, y=y), CHARTS / fname, title)])
+
+def barh_chart(df, y, x, fname, title):
+    render_charts([("barh", df, dict(y=y, x=x), CHARTS / fname, title)])
+
+def line_chart(df, x, y, fname, title):
+    render_charts([("line", df, dict(x=x, y=y), CHARTS / fname, title)])
+
+def hist_chart(df, col, bins, fname, title):
+    render_charts([("hist", df, dict(col=col, bins=bins), CHARTS / fname, title)])
+
+def scatter_chart(df, x, y, fname, title, mode="auto"):
+    render_charts([("scatter", df, dict(x=x, y=y, mode=mode), CHARTS / fname, title)])
+
+EXCEL_MAX_ROWS = 1_048_576  # вместе со строкой заголовка
+
+def _color_scale():
+    from openpyxl.formatting.rule import ColorScaleRule
+
+    return ColorScaleRule(
+        start_type="min", start_color="FFAA0000",
+        mid_type="percentile", mid_value=50, mid_color="FFFFFF00",
+        end_type="max", end_color="FF00AA00"
+    )
+
+def _chunks(src):
+    """DataFrame или итератор DataFrame-кусков (например, из курсора)."""
+    import pandas as pd
+
+    if isinstance(src, pd.DataFrame):
+        yield src
+    else:
+        yield from src
+
+def _sheet_title(name: str, part: int) -> str:
+    # Excel ограничивает имя листа 31 символом; продолжения: name_2, name_3, ...
+    suffix = f"_{part}" if part > 1 else ""
+    return name[:31 - len(suffix)] + suffix
+
+class _SheetWriter:
+    """Пишет один результат в write-only листы, открывая новый лист при
+       достижении лимита строк Excel. Форматирование задаётся сразу, без перечитывания."""
 
-def scatter_chart(df, x, y, fname, title):
-    fig, ax = plt.subplots()
-    ax.scatter(df[x], df[y])
-    ax.set_title(title); ax.set_xlabel(x); ax.set_ylabel(y)
-    save_fig(fig, CHARTS / fname, title, len(df), f"scatter: {title}")
+    def __init__(self, wb, name, columns, numeric):
+        self.wb, self.name = wb, name
+        self.columns, self.numeric = columns, numeric
+        self.part = 0
+        self.rows = 0
+        self.total = 0
+        self.ws = None
+
+    def _open(self):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        self._close()
+        self.part += 1
+        self.ws = self.wb.create_sheet(_sheet_title(self.name, self.part))
+        self.ws.freeze_panes = "A2"  # в write-only режиме — до первой строки
+        header = []
+        for col in self.columns:
+            cell = WriteOnlyCell(self.ws, value=str(col))
+            cell.font = Font(bold=True)
+            header.append(cell)
+        self.ws.append(header)
+        self.rows = 0
+
+    def _close(self):
+        from openpyxl.utils import get_column_letter
+
+        if self.ws is None:
+            return
+        last_row = self.rows + 1
+        last_col = get_column_letter(max(1, len(self.columns)))
+        self.ws.auto_filter.ref = f"A1:{last_col}{last_row}"
+        if self.rows:
+            for idx in self.numeric:
+                col_letter = get_column_letter(idx)
+                self.ws.conditional_formatting.add(f"{col_letter}2:{col_letter}{last_row}", _color_scale())
+        self.ws = None
+
+    def write(self, chunk):
+        if self.ws is None:
+            self._open()
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if self.rows == EXCEL_MAX_ROWS - 1:
+                self._open()
+            self.ws.append(row)
+            self.rows += 1
+        self.total += len(chunk)
+
+    def close(self):
+        self._close()
 
 def export_to_excel(dfs: dict, filename: Path):
+    """Один проход в write-only книгу: строки не держатся в памяти целиком,
+       freeze panes / автофильтр / цветовая шкала ставятся во время записи.
+       Значения dfs — DataFrame или итераторы DataFrame-кусков."""
+    from openpyxl import Workbook
+    from pandas.api.types import is_numeric_dtype
+
     filename = EXPORTS / filename
-    with pd.ExcelWriter(filename, engine="openpyxl") as writer:
-        for sheet, df in dfs.items():
-            df.to_excel(writer, sheet_name=sheet, index=False)
-    # форматирование
-    wb = load_workbook(filename)
-    for sheet in wb.worksheets:
-        sheet.freeze_panes = "A2"
-        sheet.auto_filter.ref = sheet.dimensions
-        df = dfs[sheet.title]
-        from pandas.api.types import is_numeric_dtype
-        for idx, col in enumerate(df.columns, start=1):
-            if is_numeric_dtype(df[col]):
-                col_letter = get_column_letter(idx)
-                last_row = len(df) + 1
-                rng = f"{col_letter}2:{col_letter}{last_row}"
-                rule = ColorScaleRule(
-                    start_type="min", start_color="FFAA0000",
-                    mid_type="percentile", mid_value=50, mid_color="FFFFFF00",
-                    end_type="max", end_color="FF00AA00"
-                )
-                sheet.conditional_formatting.add(rng, rule)
-    wb.save(filename)
-    total_rows = sum(len(v) for v in dfs.values())
-    print(f"[OK] Created {filename.name}, {len(dfs)} sheets, {total_rows} rows")
+    wb = Workbook(write_only=True)
+    total_rows = 0
+    sheets = 0
+    for name, src in dfs.items():
+        with profiling.item("export_excel", name) as info:
+            writer = None
+            for chunk in _chunks(src):
+                if writer is None:
+                    numeric = [i for i, col in enumerate(chunk.columns, start=1)
+                               if is_numeric_dtype(chunk[col])]
+                    writer = _SheetWriter(wb, name, list(chunk.columns), numeric)
+                writer.write(chunk)
+            if writer is None:
+                print(f"[WARN] {name}: no data, sheet skipped")
+                continue
+            writer.close()
+            info["rows"] = writer.total
+        total_rows += writer.total
+        sheets += writer.part
+    # write-only книга: строки уже сериализованы, save() дописывает zip-архив
+    with profiling.item("export_excel", "save"):
+        wb.save(filename)
+    print(f"[OK] Created {filename.name}, {sheets} sheets, {total_rows} rows")
 
-def main():
-    ensure_dirs()
-    e = engine()
+# колонка, по которой режется Parquet-датасет запроса (остальные — один файл)
+PARQUET_PARTITIONS = {
+    "q1_users_by_country": "country",
+    "q4_events_by_month": "month",
+    "q8_fav_artists_by_country": "country",
+    "q10_artist_popularity_by_country": "country",
+}
+
+def _arrow_table(df, partition_col):
+    """Строковые колонки -> dictionary (category), дата-партиция -> ключ YYYY-MM."""
+    import pandas as pd
+    import pyarrow as pa
+
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype("category")
+    part = partition_col
+    if part and pd.api.types.is_datetime64_any_dtype(df[part]):
+        part = f"{partition_col}_key"
+        df[part] = df[partition_col].dt.strftime("%Y-%m")
+    return pa.Table.from_pandas(df, preserve_index=False), part
+
+def export_to_parquet(dfs: dict, dirname: Path, partitions: dict = PARQUET_PARTITIONS) -> dict:
+    """Каждый результат -> Parquet-датасет exports/<dirname>/<query>/ (+ manifest.json).
+       Значения dfs — DataFrame или итераторы кусков, как в export_to_excel."""
+    import pyarrow.parquet as pq
+
+    root = EXPORTS / dirname
+    manifest = {"generated_at": datetime.now().isoformat(timespec="seconds"), "datasets": {}}
+    try:
+        # частичный экспорт (cli.py export --queries ...) обновляет только свои датасеты
+        manifest["datasets"] = json.loads((root / "manifest.json").read_text(encoding="utf-8"))["datasets"]
+    except (OSError, ValueError, KeyError):
+        pass
+    for name, src in dfs.items():
+        path = root / name
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+        rows, schema, part = 0, None, None
+        with profiling.item("export_parquet", name) as info:
+            for i, chunk in enumerate(_chunks(src)):
+                table, part = _arrow_table(chunk, partitions.get(name))
+                pq.write_to_dataset(table, root_path=str(path),
+                                    partition_cols=[part] if part else None,
+                                    basename_template=f"part-{i}-{{i}}.parquet",
+                                    existing_data_behavior="overwrite_or_ignore")
+                rows += table.num_rows
+                schema = schema or {f.name: str(f.type) for f in table.schema}
+            info["rows"] = rows
+        manifest["datasets"][name] = {
+            "path": str(path.relative_to(root)),
+            "rows": rows,
+            "partition_by": part,
+            "schema": schema or {},
+            "files": sum(1 for _ in path.rglob("*.parquet")),
+        }
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "manifest.json").write_text(json.dumps(manifest, indent=2, ensure_ascii=False),
+                                        encoding="utf-8")
+    total_rows = sum(manifest["datasets"][name]["rows"] for name in dfs)
+    print(f"[OK] Created {root.name}/ ({len(dfs)} datasets, {total_rows} rows) + manifest.json")
+    return manifest
+
+# 6 графиков: (запрос, тип, параметры, файл, заголовок)
+CHART_PLAN = [
+    ("q1_users_by_country", "pie",  dict(labels_col="country", values_col="user_count"),
+     "01_pie_users_by_country.png", "Users by Country"),
+    ("q2_events_by_genre", "bar",   dict(x="genre", y="event_count"),
+     "02_bar_events_by_genre.png", "Events by Genre"),
+    ("q3_top_artists_by_events", "barh", dict(y="artist", x="event_count"),
+     "03_barh_top_artists.png", "Top Artists by Events"),
+    ("q4_events_by_month", "line", dict(x="month", y="event_count"),
+     "04_line_events_by_month.png", "Events per Month"),
+    ("q5_user_age", "hist", dict(col="user_age", bins=10),
+     "05_hist_user_age.png", "User Age Distribution"),
+    ("q6_rating_vs_attendance", "scatter", dict(x="attended_events", y="avg_rating"),
+     "06_scatter_rating_vs_attendance.png", "Avg Rating vs Attended Events"),
+]
+
+def select(names: dict, wanted) -> dict:
+    """Оставляет только запрошенные имена (None — все); неизвестные имена — ошибка."""
+    if not wanted:
+        return names
+    unknown = [w for w in wanted if w not in names]
+    if unknown:
+        raise SystemExit(f"[ERROR] unknown name(s): {', '.join(unknown)}; "
+                         f"available: {', '.join(names)}")
+    return {k: v for k, v in names.items() if k in wanted}
+
+def chart_plan(charts=None) -> list:
+    """CHART_PLAN, отфильтрованный по имени запроса или файла графика (без .png)."""
+    if not charts:
+        return list(CHART_PLAN)
+    by_name = {}
+    for entry in CHART_PLAN:
+        by_name[entry[0]] = by_name[Path(entry[3]).stem] = entry
+    picked = select(by_name, charts)
+    return [entry for entry in CHART_PLAN if entry in picked.values()]
+
+def prepare_queries(e) -> dict:
+    """Запросы из SQL_FILE; запросы с актуальной сводкой (rollups.py) читают из неё.
+       Сводки здесь не обновляются — это делают загрузка и rollups.py по расписанию."""
     queries = load_queries(SQL_FILE)
+    raw = e.raw_connection()
+    try:
+        queries = rollups.redirect(queries, raw)
+    finally:
+        raw.close()
+    return queries
 
-    # 6 графиков
-    plan = [
-        ("q1_users_by_country", "pie",  dict(labels_col="country", values_col="user_count"),
-         "01_pie_users_by_country.png", "Users by Country"),
-        ("q2_events_by_genre", "bar",   dict(x="genre", y="event_count"),
-         "02_bar_events_by_genre.png", "Events by Genre"),
-        ("q3_top_artists_by_events", "barh", dict(y="artist", x="event_count"),
-         "03_barh_top_artists.png", "Top Artists by Events"),
-        ("q4_events_by_month", "line", dict(x="month", y="event_count"),
-         "04_line_events_by_month.png", "Events per Month"),
-        ("q5_user_age", "hist", dict(col="user_age", bins=10),
-         "05_hist_user_age.png", "User Age Distribution"),
-        ("q6_rating_vs_attendance", "scatter", dict(x="attended_events", y="avg_rating"),
-         "06_scatter_rating_vs_attendance.png", "Avg Rating vs Attended Events"),
-    ]
-
-    dfs_for_excel = {}
+def chart_jobs(e, queries: dict, dfs: dict, plan: list, hist_mode: str = "server",
+               scatter_mode: str = "auto", scatter_threshold: int = SCATTER_THRESHOLD) -> list:
+    """Задания для render_charts из готовых результатов dfs."""
+    import pandas as pd
 
-    # строим 6 графиков
+    jobs = []
     for qname, ctype, params, outfile, title in plan:
-        if qname not in queries:
+        if ctype == "hist" and hist_mode == "server" and qname in queries:
+            # гистограмма в server-режиме строится по отдельному агрегирующему запросу
+            sql = histogram_sql(queries[qname], params["col"], params["bins"])
+            try:
+                with instrumentation.query_name(f"{qname}:hist"):
+                    binned = query_cache.read_sql(sql, e)
+            except Exception as ex:
+                print(f"[ERROR] histogram {qname}: {ex}")
+                continue
+            jobs.append(("hist_binned", binned, params, CHARTS / outfile, title))
+            continue
+        if ctype == "scatter" and qname not in dfs and qname in queries:
+            try:
+                jobs.append((*scatter_job(e, qname, queries[qname], params, scatter_mode,
+                                          scatter_threshold), CHARTS / outfile, title))
+            except Exception as ex:
+                print(f"[ERROR] scatter {qname}: {ex}")
+            continue
+        if qname not in dfs:
             print(f"[WARN] {qname} not found in SQL file — skip")
             continue
-        df = pd.read_sql(queries[qname], e)
-        dfs_for_excel[qname] = df.copy()
-
-        if ctype == "pie":
-            pie_chart(df, fname=outfile, title=title, **params)
-        elif ctype == "bar":
-            bar_chart(df, fname=outfile, title=title, **params)
-        elif ctype == "barh":
-            barh_chart(df, fname=outfile, title=title, **params)
-        elif ctype == "line":
-            if "month" in df.columns:
-                df["month"] = pd.to_datetime(df["month"])
-            line_chart(df, fname=outfile, title=title, **params)
-        elif ctype == "hist":
-            hist_chart(df, fname=outfile, title=title, **params)
-        elif ctype == "scatter":
-            scatter_chart(df, fname=outfile, title=title, **params)
-
-    
-    for qname, sql in queries.items():
-        try:
-            df = pd.read_sql(sql, e)
-            dfs_for_excel[qname] = df
-            print(f"[Excel] Sheet {qname}: {len(df)} rows")
-        except Exception as ex:
-            print(f"[ERROR] query {qname}: {ex}")
-
-    export_to_excel(dfs_for_excel, filename=Path("report_assignment2.xlsx"))
+        df = dfs[qname]
+        if ctype == "line" and "month" in df.columns:
+            df = df.assign(month=pd.to_datetime(df["month"]))
+        if ctype == "scatter":
+            params = dict(params, mode=scatter_mode, threshold=scatter_threshold)
+        jobs.append((ctype, df, params, CHARTS / outfile, title))
+    return jobs
+
+def scatter_job(e, qname: str, sql: str, params: dict, mode: str = "auto",
+                threshold: int = SCATTER_THRESHOLD) -> tuple:
+    """(kind, df, params) для scatter без полного результата в памяти: density —
+       ячейки из grid2d_sql, sample — reservoir_sample по курсору, points — весь
+       результат (только если попросили явно или auto увидел <= threshold строк)."""
+    import pandas as pd
+
+    x, y = params["x"], params["y"]
+    if mode == "auto":
+        with instrumentation.query_name(f"{qname}:count"):
+            rows = int(query_cache.read_sql(count_sql(sql), e)["n"].iloc[0])
+        mode = "points" if rows <= threshold else "density"
+    if mode == "density":
+        with instrumentation.query_name(f"{qname}:grid"):
+            cells = query_cache.read_sql(grid2d_sql(sql, x, y, SCATTER_GRIDSIZE), e)
+        return "scatter_binned", cells, dict(x=x, y=y, gridsize=SCATTER_GRIDSIZE)
+    if mode == "sample":
+        xs, ys = reservoir_sample(query_cache.stream_sql(sql, e, name=f"{qname}:sample"), x, y, threshold)
+        return "scatter", pd.DataFrame({x: xs, y: ys}), dict(x=x, y=y, mode="points")
+    with instrumentation.query_name(qname):
+        df = query_cache.read_sql(sql, e)
+    return "scatter", df, dict(x=x, y=y, mode="points")
+
+def charted_queries(plan: list, hist_mode: str = "server") -> set:
+    """Запросы, результаты которых нужны графикам целиком. Server-гистограммы и
+       scatter сюда не входят: им хватает агрегата из SQL или потоковой выборки
+       (scatter_job). Остальные графики строятся по GROUP BY — строк в них по числу групп."""
+    return {q for q, ctype, *_ in plan
+            if ctype != "scatter" and not (ctype == "hist" and hist_mode == "server")}
+
+EXCEL_REPORT = "report_assignment2.xlsx"
+
+def excel_report_name(picked=None) -> str:
+    """Частичный экспорт (--queries) пишет отдельную книгу, иначе он затёр бы полный
+       отчёт, а полный этап в .cache/stages.json продолжал бы считаться выполненным."""
+    if not picked:
+        return EXCEL_REPORT
+    tag = hashlib.sha256(",".join(sorted(picked)).encode("utf-8")).hexdigest()[:8]
+    return f"{Path(EXCEL_REPORT).stem}_partial_{tag}.xlsx"
+
+def export(dfs: dict, fmt: str = "excel", excel_name: str = EXCEL_REPORT):
+    if fmt in ("excel", "both"):
+        export_to_excel(dfs, filename=Path(excel_name))
+    if fmt in ("parquet", "both"):
+        export_to_parquet(dfs, Path("parquet"))
+
+# этапы отчёта в профиле (profiling.py) и для --cprofile
+PROFILE_STAGES = ("prepare", "queries", "chart_data", "render", "export")
+
+def main():
+    parser = argparse.ArgumentParser(description="Charts + Excel report for sql/new_queries.sql")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="queries executed in parallel (and DB pool size)")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="processes used to render the charts (1 = serial, "
+                             f"0 = a pool only from {RENDER_POOL_MIN_CHARTS} charts)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always re-run the queries instead of using .cache/queries")
+    parser.add_argument("--format", choices=["excel", "parquet", "both"], default="excel",
+                        help="export target: the Excel report, Parquet datasets, or both")
+    parser.add_argument("--hist-mode", choices=["server", "client"], default="server",
+                        help="bin histograms in Postgres (server) or from raw rows (client)")
+    parser.add_argument("--scatter-mode", choices=["auto", "points", "density", "sample"],
+                        default="auto", help="how scatter charts draw large results")
+    parser.add_argument("--scatter-threshold", type=int, default=SCATTER_THRESHOLD,
+                        help="row count above which auto switches to density / sample size")
+    parser.add_argument("--stream", type=int, metavar="ROWS", default=0,
+                        help="stream exported queries that charts do not need in full through a "
+                             "server-side cursor in chunks of ROWS; with --format both they run once per target")
+    parser.add_argument("--profile", action="store_true",
+                        help="record wall/CPU time and peak memory per stage, query and chart "
+                             "into exports/profile_<time>.json")
+    parser.add_argument("--cprofile", choices=PROFILE_STAGES, metavar="STAGE",
+                        help="also run cProfile over one stage (implies --profile); "
+                             "use --render-workers 1 to profile rendering")
+    args = parser.parse_args()
+    if args.no_cache:
+        query_cache.ENABLED = False
+    if args.profile or args.cprofile:
+        profiling.start(cprofile_stage=args.cprofile)
+
+    ensure_dirs()
+    e = engine(args.workers)
+    with profiling.stage("prepare"):
+        queries = prepare_queries(e)
+    plan = chart_plan()
+
+    # каждый запрос — один раз; результаты идут и в графики, и в Excel
+    charted = charted_queries(plan, args.hist_mode)
+    if args.stream:
+        to_run = {q: sql for q, sql in queries.items() if q in charted}
+    else:
+        to_run = queries
+    with profiling.stage("queries"):
+        dfs_for_excel = run_queries(e, to_run, workers=args.workers)
+
+    # строим 6 графиков
+    with profiling.stage("chart_data"):
+        jobs = chart_jobs(e, queries, dfs_for_excel, plan, args.hist_mode,
+                          args.scatter_mode, args.scatter_threshold)
+    with profiling.stage("render"):
+        render_charts(jobs, workers=args.render_workers)
+
+    if args.stream:
+        # остальные запросы не материализуем: экспорт читает их кусками прямо из курсора
+        exported = {}
+        for q, sql in queries.items():
+            if q in dfs_for_excel:
+                exported[q] = dfs_for_excel[q]
+            elif q not in charted:
+                exported[q] = query_cache.StreamedQuery(sql, e, args.stream, name=q)
+        dfs_for_excel = exported
+
+    with profiling.stage("export"):
+        export(dfs_for_excel, args.format)
+    print_pool_status()
+    instrumentation.push("techno-analytics-report")
+    profiling.finish()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,22 @@
 import open3d as o3d
 import numpy as np
 import argparse
+import sys
+from pathlib import Path
 
-def main():
-    parser = argparse.ArgumentParser(description="Assignment 5 — Part 1 & 2")
-    parser.add_argument("model_path", help="Path to 3D file (ply/obj/stl, etc.)")
-    args = parser.parse_args()
+# step_output.py лежит в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from step_output import FORMATS, StepOutput  # noqa: E402
+
+
+def run(model_path, out: StepOutput = None) -> dict:
+    """Шаги 1–5 для одной модели; out — окно Open3D или файлы + stats.json (headless)."""
+    out = out or StepOutput(model_path, pipeline="assignment5")
 
     # === Step 1: Load original mesh ===
-    mesh = o3d.io.read_triangle_mesh(args.model_path)
+    # без mesh_cache (он только для assn5.py): кэш хранит меш после чистки trimesh
+    # без текстур, а здесь Step 1 показывает модель как есть, с текстурами/материалами
+    mesh = o3d.io.read_triangle_mesh(str(model_path))
     mesh.compute_vertex_normals()
 
     print("\nStep 1: Original Mesh")
@@ -18,7 +26,7 @@ def main():
     print(f"Has normals: {mesh.has_vertex_normals()}")
     print(f"Has textures/materials: {mesh.has_textures()}")
 
-    o3d.visualization.draw_geometries([mesh], window_name="Original Model")
+    out.show("step1_original", "Original Model", [mesh])
 
     # === Step 2: Sampling to Point Cloud ===
     print("\nStep 2: Sampling to Point Cloud")
@@ -28,7 +36,7 @@ def main():
     print(f"Has colors: {pcd.has_colors()}")
     print(f"Has normals: {pcd.has_normals()}")
 
-    o3d.visualization.draw_geometries([pcd], window_name="Point Cloud")
+    out.show("step2_point_cloud", "Point Cloud", [pcd])
 
 
         # === Step 3: Surface Reconstruction ===
@@ -48,7 +56,7 @@ def main():
 
     print(f"Reconstructed mesh: {len(mesh_rec.vertices)} vertices, {len(mesh_rec.triangles)} triangles")
 
-    o3d.visualization.draw_geometries([mesh_rec], window_name="Step 3: Reconstructed Surface")
+    out.show("step3_reconstruction", "Step 3: Reconstructed Surface", [mesh_rec])
 
 
         # === Step 4: Mesh Simplification ===
@@ -64,10 +72,7 @@ def main():
     print(f"Simplified mesh: {len(mesh_simplified.vertices)} vertices, {len(mesh_simplified.triangles)} triangles")
 
     # Визуализация
-    o3d.visualization.draw_geometries(
-        [mesh_simplified],
-        window_name="Step 4: Simplified Mesh"
-    )
+    out.show("step4_simplified", "Step 4: Simplified Mesh", [mesh_simplified])
 
 
         # === Step 5: Voxelization ===
@@ -84,11 +89,22 @@ def main():
     print(f"Number of voxels: {len(voxel_grid.get_voxels())}")
 
     # Визуализация
-    o3d.visualization.draw_geometries(
-        [voxel_grid],
-        window_name="Step 5: Voxelized Model"
-    )
+    out.note(voxel_size=voxel_size, voxels=len(voxel_grid.get_voxels()))
+    out.show("step5_voxels", "Step 5: Voxelized Model", [voxel_grid])
+
+    out.finish()
+    return out.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assignment 5 — Part 1 & 2")
+    parser.add_argument("model_path", help="Path to 3D file (ply/obj/stl, etc.)")
+    parser.add_argument("--headless", metavar="OUTDIR",
+                        help="no windows: write each step's geometry and stats.json to OUTDIR/<model>/")
+    parser.add_argument("--format", choices=FORMATS, default="ply", help="geometry file format in headless mode")
+    args = parser.parse_args()
 
+    run(args.model_path, StepOutput(args.model_path, args.headless, args.format, pipeline="assignment5"))
 
 
 if __name__ == "__main__":
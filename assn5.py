@@ -1,15 +1,24 @@
-import sys
+import argparse
+import shutil
+import tempfile
 from pathlib import Path
 
 import numpy as np
 import open3d as o3d
-import trimesh
+
+import mesh_cache
+from memmap_cloud import MemmapCloud, z_gradient_colors
+from step_output import FORMATS, StepOutput
+from voxel_modes import VOXEL_MODES
+from voxels import VOXEL_MESHERS, colormap01, voxel_size_for, voxelize_points
 
 # ================== CONFIG ==================
 
 POINTS_FOR_SAMPLING = 15000
 PLANE_NORMAL = np.array([1.0, 0.0, 0.0])
 PLANE_OFFSET = 0.0  # плоскость x = 0
+RECON_MAX_POINTS = 500_000  # Step 3 в --ooc: Poisson по прореженному облаку (to_o3d)
+GREEDY_COLOR_LEVELS = 32  # в greedy цвет квантуется, иначе соседние грани почти никогда не равны
 
 # ================== HELPERS ==================
 
@@ -29,33 +38,24 @@ def print_mesh_info(title, mesh: o3d.geometry.TriangleMesh):
     print(f"Has normals: {mesh.has_vertex_normals()}")
 
 
-def print_pcd_info(title, pcd: o3d.geometry.PointCloud):
+def print_pcd_info(title, pcd):
+    """pcd — o3d.geometry.PointCloud или MemmapCloud (--ooc: нормалей там нет)."""
     print(f"\n=== {title} ===")
+    if isinstance(pcd, MemmapCloud):
+        print(f"Points: {len(pcd)} (memory-mapped, {pcd.path})")
+        print(f"Has colors: {pcd.colors is not None}")
+        print("Has normals: False")
+        return
     print(f"Points: {len(pcd.points)}")
     print(f"Has colors: {pcd.has_colors()}")
     print(f"Has normals: {pcd.has_normals()}")
 
 
-def load_and_triangulate(model_path: Path) -> Path:
-    """Загружает модель через trimesh, триангулирует и сохраняет во временный *_tri.obj."""
+def load_and_triangulate(model_path: Path) -> o3d.geometry.TriangleMesh:
+    """Загружает модель через trimesh, триангулирует и чистит. Результат кэшируется
+       по содержимому файла (mesh_cache.py): повторный запуск читает готовые массивы."""
     print(f"🔹 Loading model: {model_path}")
-    mesh = trimesh.load(model_path, force="mesh")
-
-    if hasattr(mesh, "triangulate"):
-        mesh = mesh.triangulate()
-        print("✅ Triangulated successfully.")
-    else:
-        print("⚠️ Triangulation not available.")
-
-    # лёгкая чистка
-    mesh.remove_infinite_values()
-    mesh.remove_duplicate_faces()
-    mesh.remove_degenerate_faces()
-
-    out_path = model_path.with_name(model_path.stem + "_tri.obj")
-    mesh.export(out_path)
-    print(f"✅ Saved cleaned mesh → {out_path.name}")
-    return out_path
+    return mesh_cache.load_mesh(model_path)
 
 
 def make_sphere(center, radius=0.05, color=(1.0, 0.0, 0.0)):
@@ -82,82 +82,43 @@ def make_arrow_at(center, length=0.25, color=(1.0, 0.0, 0.0)):
     return arr
 
 
-# -------- Colorful voxel helpers (для Step 4) --------
+# -------- Colorful voxel (Step 4) --------
 
-def _colormap01(t: np.ndarray) -> np.ndarray:
-    """Простой градиент R→Y→G→C→B для значений 0..1."""
-    t = np.clip(t, 0.0, 1.0)
-    c = np.zeros((t.size, 3), float)
-    seg = np.minimum(4, (t * 4).astype(int))
-    w = (t * 4) - seg
-
-    # R(1,0,0)->Y(1,1,0)
-    m = seg == 0
-    c[m] = np.stack([np.ones(m.sum()), w[m], np.zeros(m.sum())], 1)
-    # Y(1,1,0)->G(0,1,0)
-    m = seg == 1
-    c[m] = np.stack([1.0 - w[m], np.ones(m.sum()), np.zeros(m.sum())], 1)
-    # G(0,1,0)->C(0,1,1)
-    m = seg == 2
-    c[m] = np.stack([np.zeros(m.sum()), np.ones(m.sum()), w[m]], 1)
-    # C(0,1,1)->B(0,0,1)
-    m = seg >= 3
-    c[m] = np.stack([np.zeros(m.sum()), 1.0 - w[m], np.ones(m.sum())], 1)
-    return c
-
-
-def build_colored_voxel_mesh_from_pcd(pcd: o3d.geometry.PointCloud) -> tuple[o3d.geometry.TriangleMesh, float, int]:
+def build_colored_voxel_mesh_from_pcd(pcd: o3d.geometry.PointCloud, mode: str = "cubes",
+                                      cloud: MemmapCloud = None) -> tuple[o3d.geometry.TriangleMesh, float, int]:
     """
     Делает «LEGO»-представление: кубик на каждый занятый воксель.
     Цвет кубика — по средней высоте Z в этом вокселе.
+    mode — см. VOXEL_MESHERS: форма и цвета у всех трёх одни, но surface/greedy
+    не создают внутренних граней (затенение у рёбер может отличаться — другие нормали).
+    cloud — те же точки в MemmapCloud (--ooc): тогда статистика считается блоками.
     Возвращает (меш, voxel_size, num_voxels).
     """
-    pts = np.asarray(pcd.points)
-    if pts.size == 0:
-        raise RuntimeError("Point cloud is empty for voxelization")
-
-    # подберём размер вокселя ≈ 30 кубиков по максимальному измерению
-    bb = pcd.get_axis_aligned_bounding_box()
-    diag = bb.get_max_bound() - bb.get_min_bound()
-    max_dim = float(diag.max())
-    voxel_size = max_dim / 30.0  # можно поменять на 20.0 для более крупных кубиков
-
-    origin = pts.min(axis=0)
-    ijk = np.floor((pts - origin) / voxel_size).astype(np.int32)
+    if cloud is not None:
+        if len(cloud) == 0:
+            raise RuntimeError("Point cloud is empty for voxelization")
+        voxel_size = cloud.voxel_size_for(cubes=30.0)
+        stats = cloud.voxelize(voxel_size)
+    else:
+        pts = np.asarray(pcd.points)
+        if pts.size == 0:
+            raise RuntimeError("Point cloud is empty for voxelization")
 
-    keys, inv = np.unique(ijk, axis=0, return_inverse=True)
-    num_vox = len(keys)
+        # подберём размер вокселя ≈ 30 кубиков по максимальному измерению
+        voxel_size = voxel_size_for(pts, cubes=30.0)  # можно поменять на 20.0 для более крупных кубиков
 
-    # средний Z по каждому вокселю
-    z_mean = np.zeros(num_vox, float)
-    for k in range(num_vox):
-        z_mean[k] = pts[inv == k, 2].mean()
+        # средний / min / max Z и число точек по каждому вокселю — одной группировкой
+        stats = voxelize_points(pts, voxel_size)
+    num_vox = len(stats.keys)
 
     # нормируем Z для цвета
-    z0, z1 = z_mean.min(), z_mean.max()
-    z_norm = (z_mean - z0) / (z1 - z0 + 1e-12)
-    colors = _colormap01(z_norm)
-
-    # базовый куб (единичный)
-    base_box = o3d.geometry.TriangleMesh.create_box(1.0, 1.0, 1.0)
-    vb = np.asarray(base_box.vertices)
-    tb = np.asarray(base_box.triangles)
-
-    all_v = []
-    all_f = []
-    all_c = []
+    z0, z1 = stats.mean.min(), stats.mean.max()
+    z_norm = (stats.mean - z0) / (z1 - z0 + 1e-12)
+    if mode == "greedy":
+        z_norm = np.round(z_norm * (GREEDY_COLOR_LEVELS - 1)) / (GREEDY_COLOR_LEVELS - 1)
+    colors = colormap01(z_norm)
 
-    for idx, (cell, col) in enumerate(zip(keys, colors)):
-        center = origin + (cell + 0.5) * voxel_size
-        verts = vb * voxel_size + (center - 0.5 * voxel_size)
-
-        all_v.append(verts)
-        all_f.append(tb + idx * len(vb))
-        all_c.append(np.tile(col, (len(vb), 1)))
-
-    V = np.vstack(all_v)
-    F = np.vstack(all_f)
-    C = np.vstack(all_c)
+    V, F, C = VOXEL_MESHERS[mode](stats.keys, stats.origin, voxel_size, colors)
 
     vox_mesh = o3d.geometry.TriangleMesh(
         o3d.utility.Vector3dVector(V),
@@ -170,32 +131,58 @@ def build_colored_voxel_mesh_from_pcd(pcd: o3d.geometry.PointCloud) -> tuple[o3d
 
 # ================== MAIN PIPELINE ==================
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python ass5.py <path/to/12219_boat_v2_L2.obj>")
-        sys.exit(1)
-
-    model_path = Path(sys.argv[1])
-    if not model_path.exists():
-        raise FileNotFoundError(f"Model not found: {model_path}")
-
+def run(model_path: Path, voxel_mode: str = "cubes", out: StepOutput = None, ooc: bool = False,
+        points_npy: Path = None) -> dict:
+    """Шаги 1–7 для одной модели. out решает, куда идёт геометрия шага:
+       окно Open3D (по умолчанию) или файлы + stats.json (headless, см. batch3d.py).
+       ooc — облако точек в memmap-файлах, Steps 4, 6, 7 блоками (memmap_cloud.py);
+       points_npy — облако Step 2 из (N, 3) .npy вместо сэмплинга меша (включает ooc)."""
+    out = out or StepOutput(model_path, pipeline="assn5")
+    if not (ooc or points_npy):
+        return _run_steps(model_path, voxel_mode, out)
+    if out.headless:
+        # в headless файлы облака остаются рядом с результатами шагов
+        return _run_steps(model_path, voxel_mode, out, out.dir / "ooc", points_npy)
+    work = Path(tempfile.mkdtemp(prefix="assn5_ooc_"))
+    try:
+        return _run_steps(model_path, voxel_mode, out, work, points_npy)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _run_steps(model_path: Path, voxel_mode: str, out: StepOutput, work: Path = None,
+               points_npy: Path = None) -> dict:
+    """work — каталог memmap-облаков (--ooc) или None: всё в памяти."""
     # ---- Step 1: загрузка + триангуляция ----
-    tri_path = load_and_triangulate(model_path)
-    mesh = o3d.io.read_triangle_mesh(str(tri_path))
+    mesh = load_and_triangulate(model_path)
     if mesh.is_empty():
         raise RuntimeError("Failed to load mesh")
     mesh.compute_vertex_normals()
     mesh = center_geometry(mesh)
     print_mesh_info("Step 1 : Original Mesh", mesh)
-    o3d.visualization.draw_geometries([mesh], window_name="Step 1 – Original Model")
+    out.show("step1_original", "Step 1 – Original Model", [mesh])
 
     # ---- Step 2: Point Cloud ----
-    pcd = mesh.sample_points_poisson_disk(POINTS_FOR_SAMPLING)
-    print_pcd_info("Step 2 : Point Cloud (from mesh)", pcd)
-    o3d.visualization.draw_geometries([pcd], window_name="Step 2 – Point Cloud")
+    cloud = None
+    if points_npy:
+        # облако может быть больше RAM: копия блоками прямо из mmap входного файла
+        cloud = MemmapCloud.from_array(np.load(points_npy, mmap_mode="r"), work / "points")
+        title = f"Step 2 : Point Cloud (from {Path(points_npy).name})"
+    else:
+        pcd = mesh.sample_points_poisson_disk(POINTS_FOR_SAMPLING)
+        title = "Step 2 : Point Cloud (from mesh)"
+        if work is not None:
+            cloud = MemmapCloud.from_array(np.asarray(pcd.points), work / "points")
+            del pcd  # дальше облако живёт только в memmap
+    step2 = cloud if cloud is not None else pcd
+    print_pcd_info(title, step2)
+    out.show("step2_point_cloud", "Step 2 – Point Cloud", [step2])
 
     # ---- Step 3: Surface Reconstruction (Poisson) ----
     print("\n=== Step 3 : Surface Reconstruction (Poisson) ===")
+    if cloud is not None:
+        # Poisson в Open3D работает в памяти: большое облако прореживается
+        pcd = cloud.to_o3d(max_points=RECON_MAX_POINTS)
     pcd.estimate_normals()
     mesh_rec, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
         pcd, depth=6
@@ -206,18 +193,16 @@ def main():
     mesh_rec.compute_vertex_normals()
     mesh_rec = center_geometry(mesh_rec)
     print_mesh_info("Step 3 : Reconstructed Mesh", mesh_rec)
-    o3d.visualization.draw_geometries(
-        [mesh_rec], window_name="Step 3 – Reconstructed Surface"
-    )
+    out.show("step3_reconstruction", "Step 3 – Reconstructed Surface", [mesh_rec])
 
     # ---- Step 4: Colorful Voxelization (исправленный) ----
-    vox_mesh, voxel_size, num_vox = build_colored_voxel_mesh_from_pcd(pcd)
+    vox_mesh, voxel_size, num_vox = build_colored_voxel_mesh_from_pcd(pcd, mode=voxel_mode, cloud=cloud)
     print(f"\n=== Step 4 : Colorful Voxelization ===")
     print(f"Voxel size = {voxel_size:.3f}, Voxels (cubes) = {num_vox}")
+    print(f"Mode = {voxel_mode}: {len(vox_mesh.vertices)} vertices, {len(vox_mesh.triangles)} triangles")
     print("Presence of color: True (vertex_colors on voxel mesh)")
-    o3d.visualization.draw_geometries(
-        [vox_mesh], window_name="Step 4 – Colorful Voxel Grid"
-    )
+    out.note(voxel_size=voxel_size, voxels=num_vox, voxel_mode=voxel_mode)
+    out.show("step4_voxels", "Step 4 – Colorful Voxel Grid", [vox_mesh])
 
     # ---- Step 5: Plane ----
     plane_size = 1.2 * np.max(mesh.get_max_bound() - mesh.get_min_bound())
@@ -237,44 +222,49 @@ def main():
     )
     plane.paint_uniform_color([0.8, 0.8, 0.2])
     plane.compute_vertex_normals()
-    o3d.visualization.draw_geometries(
-        [mesh_rec, plane], window_name="Step 5 – Plane Added"
-    )
+    out.show("step5_plane", "Step 5 – Plane Added", [mesh_rec, plane])
 
     # ---- Step 6: Clipping ----
     p0 = np.array([PLANE_OFFSET, 0.0, 0.0])
     n = PLANE_NORMAL / np.linalg.norm(PLANE_NORMAL)
-    pts = np.asarray(pcd.points)
-    side = (pts - p0) @ n
-    keep_idx = np.where(side <= 0)[0]
-    pcd_clipped = pcd.select_by_index(keep_idx)
+    if cloud is not None:
+        clipped = cloud.clip_plane(p0, n, work / "clipped")
+        pcd_clipped = clipped  # в файл шага — всё облако, в окно — to_o3d() (StepOutput)
+    else:
+        pts = np.asarray(pcd.points)
+        side = (pts - p0) @ n
+        keep_idx = np.where(side <= 0)[0]
+        pcd_clipped = pcd.select_by_index(keep_idx)
     print_pcd_info("Step 6 : Clipped Point Cloud", pcd_clipped)
-    o3d.visualization.draw_geometries(
-        [pcd_clipped, plane], window_name="Step 6 – After Clipping"
-    )
+    out.show("step6_clipped", "Step 6 – After Clipping", [pcd_clipped, plane])
 
         # ---- Step 7: Gradient + visible min/max (IMPROVED) ----
     # ---- Step 7: Gradient + visible min/max (IMPROVED) ----
     # ---- Step 7: Gradient + Visible Min/Max (CUBE MARKERS) ----
     # ---- Step 7: Gradient + LARGE Visible Min/Max ----
-    pts = np.asarray(pcd_clipped.points)
-    if pts.size == 0:
-        raise RuntimeError("No points after clipping — adjust PLANE_OFFSET.")
+    if cloud is not None:
+        if len(clipped) == 0:
+            raise RuntimeError("No points after clipping — adjust PLANE_OFFSET.")
+        z_min, z_max, p_min, p_max = clipped.z_extremes()
+        clipped.write_z_gradient_colors(z_min, z_max)
+    else:
+        pts = np.asarray(pcd_clipped.points)
+        if pts.size == 0:
+            raise RuntimeError("No points after clipping — adjust PLANE_OFFSET.")
 
-    z = pts[:, 2]
-    z_min, z_max = float(z.min()), float(z.max())
-    z_norm = (z - z_min) / (z_max - z_min + 1e-12)
+        z = pts[:, 2]
+        z_min, z_max = float(z.min()), float(z.max())
 
-# Color gradient
-    colors = np.vstack([z_norm, 0.3*np.ones_like(z_norm), 1.0 - z_norm]).T
-    pcd_clipped.colors = o3d.utility.Vector3dVector(colors)
+        # Color gradient
+        pcd_clipped.colors = o3d.utility.Vector3dVector(z_gradient_colors(z, z_min, z_max))
 
-    imin, imax = int(np.argmin(z)), int(np.argmax(z))
-    p_min, p_max = pts[imin], pts[imax]
+        imin, imax = int(np.argmin(z)), int(np.argmax(z))
+        p_min, p_max = pts[imin], pts[imax]
 
     print("\n=== Step 7 : Color & Extremes ===")
     print(f"Z min = {z_min:.4f}  at {p_min}")
     print(f"Z max = {z_max:.4f}  at {p_max}")
+    out.note(z_min=z_min, z_max=z_max, p_min=p_min, p_max=p_max)
 
 # A) VERY LARGE cubes (always visible)
     def big_cube(center, size=50, color=(1,0,0)):
@@ -338,14 +328,14 @@ def main():
     arrow_max = arrow(p_max, direction=np.array([0,0,1]),  length=150, color=(0,1,0))
 
 # D) Show everything together
-    o3d.visualization.draw_geometries([
+    out.show("step7_extremes", "Step 7 – BIG VISIBLE Min/Max Markers", [
         pcd_clipped,
         plane,
         cube_min, cube_max,
         panel_min, panel_max,
         arrow_min[0], arrow_min[1],
         arrow_max[0], arrow_max[1]
-    ], window_name="Step 7 – BIG VISIBLE Min/Max Markers")
+    ])
 
     # ---- краткое summary ----
     print("\n✅ Interpretation for defense:")
@@ -357,6 +347,35 @@ def main():
     print("6) Clipped points by plane (kept one side only).")
     print("7) Colored points by Z, marked minimal & maximal height with spheres and arrows.")
 
+    out.finish()
+    return out.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assignment 5 — 3D pipeline (Open3D)")
+    parser.add_argument("model_path", help="path/to/12219_boat_v2_L2.obj")
+    parser.add_argument("--voxel-mode", choices=VOXEL_MODES, default="cubes",
+                        help="Step 4 mesh: full cubes, exposed faces only, or exposed faces merged into strips")
+    parser.add_argument("--headless", metavar="OUTDIR",
+                        help="no windows: write each step's geometry and stats.json to OUTDIR/<model>/")
+    parser.add_argument("--no-mesh-cache", action="store_true",
+                        help="always re-run trimesh cleaning in Step 1 (do not read or write .cache/meshes)")
+    parser.add_argument("--ooc", action="store_true",
+                        help="keep the point cloud in memory-mapped .npy files and run Steps 4, 6, 7 in blocks")
+    parser.add_argument("--points-npy", metavar="PATH",
+                        help="(N, 3) float .npy used as the Step 2 point cloud instead of sampling the "
+                             "mesh; read through mmap, so it can be larger than RAM (implies --ooc)")
+    parser.add_argument("--format", choices=FORMATS, default="ply", help="geometry file format in headless mode")
+    args = parser.parse_args()
+    if args.no_mesh_cache:
+        mesh_cache.ENABLED = False
+
+    model_path = Path(args.model_path)
+    if not model_path.exists():
+        raise FileNotFoundError(f"Model not found: {model_path}")
+    run(model_path, args.voxel_mode, StepOutput(model_path, args.headless, args.format, pipeline="assn5"),
+        ooc=args.ooc, points_npy=args.points_npy)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+"""Пакетная обработка 3D-моделей без окон: каждая модель — в своём процессе.
+
+    python batch3d.py models/ --out exports/3d --workers 8
+    python batch3d.py a.obj b.ply --pipeline assignment5 --format npz
+
+Для каждой модели assn5.run() (или assignment5/main.py) в headless-режиме пишет
+геометрию шагов и stats.json в OUT/<модель>/, вывод скрипта — в OUT/<модель>/run.log.
+В конце — OUT/batch_<время>.json: время по моделям, моделей в час и эффективность
+параллельности (сумма времени моделей / (wall × воркеры)).
+
+Open3D распараллеливает часть шагов через OpenMP: при N процессах на N ядрах это
+только мешает, поэтому в воркерах OMP_NUM_THREADS = --threads (по умолчанию 1)
+выставляется до импорта open3d. Большие файлы отправляются первыми, чтобы в конце
+не ждать одну долгую модель.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+from voxel_modes import VOXEL_MODES
+
+MODEL_SUFFIXES = {".obj", ".ply", ".stl", ".off", ".glb", ".gltf"}
+PIPELINES = ("assn5", "assignment5")
+
+
+def find_models(paths: list) -> list:
+    """Файлы моделей из путей и каталогов; *_tri.obj (артефакты Step 1) пропускаются."""
+    found = []
+    for p in map(Path, paths):
+        candidates = sorted(p.rglob("*")) if p.is_dir() else [p]
+        for f in candidates:
+            if f.is_file() and f.suffix.lower() in MODEL_SUFFIXES and not f.stem.endswith("_tri"):
+                found.append(f)
+    # самые тяжёлые — вперёд
+    return sorted(set(found), key=lambda f: f.stat().st_size, reverse=True)
+
+
+def _init_worker(threads: int):
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+
+def process_model(model: str, out_dir: str, pipeline: str, fmt: str, voxel_mode: str) -> dict:
+    """Выполняется в воркере: один пайплайн для одной модели, stdout — в run.log."""
+    import open3d as o3d
+
+    from step_output import StepOutput
+
+    o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Error)
+    model = Path(model)
+    out = StepOutput(model, out_dir, fmt, pipeline=pipeline)
+    t = time.perf_counter()
+    with open(out.dir / "run.log", "w", encoding="utf-8") as log, redirect_stdout(log):
+        if pipeline == "assn5":
+            import assn5
+            stats = assn5.run(model, voxel_mode, out)
+        else:
+            from assignment5 import main as assignment5_main
+            stats = assignment5_main.run(model, out)
+    return dict(model=str(model), seconds=round(time.perf_counter() - t, 3),
+                stats=str(out.dir / "stats.json"), steps=len(stats["steps"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch run of the 3D pipeline over many models")
+    parser.add_argument("paths", nargs="+", help="model files and/or directories (searched recursively)")
+    parser.add_argument("--out", default="exports/3d", help="output directory")
+    parser.add_argument("--pipeline", choices=PIPELINES, default="assn5")
+    parser.add_argument("--format", choices=("ply", "npz"), default="ply", help="geometry file format")
+    parser.add_argument("--voxel-mode", choices=VOXEL_MODES, default="surface",
+                        help="Step 4 mesh for assn5 (surface: same shape and colors, far fewer triangles)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes")
+    parser.add_argument("--threads", type=int, default=1, help="OpenMP threads per process")
+    args = parser.parse_args()
+
+    models = find_models(args.paths)
+    if not models:
+        print("[WARN] No model files found")
+        return
+    stems = [m.stem for m in models]
+    if len(set(stems)) != len(stems):
+        # OUT/<модель>/ — по имени файла, одинаковые имена затёрли бы друг друга
+        dups = sorted({s for s in stems if stems.count(s) > 1})
+        raise SystemExit(f"[ERROR] Duplicate model names: {', '.join(dups)}")
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    workers = max(1, min(args.workers, len(models)))
+    print(f"[OK] {len(models)} models, {workers} workers x {args.threads} threads -> {out_dir}")
+
+    results, failed = [], []
+    t0 = time.perf_counter()
+    # spawn: воркеры не наследуют состояние OpenMP/Open3D родителя
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                             initializer=_init_worker, initargs=(args.threads,)) as pool:
+        futures = {pool.submit(process_model, str(m), str(out_dir), args.pipeline,
+                               args.format, args.voxel_mode): m for m in models}
+        for fut in as_completed(futures):
+            model = futures[fut]
+            try:
+                r = fut.result()
+            except Exception as ex:
+                failed.append(dict(model=str(model), error=f"{type(ex).__name__}: {ex}"))
+                print(f"[ERROR] {model.name}: {ex}")
+                continue
+            results.append(r)
+            print(f"[OK] {model.name}: {r['seconds']:.1f}s ({len(results) + len(failed)}/{len(models)})")
+    wall = time.perf_counter() - t0
+
+    busy = sum(r["seconds"] for r in results)
+    summary = dict(
+        finished_at=datetime.now().isoformat(timespec="seconds"),
+        pipeline=args.pipeline,
+        workers=workers,
+        threads=args.threads,
+        wall_s=round(wall, 3),
+        models_ok=len(results),
+        models_failed=len(failed),
+        models_per_hour=round(len(results) * 3600 / wall, 1) if wall else None,
+        parallel_efficiency=round(busy / (wall * workers), 3) if wall else None,
+        models=results,
+        failed=failed,
+    )
+    path = out_dir / f"batch_{datetime.now():%Y%m%d_%H%M%S}.json"
+    path.write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"[OK] {len(results)} ok, {len(failed)} failed in {wall:.1f}s — "
+          f"{summary['models_per_hour']} models/hour, efficiency {summary['parallel_efficiency']} -> {path.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,715 @@
+"""Бенчмарки для отчёта: python bench.py <name> [--n N].
+
+Бенчмарки работают на синтетических данных и не требуют базы (sql-metrics —
+на sqlite в памяти); проверки (hist-parity, load-memory, copy) запускаются против настоящей базы
+с данными из archive/; partitions и reschedule создают в ней свои временные схемы.
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+
+
+def timed(fn, *args, **kwargs) -> float:
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def bench_render(n: int):
+    """Последовательный рендер vs пул процессов на n графиках."""
+    import os
+
+    import numpy as np
+    import pandas as pd
+
+    import analytics
+
+    rng = np.random.default_rng(0)
+    cats = pd.DataFrame({"name": [f"c{i}" for i in range(12)], "value": rng.integers(1, 100, 12)})
+    months = pd.DataFrame({"month": pd.date_range("2020-01-01", periods=48, freq="MS"),
+                           "value": rng.integers(0, 50, 48)})
+    points = pd.DataFrame({"x": rng.normal(size=5000), "y": rng.normal(size=5000)})
+    specs = [
+        ("pie", cats, dict(labels_col="name", values_col="value")),
+        ("bar", cats, dict(x="name", y="value")),
+        ("barh", cats, dict(y="name", x="value")),
+        ("line", months, dict(x="month", y="value")),
+        ("hist", points, dict(col="x", bins=30)),
+        ("scatter", points, dict(x="x", y="y")),
+    ]
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = []
+        for i in range(n):
+            kind, df, params = specs[i % len(specs)]
+            jobs.append((kind, df, params, Path(tmp) / f"{i:04d}_{kind}.png", f"chart {i}"))
+        serial = timed(analytics.render_charts, jobs, workers=1)
+        pooled = timed(analytics.render_charts, jobs, workers=workers)
+    print(f"\nrender {n} charts: serial {serial:.2f}s, "
+          f"pool({workers}) {pooled:.2f}s, speedup x{serial / pooled:.1f}")
+
+
+def bench_export(n: int):
+    """Excel-отчёт vs Parquet-датасеты: запись, чтение и размер на диске."""
+    import numpy as np
+    import pandas as pd
+
+    import analytics
+
+    rng = np.random.default_rng(0)
+    countries = np.array(["Germany", "USA", "Netherlands", "UK", "Belgium", "Kazakhstan"])
+    df = pd.DataFrame({
+        "artist": np.array([f"artist {i}" for i in range(500)])[rng.integers(0, 500, n)],
+        "country": countries[rng.integers(0, len(countries), n)],
+        "attendance": rng.integers(0, 10_000, n),
+    })
+    dfs = {"q10_artist_popularity_by_country": df}
+    with tempfile.TemporaryDirectory() as tmp:
+        xlsx = Path(tmp) / "report.xlsx"
+        pq_dir = Path(tmp) / "parquet"
+        w_xlsx = timed(analytics.export_to_excel, dfs, xlsx)
+        w_pq = timed(analytics.export_to_parquet, dfs, pq_dir)
+        r_xlsx = timed(pd.read_excel, xlsx, sheet_name=None)
+        r_pq = timed(pd.read_parquet, pq_dir / "q10_artist_popularity_by_country")
+        size_xlsx = xlsx.stat().st_size
+        size_pq = sum(p.stat().st_size for p in pq_dir.rglob("*.parquet"))
+    print(f"\n{n} rows      write     read      size")
+    print(f"excel      {w_xlsx:7.2f}s {r_xlsx:7.2f}s {size_xlsx / 1e6:8.2f} MB")
+    print(f"parquet    {w_pq:7.2f}s {r_pq:7.2f}s {size_pq / 1e6:8.2f} MB")
+
+
+def bench_scatter(n: int):
+    """Время рендера scatter по режимам при росте числа точек до n."""
+    import numpy as np
+    import pandas as pd
+
+    import analytics
+
+    rng = np.random.default_rng(0)
+    sizes = [s for s in (10_000, 100_000, 1_000_000, 10_000_000) if s <= n] or [n]
+    print(f"\n{'points':>10} {'points-mode':>12} {'density':>10} {'sample':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            df = pd.DataFrame({"attended_events": rng.poisson(5, size),
+                               "avg_rating": rng.normal(3, 1, size).clip(0, 5)})
+            row = []
+            for mode in ("points", "density", "sample"):
+                if mode == "points" and size > 1_000_000:
+                    row.append("   skipped")
+                    continue
+                job = ("scatter", df, dict(x="attended_events", y="avg_rating", mode=mode),
+                       Path(tmp) / f"{mode}.png", mode)
+                row.append(f"{timed(analytics.render_chart, job):9.2f}s")
+            print(f"{size:>10} {row[0]:>12} {row[1]:>10} {row[2]:>10}")
+
+
+def check_hist_parity(bins: int):
+    """Гистограмма из SQL-корзин должна совпасть с клиентской до пикселя."""
+    import numpy as np
+
+    import analytics
+    import query_cache
+    from chart_sql import histogram_from_bins, histogram_sql
+
+    e = analytics.engine(1)
+    queries = analytics.load_queries(analytics.SQL_FILE)
+    name, col = "q5_rating_distribution", "rate"
+    raw = query_cache.read_sql(queries[name], e)
+    binned = query_cache.read_sql(histogram_sql(queries[name], col, bins), e)
+
+    edges_c, counts_c = np.histogram(raw[col].dropna().astype(float), bins=bins)
+    edges_s, counts_s = histogram_from_bins(binned, bins)
+    same_bins = np.allclose(edges_c, edges_s) and np.array_equal(counts_c, counts_s)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client_png, server_png = Path(tmp) / "client.png", Path(tmp) / "server.png"
+        analytics.render_chart(("hist", raw, dict(col=col, bins=bins), client_png, name))
+        analytics.render_chart(("hist_binned", binned, dict(col=col, bins=bins), server_png, name))
+        same_png = client_png.read_bytes() == server_png.read_bytes()
+
+    print(f"{name}: {len(raw)} raw rows -> {len(binned)} bins from SQL")
+    print(f"bins/counts equal: {same_bins}, rendered PNG identical: {same_png}")
+    if not (same_bins and same_png):
+        raise SystemExit(1)
+
+
+def _write_users_csv(path: Path, rows: int = None, max_bytes: int = None) -> int:
+    """Синтетический users.csv (заголовок из archive/) до rows строк или max_bytes байт,
+       блоками по 10 000 строк; каждая третья bio — NULL. Возвращает число строк."""
+    header = (BASE / "archive" / "users.csv").open(encoding="utf-8").readline()
+    row = ('{0},user{0},"User {0}",user{0}@example.com,AQAAAAIAAYagAAAAEMWwMqqz7D3wBOnxjrWMi2Nu7J,'
+           '{1},{2},"2024-01-12 02:56:57.437370"\n')
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(header)
+        i = 0
+        while (rows is None or i < rows) and (max_bytes is None or f.tell() < max_bytes):
+            block = 10_000 if rows is None else min(10_000, rows - i)
+            f.write("".join(row.format(i + k, (i + k) % 7 + 1, "NULL" if k % 3 else '"some bio"')
+                            for k in range(block)))
+            i += block
+    return i
+
+
+def _copy_child(path: str, chunk_rows: int):
+    """Запускается в отдельном процессе из check_load_memory: COPY во временную
+       таблицу и пиковый RSS процесса (строка для разбора родителем)."""
+    import resource
+
+    import import_data
+
+    conn = import_data.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE bench_users (LIKE users)")
+        t0 = time.perf_counter()
+        rows = import_data.copy_into(cur, "bench_users", "users", Path(path), chunk_rows=chunk_rows)
+        dt = time.perf_counter() - t0
+        conn.rollback()
+    finally:
+        conn.close()
+    # ru_maxrss: в Linux — килобайты, в macOS — байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(rows, dt, peak // (2**20 if sys.platform == "darwin" else 1024))
+
+
+def check_load_memory(mb: int, cap_mb: int = 400):
+    """import_data.copy_into на сгенерированном users.csv в mb мегабайт: пиковый RSS
+       загрузчика не должен зависеть от размера файла (предел cap_mb) — и в сыром
+       COPY, и в типизированных кусках. Нужна база из setup_db.py (пишет во временную таблицу)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "users.csv"
+        i = _write_users_csv(path, max_bytes=mb * 2**20)
+        print(f"\n{path.stat().st_size / 2**20:.0f} MB, {i} rows, cap {cap_mb} MB")
+        print(f"{'mode':<18} {'rows':>10} {'seconds':>8} {'peak RSS, MB':>13}")
+        ok = True
+        for label, chunk_rows in (("raw COPY", 0), ("typed 100k rows", 100_000)):
+            proc = subprocess.run([sys.executable, "-c",
+                                   f"import bench; bench._copy_child({str(path)!r}, {chunk_rows})"],
+                                  cwd=BASE, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr)
+                raise SystemExit(1)
+            rows, dt, peak = proc.stdout.split()[-3:]
+            ok &= int(rows) == i and int(peak) <= cap_mb
+            print(f"{label:<18} {rows:>10} {float(dt):8.1f} {peak:>13}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def bench_copy(n: int, insert_rows: int = 100_000, min_speedup: float = 10.0):
+    """import_data.copy_into (COPY FROM STDIN) против построчных INSERT, как грузил
+       прежний import_data.py, на сгенерированном users.csv из n строк. INSERT на
+       10M строк шёл бы часами, поэтому он гонится на первых insert_rows строках;
+       сравниваются строки в секунду. COPY должен быть быстрее не меньше чем в
+       min_speedup раз. Пишет во временную таблицу базы из setup_db.py."""
+    import csv
+
+    import import_data
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "users.csv"
+        rows = _write_users_csv(path, rows=n)
+        print(f"\n{rows} rows, {path.stat().st_size / 2**20:.0f} MB")
+        cols = import_data.csv_columns("users", path)
+        conn = import_data.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("CREATE TEMP TABLE bench_users (LIKE users)")
+
+            t0 = time.perf_counter()
+            copied = import_data.copy_into(cur, "bench_users", "users", path)
+            copy_s = time.perf_counter() - t0
+            cur.execute("TRUNCATE bench_users")
+
+            sql = f"INSERT INTO bench_users ({', '.join(cols)}) VALUES ({', '.join(['%s'] * len(cols))})"
+            inserted = 0
+            t0 = time.perf_counter()
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader)
+                for row in reader:
+                    if inserted == insert_rows:
+                        break
+                    cur.execute(sql, [None if v == "NULL" else v for v in row])
+                    inserted += 1
+            insert_s = time.perf_counter() - t0
+            conn.rollback()
+        finally:
+            conn.close()
+    copy_rate, insert_rate = copied / copy_s, inserted / insert_s
+    speedup = copy_rate / insert_rate
+    print(f"{'method':<10} {'rows':>10} {'seconds':>8} {'rows/s':>11}")
+    print(f"{'COPY':<10} {copied:>10} {copy_s:8.1f} {copy_rate:11.0f}")
+    print(f"{'INSERT':<10} {inserted:>10} {insert_s:8.1f} {insert_rate:11.0f}")
+    print(f"COPY is {speedup:.1f}x faster (required {min_speedup:.0f}x)")
+    if copied != rows or speedup < min_speedup:
+        raise SystemExit(1)
+
+
+def bench_partitions(months: int, rows_per_month: int = 20_000):
+    """q4 и time slider (main.py --months) на синтетической истории за months месяцев:
+       обычная таблица events против месячных партиций. С партициями время должно
+       расти с окном, а не со всей историей. Таблицы — во временных схемах bench_*."""
+    import psycopg2
+
+    from config import dbapi_params
+    from main import EVENTS_BY_MONTH_SINCE, GENRES_BY_MONTH_SINCE
+
+    start = "2015-01-01"
+    layouts = {
+        "flat": "CREATE TABLE events (id INT, date TIMESTAMP NOT NULL, genreid INT)",
+        "partitioned": "CREATE TABLE events (id INT, date TIMESTAMP NOT NULL, genreid INT) "
+                       "PARTITION BY RANGE (date)",
+    }
+    conn = psycopg2.connect(**dbapi_params("writer"))
+    cur = conn.cursor()
+    try:
+        for layout, ddl in layouts.items():
+            schema = f"bench_{layout}"
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}; "
+                        f"SET search_path TO {schema};")
+            cur.execute(ddl)
+            if layout == "partitioned":
+                for m in range(months):
+                    cur.execute(f"CREATE TABLE events_{m} PARTITION OF events FOR VALUES "
+                                f"FROM (%(s)s::timestamp + {m} * interval '1 month') "
+                                f"TO (%(s)s::timestamp + {m + 1} * interval '1 month')", {"s": start})
+            cur.execute("CREATE TABLE genres AS SELECT g AS id, 'genre ' || g AS name "
+                        "FROM generate_series(1, 10) g")
+            cur.execute("SELECT setseed(0.5)")
+            cur.execute(f"""
+                INSERT INTO events
+                SELECT g, %(s)s::timestamp + (g %% {months}) * interval '1 month'
+                          + random() * interval '27 days', g %% 10 + 1
+                FROM generate_series(1, {months * rows_per_month}) g
+            """, {"s": start})
+            cur.execute("CREATE INDEX ON events (date)")
+            cur.execute("ANALYZE events; ANALYZE genres;")
+            conn.commit()
+
+        print(f"\n{months} months x {rows_per_month} events/month")
+        print(f"{'window':>8} {'layout':>12} {'q4, ms':>9} {'slider, ms':>11} {'scanned':>8}")
+        for window in sorted({3, 12, months // 2, months}):
+            cur.execute(f"SELECT %(s)s::timestamp + {months - window} * interval '1 month'", {"s": start})
+            since = cur.fetchone()[0]
+            for layout in layouts:
+                cur.execute(f"SET search_path TO bench_{layout}")
+                row = []
+                for sql in (EVENTS_BY_MONTH_SINCE, GENRES_BY_MONTH_SINCE):
+                    best = min(timed(cur.execute, sql, {"since": since}) for _ in range(3))
+                    row.append(best * 1000)
+                cur.execute("EXPLAIN (FORMAT JSON) " + EVENTS_BY_MONTH_SINCE, {"since": since})
+                rels = set()
+                stack = [cur.fetchone()[0][0]["Plan"]]
+                while stack:
+                    node = stack.pop()
+                    if "Relation Name" in node:
+                        rels.add(node["Relation Name"])
+                    stack.extend(node.get("Plans", []))
+                print(f"{window:>8} {layout:>12} {row[0]:9.1f} {row[1]:11.1f} {len(rels):>8}")
+    finally:
+        conn.rollback()
+        cur.execute("DROP SCHEMA IF EXISTS bench_flat CASCADE; DROP SCHEMA IF EXISTS bench_partitioned CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+def check_reschedule(months: int):
+    """Инкрементальная загрузка в партиционированную схему: событие 1 переносится
+       на months месяцев вперёд (в другую партицию). После merge у каждого id одна
+       строка events, а eventartists/eventhistory ссылаются на новую дату.
+       Схема — временная bench_reschedule в настоящей базе."""
+    import csv
+    from datetime import date
+
+    import psycopg2
+
+    import import_data
+    import setup_db
+    from config import dbapi_params
+
+    def write(path, header, rows):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows(rows)
+
+    if not 1 <= months <= 11:
+        raise SystemExit("[ERROR] reschedule: --n is the shift in months, 1..11")
+    old, new = "2024-01-20 22:00:00", f"2024-{1 + months:02d}-05 22:00:00"
+    conn = psycopg2.connect(**dbapi_params("writer"))
+    cur = conn.cursor()
+    try:
+        cur.execute("DROP SCHEMA IF EXISTS bench_reschedule CASCADE; CREATE SCHEMA bench_reschedule; "
+                    "SET search_path TO bench_reschedule;")
+        cur.execute(setup_db.partitioned_schema())
+        conn.commit()
+        setup_db.ensure_partitions(conn, date(2024, 1, 1), date(2024, 1 + months, 1))
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            header = ["Id", "Name", "Description", "Venue", "Date", "CoverUrl", "LocationId", "GenreId"]
+            write(tmp / "events_v1.csv", header, [[1, "Moved", "", "Hall", old, "", "NULL", "NULL"],
+                                                  [2, "Stays", "", "Hall", old, "", "NULL", "NULL"]])
+            write(tmp / "events_v2.csv", header, [[1, "Moved", "", "Hall", new, "", "NULL", "NULL"],
+                                                  [2, "Stays", "", "Hall", old, "", "NULL", "NULL"]])
+            write(tmp / "eventartists.csv", ["Id", "EventId", "ArtistId"], [[1, 1, "NULL"], [2, 2, "NULL"]])
+            write(tmp / "eventhistory.csv", ["Id", "UserId", "EventId", "Rate", "HasAttended", "IsInterested"],
+                  [[1, "NULL", 1, 5, 1, 1], [2, "NULL", 2, 4, 1, 0]])
+            runs = {}
+            for version in ("v1", "v2"):
+                for table, path in (("events", tmp / f"events_{version}.csv"),
+                                    ("eventartists", tmp / "eventartists.csv"),
+                                    ("eventhistory", tmp / "eventhistory.csv")):
+                    runs[f"{table} {version}"] = import_data.merge_table(cur, table, path)
+                    conn.commit()
+        for name, (inserted, updated) in runs.items():
+            print(f"{name:<16} +{inserted} ~{updated}")
+
+        checks = {
+            "one events row per id": "SELECT COUNT(*) = COUNT(DISTINCT id) FROM events",
+            "event 1 rescheduled": f"SELECT date = '{new}' FROM events WHERE id = 1",
+            "event 1 in its month partition":
+                f"SELECT tableoid::regclass::text = 'events_{new[:7].replace('-', '_')}' FROM events WHERE id = 1",
+            "eventartists follow": f"SELECT bool_and(eventdate = CASE eventid WHEN 1 THEN '{new}' "
+                                   f"ELSE '{old}' END::timestamp) FROM eventartists",
+            "eventhistory follows": f"SELECT COUNT(*) = 2 AND bool_and(eventdate = CASE eventid WHEN 1 "
+                                    f"THEN '{new}' ELSE '{old}' END::timestamp) FROM eventhistory",
+        }
+        ok = True
+        for name, sql in checks.items():
+            cur.execute(sql)
+            passed = bool(cur.fetchone()[0])
+            ok &= passed
+            print(f"{'[OK]' if passed else '[ERROR]'} {name}")
+    finally:
+        conn.rollback()
+        cur.execute("DROP SCHEMA IF EXISTS bench_reschedule CASCADE;")
+        conn.commit()
+        conn.close()
+    if not ok:
+        raise SystemExit(1)
+
+
+def bench_sql_metrics(n: int):
+    """Накладные расходы instrumentation на запрос: sqlite в памяти, SELECT без I/O —
+       худший случай, в Postgres сам запрос на порядки дольше."""
+    from sqlalchemy import create_engine, text
+
+    import instrumentation
+
+    def run(e):
+        stmt = text("SELECT 1")
+        with e.connect() as conn:
+            conn.execute(stmt).fetchall()  # прогрев: соединение и кэш компиляции
+            t0 = time.perf_counter()
+            for _ in range(n):
+                conn.execute(stmt).fetchall()
+            return (time.perf_counter() - t0) / n
+
+    plain = run(create_engine("sqlite://"))
+    instrumented = create_engine("sqlite://")
+    instrumentation.instrument(instrumented, "bench")
+    if instrumentation.ENABLED and instrumentation._prometheus_available():
+        with instrumentation.query_name("bench_select"):
+            timed_q = run(instrumented)
+    else:
+        print("[WARN] prometheus_client is not installed — measuring the no-op path")
+        timed_q = run(instrumented)
+    print(f"\n{n} x SELECT 1: plain {plain * 1e6:.1f} us, instrumented {timed_q * 1e6:.1f} us, "
+          f"overhead {(timed_q - plain) * 1e6:+.1f} us/query")
+
+
+def bench_voxel(n: int):
+    """voxels.voxelize_points + cube_mesh_arrays на сетке 200³: время на точку
+       должно почти не расти с N. Старый цикл по вокселям — только на малых N."""
+    import numpy as np
+
+    from voxels import cube_mesh_arrays, voxel_size_for, voxelize_points
+
+    def loop_mean(pts, voxel_size):
+        # прежняя реализация Step 4: O(точек × вокселей)
+        ijk = np.floor((pts - pts.min(axis=0)) / voxel_size).astype(np.int32)
+        keys, inv = np.unique(ijk, axis=0, return_inverse=True)
+        inv = inv.reshape(-1)
+        return np.array([pts[inv == k, 2].mean() for k in range(len(keys))])
+
+    rng = np.random.default_rng(0)
+    print(f"\n{'points':>10} {'voxels':>9} {'grouping':>10} {'cubes':>9} {'ns/point':>9} {'old loop':>10}")
+    for size in (n // 16, n // 8, n // 4, n // 2, n):
+        # точки на поверхности сферы — как у облака из Poisson sampling
+        pts = rng.normal(size=(size, 3))
+        pts /= np.linalg.norm(pts, axis=1, keepdims=True)
+        voxel_size = voxel_size_for(pts, cubes=200.0)
+        t_group = timed(voxelize_points, pts, voxel_size)
+        stats = voxelize_points(pts, voxel_size)
+        colors = np.zeros((len(stats.keys), 3))
+        t_cubes = timed(cube_mesh_arrays, stats.keys, stats.origin, voxel_size, colors)
+        old = ""
+        if size <= 20_000:
+            t_old = timed(loop_mean, pts, voxel_size)
+            assert np.allclose(loop_mean(pts, voxel_size), stats.mean)
+            old = f"{t_old:9.2f}s"
+        per_point = (t_group + t_cubes) / size * 1e9
+        print(f"{size:>10} {len(stats.keys):>9} {t_group:9.3f}s {t_cubes:8.3f}s {per_point:9.0f} {old:>10}")
+
+
+def _silhouettes(V, F, origin, voxel_size, shape) -> list:
+    """Ортогональные проекции меша вдоль x, y, z: маски ячеек сетки, покрытых
+       треугольниками. Пробные точки внутри ячейки не лежат на её диагоналях."""
+    import numpy as np
+
+    def cross(a, b):
+        return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+    g = np.rint((V - origin) / voxel_size).astype(np.int64)
+    samples = np.array([[0.25, 0.6], [0.7, 0.35]])
+    masks = []
+    for axis in range(3):
+        u_ax, v_ax = [a for a in range(3) if a != axis]
+        tri = g[F][:, :, [u_ax, v_ax]].astype(float)             # (T, 3, 2)
+        area = cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+        tri = tri[area != 0]                                     # грани вдоль луча не видны
+        lo, hi = tri.min(axis=1).astype(np.int64), tri.max(axis=1).astype(np.int64)
+        span = hi - lo
+        n_cells = span[:, 0] * span[:, 1]
+        t = np.repeat(np.arange(len(tri)), n_cells)
+        local = np.arange(n_cells.sum()) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        cell = lo[t] + np.stack([local // span[t, 1], local % span[t, 1]], axis=1)
+        mask = np.zeros((shape[u_ax], shape[v_ax]), dtype=bool)
+        for sp in samples:
+            p = cell + sp
+            a, b, c = tri[t, 0], tri[t, 1], tri[t, 2]
+            d1 = cross(b - a, p - a)
+            d2 = cross(c - b, p - b)
+            d3 = cross(a - c, p - c)
+            inside = ((d1 > 0) & (d2 > 0) & (d3 > 0)) | ((d1 < 0) & (d2 < 0) & (d3 < 0))
+            mask[cell[inside, 0], cell[inside, 1]] = True
+        masks.append(mask)
+    return masks
+
+
+def check_voxel_silhouette(n: int):
+    """surface / greedy против полных кубиков: те же силуэты по трём осям и тот же AABB,
+       но в разы меньше треугольников и памяти (плотная модель — заполненный шар)."""
+    import numpy as np
+
+    from voxels import VOXEL_MESHERS, colormap01, voxel_size_for, voxelize_points
+
+    rng = np.random.default_rng(0)
+    pts = rng.normal(size=(n, 3))
+    pts *= (rng.random(n) ** (1 / 3) / np.linalg.norm(pts, axis=1))[:, None]
+    voxel_size = voxel_size_for(pts, cubes=30.0)
+    stats = voxelize_points(pts, voxel_size)
+    z = (stats.mean - stats.mean.min()) / np.ptp(stats.mean)
+    colors = colormap01(np.round(z * 31) / 31)
+    shape = stats.keys.max(axis=0) + 2
+
+    ref = None
+    ok = True
+    print(f"\n{len(stats.keys)} voxels      vertices  triangles   memory   time   silhouettes  AABB")
+    for mode, fn in VOXEL_MESHERS.items():
+        t0 = time.perf_counter()
+        V, F, C = fn(stats.keys, stats.origin, voxel_size, colors)
+        dt = time.perf_counter() - t0
+        masks = _silhouettes(V, F, stats.origin, voxel_size, shape)
+        aabb = np.r_[V.min(axis=0), V.max(axis=0)]
+        if ref is None:
+            ref = masks, aabb
+        same_sil = all(np.array_equal(a, b) for a, b in zip(masks, ref[0]))
+        same_box = np.allclose(aabb, ref[1])
+        ok &= same_sil and same_box
+        mb = (V.nbytes + F.nbytes + C.nbytes) / 2**20
+        print(f"{mode:<16} {len(V):>9} {len(F):>10} {mb:7.1f}MB {dt:6.2f}s {str(same_sil):>12} {str(same_box):>5}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def check_ooc_parity(n: int):
+    """memmap_cloud (Steps 4, 6, 7 блоками) против обработки в памяти на n точках:
+       те же воксели, обрезка, экстремумы и цвета; пик памяти ограничен блоком."""
+    import tracemalloc
+
+    import numpy as np
+
+    from memmap_cloud import MemmapCloud, z_gradient_colors
+    from voxels import voxel_size_for, voxelize_points
+
+    def in_memory(pts):
+        voxel_size = voxel_size_for(pts, cubes=30.0)
+        stats = voxelize_points(pts, voxel_size)
+        clipped = pts[pts[:, 0] <= 0]
+        z = clipped[:, 2]
+        return (voxel_size, stats, clipped, (z.min(), z.max(), clipped[np.argmin(z)], clipped[np.argmax(z)]),
+                z_gradient_colors(z, z.min(), z.max()))
+
+    def out_of_core(cloud, work):
+        voxel_size = cloud.voxel_size_for(cubes=30.0)
+        stats = cloud.voxelize(voxel_size)
+        clipped = cloud.clip_plane([0, 0, 0], [1, 0, 0], work / "clipped")
+        extremes = clipped.z_extremes()
+        clipped.write_z_gradient_colors(*extremes[:2])
+        return voxel_size, stats, clipped.points, extremes, clipped.colors
+
+    def peak_mb(fn, *args):
+        tracemalloc.start()
+        out = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        return out, peak
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        # облако пишется сразу в файл блоками — целиком в памяти его нет
+        rng = np.random.default_rng(0)
+        src = np.lib.format.open_memmap(tmp / "points.npy", mode="w+", dtype=np.float64, shape=(n, 3))
+        for s in range(0, n, 1 << 18):
+            src[s:s + (1 << 18)] = rng.normal(size=(min(1 << 18, n - s), 3)) * [3.0, 2.0, 1.0]
+        src.flush()
+        del src
+
+        ref, ref_peak = peak_mb(lambda: in_memory(np.load(tmp / "points.npy")))
+        ok = True
+        print(f"\n{n} points  block     voxels  exact  mean err   peak, MB (in memory {ref_peak:.1f})")
+        for block in (n // 7 + 1, 1 << 16, n):
+            cloud = MemmapCloud(tmp, block=block)
+            got, peak = peak_mb(out_of_core, cloud, tmp / f"work_{block}")
+            exact = (got[0] == ref[0]
+                     and all(np.array_equal(getattr(got[1], f), getattr(ref[1], f))
+                             for f in ("keys", "count", "min", "max"))
+                     and np.array_equal(got[2], ref[2])
+                     and got[3][:2] == ref[3][:2]
+                     and all(np.array_equal(a, b) for a, b in zip(got[3][2:], ref[3][2:]))
+                     and np.array_equal(got[4], ref[4]))
+            err = float(np.abs(got[1].mean - ref[1].mean).max())
+            ok &= exact and err < 1e-9
+            print(f"{'':>10} {block:>7} {len(got[1].keys):>9} {str(exact):>6} {err:9.1e} {peak:10.1f}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def _write_torus_ply(path: Path, segments: int, tube: float):
+    """Тор segments × segments/2 в бинарный PLY — синтетическая модель для batch3d."""
+    import numpy as np
+
+    nu, nv = segments, segments // 2
+    u, v = np.meshgrid(np.linspace(0, 2 * np.pi, nu, endpoint=False),
+                       np.linspace(0, 2 * np.pi, nv, endpoint=False), indexing="ij")
+    xyz = np.stack([(1 + tube * np.cos(v)) * np.cos(u), (1 + tube * np.cos(v)) * np.sin(u),
+                    tube * np.sin(v)], axis=-1).reshape(-1, 3).astype("<f4")
+    i, j = np.meshgrid(np.arange(nu), np.arange(nv), indexing="ij")
+    a, b = i * nv + j, (i + 1) % nu * nv + j
+    c, d = (i + 1) % nu * nv + (j + 1) % nv, i * nv + (j + 1) % nv
+    tris = np.concatenate([np.stack([a, b, c], -1).reshape(-1, 3), np.stack([a, c, d], -1).reshape(-1, 3)])
+    faces = np.empty(len(tris), dtype=[("n", "u1"), ("idx", "<i4", (3,))])
+    faces["n"], faces["idx"] = 3, tris
+    header = (f"ply\nformat binary_little_endian 1.0\nelement vertex {len(xyz)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              f"element face {len(faces)}\nproperty list uchar int vertex_indices\nend_header\n")
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(xyz.tobytes())
+        f.write(faces.tobytes())
+
+
+def bench_batch3d(models: int, segments: int = 160):
+    """batch3d.py (assn5, headless) на models синтетических торах: моделей в час
+       при 1 воркере и при os.cpu_count(), ускорение и эффективность параллельности."""
+    import json
+    import os
+
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "models"
+        src.mkdir()
+        for k in range(models):
+            # разный размер, чтобы сортировка «тяжёлые вперёд» что-то значила
+            _write_torus_ply(src / f"torus_{k:03d}.ply", segments + 8 * (k % 8), 0.25 + 0.02 * (k % 5))
+        summaries = {}
+        for w in sorted({1, workers}):
+            out = Path(tmp) / f"out_{w}"
+            proc = subprocess.run([sys.executable, str(BASE / "batch3d.py"), str(src), "--out", str(out),
+                                   "--workers", str(w), "--format", "npz"],
+                                  cwd=BASE, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stdout, proc.stderr)
+                raise SystemExit(1)
+            summaries[w] = json.loads(next(out.glob("batch_*.json")).read_text(encoding="utf-8"))
+    print(f"\n{models} models  workers   wall, s  models/hour  speedup  efficiency  failed")
+    base = summaries[1]["wall_s"]
+    for w, s in summaries.items():
+        print(f"{'':>9} {w:>8} {s['wall_s']:9.1f} {s['models_per_hour']:12.1f} "
+              f"{base / s['wall_s']:8.2f} {s['parallel_efficiency']:11.3f} {s['models_failed']:>7}")
+    if workers == 1:
+        print("[WARN] 1 CPU: nothing to compare the serial run with")
+    if any(s["models_failed"] for s in summaries.values()):
+        raise SystemExit(1)
+
+
+HEAVY_MODULES = ("pandas", "numpy", "matplotlib", "openpyxl", "plotly", "sqlalchemy", "pyarrow")
+STARTUP_MODULES = ("cli", "analytics", "main", "query_cache", "rollups", "chart_sql", "show")
+
+
+def check_importtime(budget_ms: int):
+    """python -X importtime: точки входа не должны тянуть тяжёлые библиотеки при импорте."""
+    code = "; ".join(f"import {m}" for m in STARTUP_MODULES)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=BASE,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr)
+        raise SystemExit(1)
+    # строки вида "import time:   self [us] | cumulative | imported package"
+    loaded, total_us = {}, 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, raw_name = line[len("import time:"):].split("|")
+        name = raw_name.strip()
+        top = name.split(".")[0]
+        loaded[top] = max(loaded.get(top, 0), int(cumulative))
+        if raw_name == " " + name:  # импорт верхнего уровня (без отступа вложенности)
+            total_us += int(cumulative)
+    heavy = sorted(m for m in HEAVY_MODULES if m in loaded)
+    for m in STARTUP_MODULES:
+        print(f"{m:<12} {loaded.get(m, 0) / 1000:8.1f} ms")
+    print(f"total        {total_us / 1000:8.1f} ms (budget {budget_ms} ms)")
+    if heavy:
+        print(f"[ERROR] heavy modules imported at startup: {', '.join(heavy)}")
+    if heavy or total_us > budget_ms * 1000:
+        raise SystemExit(1)
+
+
+BENCHMARKS = {
+    "render": (bench_render, 120),
+    "export": (bench_export, 200_000),
+    "scatter": (bench_scatter, 1_000_000),
+    "hist-parity": (check_hist_parity, 10),
+    "load-memory": (check_load_memory, 2048),
+    "copy": (bench_copy, 10_000_000),
+    "partitions": (bench_partitions, 72),
+    "reschedule": (check_reschedule, 2),
+    "importtime": (check_importtime, 200),
+    "sql-metrics": (bench_sql_metrics, 20_000),
+    "voxel": (bench_voxel, 1_000_000),
+    "voxel-silhouette": (check_voxel_silhouette, 200_000),
+    "ooc-parity": (check_ooc_parity, 2_000_000),
+    "batch3d": (bench_batch3d, 16),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--n", type=int, help="problem size (default depends on the benchmark)")
+    args = parser.parse_args()
+    fn, default_n = BENCHMARKS[args.name]
+    fn(args.n or default_n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Распределения, посчитанные на стороне Postgres.
+
+Вместо того чтобы тянуть все сырые значения и звать hist()/value_counts()
+на клиенте, запрос оборачивается в GROUP BY / width_bucket и возвращает
+только счётчики по корзинам. Рисуется это через hist(..., weights=counts),
+поэтому картинка та же, что и у клиентского варианта.
+"""
+
+
+def histogram_sql(sql: str, col: str, bins: int) -> str:
+    """Корзины как у np.histogram(bins=int): равные интервалы на [min, max],
+       правая граница включена в последнюю корзину; при min == max — [min-0.5, max+0.5]."""
+    return f"""
+    WITH src AS ({sql}),
+    bounds AS (
+      SELECT MIN({col})::float8 AS lo, MAX({col})::float8 AS hi
+      FROM src WHERE {col} IS NOT NULL
+    ),
+    edges AS (
+      SELECT CASE WHEN hi > lo THEN lo ELSE lo - 0.5 END AS lo,
+             CASE WHEN hi > lo THEN hi ELSE hi + 0.5 END AS hi
+      FROM bounds
+    )
+    SELECT LEAST(width_bucket(s.{col}::float8, e.lo, e.hi, {bins}), {bins}) AS bucket,
+           e.lo, e.hi, COUNT(*) AS n
+    FROM src s CROSS JOIN edges e
+    WHERE s.{col} IS NOT NULL
+    GROUP BY bucket, e.lo, e.hi
+    ORDER BY bucket
+    """
+
+
+def value_counts_sql(sql: str, col: str) -> str:
+    """Для дискретных значений (оценки 0..5): одна строка на значение."""
+    return f"""
+    SELECT s.{col} AS value, COUNT(*) AS n
+    FROM ({sql}) s
+    WHERE s.{col} IS NOT NULL
+    GROUP BY s.{col}
+    ORDER BY s.{col}
+    """
+
+
+def histogram_from_bins(df, bins: int) -> tuple:
+    """Результат histogram_sql -> (edges, counts) в формате np.histogram."""
+    import numpy as np
+
+    if df.empty:
+        return np.linspace(0.0, 1.0, bins + 1), np.zeros(bins)
+    lo, hi = float(df["lo"].iloc[0]), float(df["hi"].iloc[0])
+    edges = np.linspace(lo, hi, bins + 1)
+    counts = np.zeros(bins)
+    counts[df["bucket"].to_numpy(dtype=int) - 1] = df["n"].to_numpy()
+    return edges, counts
+
+
+def count_sql(sql: str) -> str:
+    return f"SELECT COUNT(*) AS n FROM ({sql}) s"
+
+
+def grid2d_sql(sql: str, x: str, y: str, gridsize: int) -> str:
+    """Плотность для scatter: gridsize × gridsize ячеек на [min, max] по каждой оси,
+       края — как у histogram_sql. Одна строка на непустую ячейку."""
+    return f"""
+    WITH src AS (SELECT {x}::float8 AS x, {y}::float8 AS y FROM ({sql}) s
+                 WHERE {x} IS NOT NULL AND {y} IS NOT NULL),
+    bounds AS (
+      SELECT MIN(x) AS xlo, MAX(x) AS xhi, MIN(y) AS ylo, MAX(y) AS yhi FROM src
+    ),
+    edges AS (
+      SELECT CASE WHEN xhi > xlo THEN xlo ELSE xlo - 0.5 END AS xlo,
+             CASE WHEN xhi > xlo THEN xhi ELSE xhi + 0.5 END AS xhi,
+             CASE WHEN yhi > ylo THEN ylo ELSE ylo - 0.5 END AS ylo,
+             CASE WHEN yhi > ylo THEN yhi ELSE yhi + 0.5 END AS yhi
+      FROM bounds
+    )
+    SELECT LEAST(width_bucket(s.x, e.xlo, e.xhi, {gridsize}), {gridsize}) AS ix,
+           LEAST(width_bucket(s.y, e.ylo, e.yhi, {gridsize}), {gridsize}) AS iy,
+           e.xlo, e.xhi, e.ylo, e.yhi, COUNT(*) AS n
+    FROM src s CROSS JOIN edges e
+    GROUP BY ix, iy, e.xlo, e.xhi, e.ylo, e.yhi
+    """
+
+
+def grid_from_cells(df, gridsize: int) -> tuple:
+    """Результат grid2d_sql -> (xedges, yedges, counts[iy, ix]) для pcolormesh."""
+    import numpy as np
+
+    counts = np.zeros((gridsize, gridsize))
+    if df.empty:
+        edges = np.linspace(0.0, 1.0, gridsize + 1)
+        return edges, edges, counts
+    first = df.iloc[0]
+    xedges = np.linspace(float(first["xlo"]), float(first["xhi"]), gridsize + 1)
+    yedges = np.linspace(float(first["ylo"]), float(first["yhi"]), gridsize + 1)
+    counts[df["iy"].to_numpy(dtype=int) - 1, df["ix"].to_numpy(dtype=int) - 1] = df["n"].to_numpy()
+    return xedges, yedges, counts
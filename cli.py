@@ -0,0 +1,255 @@
+"""Единая точка входа: python cli.py setup|load|report|charts|export [...].
+
+Все этапы берут один engine из config.get_engine(). Этап пропускается, если
+его входы не изменились с прошлого успешного запуска (.cache/stages.json):
+  setup  — текст схемы и флаги;
+  load   — sha256 файлов archive/*.csv и флаги;
+  report / charts / export — версии прочитанных таблиц (data_versions,
+           rollup_state), хэш sql/new_queries.sql, выбор запросов и опции,
+           плюс наличие результатов на диске.
+--force выполняет этап в любом случае.
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import analytics
+import instrumentation
+import profiling
+import query_cache
+
+BASE = Path(__file__).resolve().parent
+STATE_FILE = BASE / ".cache" / "stages.json"
+STAGES = ("setup", "load", "report", "charts", "export")
+
+
+def _digest(obj) -> str:
+    raw = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def load_state() -> dict:
+    try:
+        return json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: dict):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, STATE_FILE)
+
+
+def stage_key(stage: str, args) -> str:
+    """Частичные запуски (--queries / --charts) запоминаются отдельно от полного."""
+    picked = sorted((getattr(args, "queries", None) or []) + (getattr(args, "charts", None) or []))
+    return f"{stage}[{','.join(picked)}]" if picked else stage
+
+
+def run_stage(stage: str, args, inputs, fn) -> bool:
+    """inputs — словарь входов этапа или None (входы неизвестны — всегда выполняем).
+       Возвращает True, если этап выполнялся."""
+    key = stage_key(stage, args)
+    state = load_state()
+    fp = _digest(inputs) if inputs is not None else None
+    if fp and not args.force and state.get(key, {}).get("fingerprint") == fp:
+        print(f"[OK] {key}: inputs unchanged since {state[key]['finished_at']} — skip (--force to rerun)")
+        return False
+    fn()
+    if fp:
+        state = load_state()
+        state[key] = {"fingerprint": fp, "finished_at": datetime.now().isoformat(timespec="seconds")}
+        save_state(state)
+    return True
+
+
+# --- setup / load ---
+
+def cmd_setup(args):
+    import setup_db
+
+    schema = setup_db.partitioned_schema() if args.partitioned else setup_db.SCHEMA
+    inputs = {"schema": schema, "data_versions": setup_db.DATA_VERSIONS,
+              "partitioned": args.partitioned}
+
+    def work():
+        conn = setup_db.connect()
+        try:
+            setup_db.create_tables(conn, partitioned=args.partitioned)
+        finally:
+            conn.close()
+        print("[OK] tables created")
+
+    run_stage("setup", args, inputs, work)
+
+
+def cmd_load(args):
+    import import_data
+    import rollups
+    from setup_db import create_indexes
+
+    inputs = {
+        "files": {t: import_data.file_checksum(p) for t, p in import_data.files.items()},
+        # после пересоздания схемы данные нужно грузить заново
+        "setup": load_state().get("setup", {}).get("finished_at"),
+        "incremental": args.incremental,
+        "indexes": not args.no_indexes,
+    }
+
+    def work():
+        timings = import_data.load_all(workers=args.workers, incremental=args.incremental,
+                                       chunk_rows=args.chunk_rows)
+        import_data.print_timings(timings)
+        conn = import_data.connect()
+        try:
+            if not args.no_indexes:
+                create_indexes(conn)
+            rollups.refresh(conn)
+        finally:
+            conn.close()
+
+    run_stage("load", args, inputs, work)
+
+
+# --- report / charts / export ---
+
+def _analytics_inputs(e, queries: dict, args, outputs: list):
+    """Версии таблиц, которые читают выбранные запросы; None — версий нет в базе."""
+    if args.no_cache or not all(p.exists() for p in outputs):
+        return None
+    tables = sorted({t for sql in queries.values() for t in query_cache.relations(sql)})
+    with e.connect() as conn:
+        versions = query_cache.fingerprint(conn, tables)
+    if versions is None:
+        return None
+    options = {k: v for k, v in vars(args).items() if k not in ("func", "force", "workers", "render_workers", "profile", "cprofile")}
+    sql_hash = hashlib.sha256(analytics.SQL_FILE.read_bytes()).hexdigest()
+    return {"versions": versions, "sql": sql_hash, "options": options}
+
+
+def _export_outputs(fmt: str, picked=None) -> list:
+    outputs = []
+    if fmt in ("excel", "both"):
+        outputs.append(analytics.EXPORTS / analytics.excel_report_name(picked))
+    if fmt in ("parquet", "both"):
+        outputs.append(analytics.EXPORTS / "parquet" / "manifest.json")
+    return outputs
+
+
+def cmd_analytics(args):
+    """report = графики + экспорт; charts и export — по отдельности."""
+    from config import get_engine, print_pool_status
+
+    if args.no_cache:
+        query_cache.ENABLED = False
+    if args.profile or args.cprofile:
+        profiling.start(cprofile_stage=args.cprofile)
+    analytics.ensure_dirs()
+    e = get_engine("reader", pool_size=args.workers)
+    with profiling.stage("prepare"):
+        all_queries = analytics.prepare_queries(e)
+
+    do_charts = args.stage in ("report", "charts")
+    do_export = args.stage in ("report", "export")
+    plan = analytics.chart_plan(getattr(args, "charts", None)) if do_charts else []
+    queries = analytics.select(all_queries, getattr(args, "queries", None)) if do_export else {}
+    # графикам нужны их запросы, даже если экспорт выбран частично
+    needed = {q: all_queries[q] for q, *_ in plan if q in all_queries}
+    needed.update(queries)
+
+    outputs = [analytics.CHARTS / entry[3] for entry in plan]
+    if do_export:
+        outputs += _export_outputs(args.format, getattr(args, "queries", None))
+    inputs = _analytics_inputs(e, needed, args, outputs)
+
+    def work():
+        charted = analytics.charted_queries(plan, getattr(args, "hist_mode", "server"))
+        to_run = {q: sql for q, sql in needed.items() if q in queries or q in charted}
+        with profiling.stage("queries"):
+            dfs = analytics.run_queries(e, to_run, workers=args.workers)
+        if do_charts:
+            with profiling.stage("chart_data"):
+                jobs = analytics.chart_jobs(e, all_queries, dfs, plan, args.hist_mode,
+                                            args.scatter_mode, args.scatter_threshold)
+            with profiling.stage("render"):
+                analytics.render_charts(jobs, workers=args.render_workers)
+        if do_export:
+            with profiling.stage("export"):
+                analytics.export({q: dfs[q] for q in queries if q in dfs}, args.format,
+                                 analytics.excel_report_name(getattr(args, "queries", None)))
+
+    run_stage(args.stage, args, inputs, work)
+    print_pool_status()
+    profiling.finish()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="techno-analytics",
+                                     description="Techno events pipeline: schema, load, charts, exports")
+    sub = parser.add_subparsers(dest="stage", required=True, metavar="{" + ",".join(STAGES) + "}")
+
+    p = sub.add_parser("setup", help="create the schema")
+    p.add_argument("--partitioned", action="store_true",
+                   help="create events/eventhistory as monthly range partitions")
+    p.set_defaults(func=cmd_setup)
+
+    p = sub.add_parser("load", help="load archive/*.csv into Postgres")
+    p.add_argument("--workers", type=int, default=4,
+                   help="connections used to load one FK layer in parallel")
+    p.add_argument("--incremental", action="store_true",
+                   help="no TRUNCATE: skip unchanged files, upsert new/changed rows by id")
+    p.add_argument("--chunk-rows", type=int, default=0,
+                   help="read CSVs in typed pandas chunks of N rows (0 = raw COPY stream)")
+    p.add_argument("--no-indexes", action="store_true",
+                   help="do not build the query indexes after loading")
+    p.set_defaults(func=cmd_load)
+
+    for stage, help_ in (("report", "charts and exports"), ("charts", "charts only"),
+                         ("export", "exports only")):
+        p = sub.add_parser(stage, help=help_)
+        p.add_argument("--workers", type=int, default=4,
+                       help="queries executed in parallel (and DB pool size)")
+        p.add_argument("--no-cache", action="store_true",
+                       help="always re-run the queries (also disables stage skipping)")
+        if stage in ("report", "charts"):
+            p.add_argument("--charts", nargs="+", metavar="NAME",
+                           help="only these charts (query name or file name without .png)")
+            p.add_argument("--render-workers", type=int, default=0,
+                           help="processes used to render the charts (1 = serial, "
+                                f"0 = a pool only from {analytics.RENDER_POOL_MIN_CHARTS} charts)")
+            p.add_argument("--hist-mode", choices=["server", "client"], default="server",
+                           help="bin histograms in Postgres (server) or from raw rows (client)")
+            p.add_argument("--scatter-mode", choices=["auto", "points", "density", "sample"],
+                           default="auto", help="how scatter charts draw large results")
+            p.add_argument("--scatter-threshold", type=int, default=analytics.SCATTER_THRESHOLD,
+                           help="row count above which auto switches to density / sample size")
+        if stage in ("report", "export"):
+            p.add_argument("--queries", nargs="+", metavar="NAME",
+                           help="only export these named queries (Excel: a separate "
+                                "report_assignment2_partial_<hash>.xlsx; Parquet: only their datasets)")
+            p.add_argument("--format", choices=["excel", "parquet", "both"], default="excel",
+                           help="export target: the Excel report, Parquet datasets, or both")
+        p.add_argument("--profile", action="store_true",
+                       help="write a per-stage/query/chart timing report to exports/profile_<time>.json")
+        p.add_argument("--cprofile", choices=analytics.PROFILE_STAGES, metavar="STAGE",
+                       help="also run cProfile over one stage (implies --profile)")
+        p.set_defaults(func=cmd_analytics)
+
+    for p in sub.choices.values():
+        p.add_argument("--force", action="store_true", help="run even if the inputs are unchanged")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.func(args)
+    instrumentation.push(f"techno-analytics-{args.stage}")
+
+
+if __name__ == "__main__":
+    main()
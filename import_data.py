@@ -1,14 +1,19 @@
+import argparse
+import csv
+import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+
 import psycopg2
-import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import dbapi_params
 
-conn = psycopg2.connect(
-    dbname="techno musin events",
-    user="postgres",
-    password="1234",
-    host="localhost",
-    port="5432"
-)
-cur = conn.cursor()
+BASE = Path(__file__).resolve().parent
+ARCHIVE = BASE / "archive"
 
 tables = [
     "eventartists",
@@ -23,22 +28,17 @@ tables = [
     "genres"
 ]
 
-for t in tables:
-    print(f"🧹 Чищу таблицу {t}...")
-    cur.execute(f"TRUNCATE TABLE {t} RESTART IDENTITY CASCADE;")
-conn.commit()
-
 files = {
-    "countries": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/countries.csv",
-    "genres": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/genres.csv",
-    "locations": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/locations.csv",
-    "users": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/users.csv",
-    "artists": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/convertedArtists.csv",
-    "events": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/events.csv",
-    "eventartists": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/eventartists.csv",
-    "eventhistory": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/eventhistory.csv",
-    "favoriteartists": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/favoriteartists.csv",
-    "favoritegenres": "/Users/aygerimkoszhanova/Desktop/docs/db/archive/favoritegenres.csv"
+    "countries": ARCHIVE / "countries.csv",
+    "genres": ARCHIVE / "genres.csv",
+    "locations": ARCHIVE / "locations.csv",
+    "users": ARCHIVE / "users.csv",
+    "artists": ARCHIVE / "convertedArtists.csv",
+    "events": ARCHIVE / "events.csv",
+    "eventartists": ARCHIVE / "eventartists.csv",
+    "eventhistory": ARCHIVE / "eventhistory.csv",
+    "favoriteartists": ARCHIVE / "favoriteartists.csv",
+    "favoritegenres": ARCHIVE / "favoritegenres.csv"
 }
 
 
@@ -70,24 +70,453 @@ column_mapping = {
         "LocationId": "locationid",
         "GenreId": "genreid"
     }
-    
+
 }
 
-for table, file in files.items():
-    print(f"▶ Загружаю {file} в {table}...")
-    df = pd.read_csv(file)
 
-    
-    if table in column_mapping:
-        df.rename(columns=column_mapping[table], inplace=True)
+def connect():
+    # загрузка пишет — только на primary (config.py, роль writer)
+    return psycopg2.connect(**dbapi_params("writer"))
+
+
+def csv_columns(table: str, path: Path) -> list:
+    """Читает только заголовок CSV и применяет column_mapping.
+       Остальные колонки (Id, UserId, ...) Postgres и так понимает без кавычек."""
+    with open(path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+    mapping = column_mapping.get(table, {})
+    return [mapping.get(col, col).lower() for col in header]
+
+
+# компактные типы pandas для колонок схемы (setup_db.py)
+PG_TO_PANDAS = {
+    "smallint": "Int16",
+    "integer": "Int32",
+    "bigint": "Int64",
+}
+
+CHUNK_BYTES = 1 << 20
+
+
+def schema_dtypes(cur, table: str) -> dict:
+    """dtype для read_csv по information_schema: SMALLINT -> Int16, INT -> Int32,
+       всё остальное читаем строкой и отдаём Postgres как есть."""
+    cur.execute("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    """, (table,))
+    return {name: PG_TO_PANDAS.get(dtype, "string") for name, dtype in cur.fetchall()}
+
+
+def copy_chunks(cur, target: str, table: str, path: Path, chunk_rows: int) -> int:
+    """Читает CSV кусками по chunk_rows строк с компактными типами и отправляет
+       каждый кусок через COPY до чтения следующего — память не растёт с файлом."""
+    import pandas as pd
+
+    cols = csv_columns(table, path)
+    dtypes = schema_dtypes(cur, table)
+    sql = f"COPY {target} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv, NULL 'NULL')"
+    total = 0
+    # пропуски — только NULL, как в сыром COPY (иначе pandas сочтёт NULL-ом и "NA", "null", ...)
+    reader = pd.read_csv(path, header=0, names=cols, chunksize=chunk_rows,
+                         dtype={c: dtypes.get(c, "string") for c in cols},
+                         keep_default_na=False, na_values=["NULL"])
+    for chunk in reader:
+        buf = io.StringIO()
+        chunk.to_csv(buf, index=False, header=False, na_rep="NULL")
+        buf.seek(0)
+        cur.copy_expert(sql, buf, size=CHUNK_BYTES)
+        total += len(chunk)
+    return total
+
+
+def copy_into(cur, target: str, table: str, path: Path,
+              chunk_rows: int = 0, chunk_bytes: int = CHUNK_BYTES) -> int:
+    """COPY файла в target (саму таблицу или её staging-копию).
+       По умолчанию файл стримится как есть блоками по chunk_bytes;
+       с chunk_rows — типизированными кусками через pandas."""
+    if chunk_rows:
+        return copy_chunks(cur, target, table, path, chunk_rows)
+    cols = ", ".join(csv_columns(table, path))
+    # в archive/*.csv пустые значения записаны как NULL без кавычек (users.bio)
+    sql = f"COPY {target} ({cols}) FROM STDIN WITH (FORMAT csv, HEADER true, NULL 'NULL')"
+    with open(path, newline="", encoding="utf-8") as f:
+        cur.copy_expert(sql, f, size=chunk_bytes)
+    return cur.rowcount
+
+
+def has_column(cur, table: str, column: str) -> bool:
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone() is not None
+
+
+def primary_key(cur, table: str) -> list:
+    cur.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+    """, (table,))
+    return [r[0] for r in cur.fetchall()] or ["id"]
+
+
+def create_stage(cur, table: str, cols: list) -> str:
+    """Временная таблица только с колонками CSV: (LIKE table) унесла бы NOT NULL
+       с eventdate, которой в CSV нет, и COPY в staging падал бы."""
+    stage = f"stage_{table}"
+    cur.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+                f"SELECT {', '.join(cols)} FROM {table} WITH NO DATA;")
+    return stage
+
+
+def staged_rows(cur, table: str, stage: str, cols: list) -> tuple:
+    """(колонки, SELECT) для переноса строк из staging в таблицу.
+       В партиционированной схеме (setup_db.py --partitioned) eventhistory и
+       eventartists хранят дату события — в CSV её нет, подтягиваем из events."""
+    if not has_column(cur, table, "eventdate"):
+        col_list = ", ".join(cols)
+        return cols, f"SELECT {col_list} FROM {stage}"
+    select = ", ".join(f"s.{c}" for c in cols)
+    return cols + ["eventdate"], (
+        f"SELECT {select}, e.date FROM {stage} s LEFT JOIN events e ON e.id = s.eventid"
+    )
+
+
+def copy_table(cur, table: str, path: Path, **chunking) -> int:
+    """Стримит файл через COPY FROM STDIN, без построчных INSERT."""
+    if not has_column(cur, table, "eventdate"):
+        return copy_into(cur, table, table, path, **chunking)
+    cols = csv_columns(table, path)
+    stage = create_stage(cur, table, cols)
+    copy_into(cur, stage, table, path, **chunking)
+    target, select = staged_rows(cur, table, stage, cols)
+    cur.execute(f"INSERT INTO {table} ({', '.join(target)}) {select};")
+    return cur.rowcount
+
+
+def reset_sequence(cur, table: str):
+    """id загружаются явно, поэтому двигаем SERIAL-последовательность на MAX(id),
+       иначе следующие INSERT без id (auto_insert.py, show.py) упадут на PK."""
+    cur.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"COALESCE(MAX(id), 0) + 1, false) FROM {table};"
+    )
+
+
+def file_checksum(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def ensure_state_table(cur):
+    """Служебная таблица: что и когда было загружено из каждого CSV."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_state (
+            table_name VARCHAR PRIMARY KEY,
+            checksum   VARCHAR NOT NULL,
+            max_id     BIGINT,
+            loaded_at  TIMESTAMP NOT NULL DEFAULT now()
+        );
+    """)
+
+
+def stored_checksum(cur, table: str):
+    cur.execute("SELECT checksum FROM import_state WHERE table_name = %s;", (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_state(cur, table: str, checksum: str):
+    cur.execute(f"""
+        INSERT INTO import_state (table_name, checksum, max_id, loaded_at)
+        SELECT %s, %s, MAX(id), now() FROM {table}
+        ON CONFLICT (table_name) DO UPDATE
+        SET checksum = EXCLUDED.checksum, max_id = EXCLUDED.max_id, loaded_at = EXCLUDED.loaded_at;
+    """, (table, checksum))
+
+
+def referencing_keys(cur, table: str) -> list:
+    """[(дочерняя таблица, её колонки, колонки table)] по внешним ключам на table.
+       conparentid = 0 — только ключи самих таблиц, не их копии на партициях."""
+    cur.execute("""
+        SELECT c.conrelid::regclass::text,
+               array_agg(ca.attname::text ORDER BY k.i), array_agg(pa.attname::text ORDER BY k.i)
+        FROM pg_constraint c
+        CROSS JOIN LATERAL unnest(c.conkey, c.confkey) WITH ORDINALITY AS k(child, parent, i)
+        JOIN pg_attribute ca ON ca.attrelid = c.conrelid AND ca.attnum = k.child
+        JOIN pg_attribute pa ON pa.attrelid = c.confrelid AND pa.attnum = k.parent
+        WHERE c.contype = 'f' AND c.confrelid = %s::regclass AND c.conparentid = 0
+        GROUP BY c.oid, c.conrelid
+    """, (table,))
+    return [(child, list(ccols), list(pcols)) for child, ccols, pcols in cur.fetchall()]
+
+
+def move_rescheduled(cur, table: str, cols: list, select: str, pk: list) -> int:
+    """Партиционированная схема: PK = (id, дата). Если в CSV у существующего id
+       другая дата (событие перенесли), ON CONFLICT (id, дата) не найдёт строку и
+       вставит второй id. Поэтому до upsert такие строки переезжают: вставляем
+       строку с новой датой (если её вставил прежний upsert — берём её), переводим
+       на неё ссылки дочерних таблиц (eventartists, eventhistory) и удаляем старую.
+       Ссылки переводим сами, не полагаясь на ON UPDATE CASCADE: до Postgres 15
+       UPDATE ключа с переносом между партициями срабатывал для ссылок как DELETE.
+       Возвращает число перенесённых (удалённых старых) строк."""
+    keys = [c for c in pk if c != "id"]
+    if "id" not in pk or not keys or not set(keys) <= set(cols):
+        return 0
+    moved = f"moved_{table}"
+    src = f"({select}) AS s ({', '.join(cols)})"
+    cur.execute(f"""
+        CREATE TEMP TABLE {moved} ON COMMIT DROP AS
+        SELECT DISTINCT t.id, {", ".join(f"t.{k} AS old_{k}, s.{k} AS new_{k}" for k in keys)}
+        FROM {table} t JOIN {src} ON s.id = t.id
+        WHERE ({", ".join(f"t.{k}" for k in keys)}) IS DISTINCT FROM ({", ".join(f"s.{k}" for k in keys)});
+    """)
+    n_moved = cur.rowcount
+    if n_moved == 0:
+        return 0
+    cur.execute(f"""
+        INSERT INTO {table} ({", ".join(cols)})
+        SELECT DISTINCT ON (s.id) s.* FROM {src}
+        JOIN (SELECT DISTINCT id, {", ".join(f"new_{k}" for k in keys)} FROM {moved}) m
+          ON m.id = s.id AND {" AND ".join(f"m.new_{k} = s.{k}" for k in keys)}
+        ON CONFLICT DO NOTHING;
+    """)
+    for child, ccols, pcols in referencing_keys(cur, table):
+        if set(pcols) != set(pk):
+            continue
+        ref = dict(zip(pcols, ccols))
+        cur.execute(f"""
+            UPDATE {child} c SET {", ".join(f"{ref[k]} = m.new_{k}" for k in keys)}
+            FROM {moved} m
+            WHERE c.{ref["id"]} = m.id AND {" AND ".join(f"c.{ref[k]} = m.old_{k}" for k in keys)};
+        """)
+    cur.execute(f"""
+        DELETE FROM {table} t USING {moved} m
+        WHERE t.id = m.id AND {" AND ".join(f"t.{k} = m.old_{k}" for k in keys)};
+    """)
+    return n_moved
+
+
+def merge_table(cur, table: str, path: Path, **chunking) -> tuple:
+    """Инкрементальная загрузка: COPY во временную таблицу, затем upsert по PK
+       (id, а в партиционированных таблицах — id + дата; строки с новой датой
+       сначала переезжают, см. move_rescheduled).
+       Строки, которые не изменились, не переписываются (IS DISTINCT FROM).
+       Возвращает (inserted, updated)."""
+    stage = create_stage(cur, table, csv_columns(table, path))
+    copy_into(cur, stage, table, path, **chunking)
+    cols, select = staged_rows(cur, table, stage, csv_columns(table, path))
+    pk = primary_key(cur, table)
+    data_cols = [c for c in cols if c not in pk]
+    moved = move_rescheduled(cur, table, cols, select, pk)
+
+    if data_cols:
+        assign = ", ".join(f"{c} = EXCLUDED.{c}" for c in data_cols)
+        old = ", ".join(f"{table}.{c}" for c in data_cols)
+        new = ", ".join(f"EXCLUDED.{c}" for c in data_cols)
+        on_conflict = f"DO UPDATE SET {assign} WHERE ({old}) IS DISTINCT FROM ({new})"
+    else:
+        on_conflict = "DO NOTHING"
+    cur.execute(f"""
+        WITH merged AS (
+            INSERT INTO {table} ({", ".join(cols)})
+            {select}
+            ON CONFLICT ({", ".join(pk)}) {on_conflict}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted)
+        FROM merged;
+    """)
+    inserted, updated = cur.fetchone()
+    # перенесённые строки уже на месте: upsert их не трогает, но они изменились
+    return inserted, updated + moved
+
+
+def csv_date_range(table: str, column: str):
+    """(min, max) даты в колонке CSV — чтобы заранее создать месячные партиции."""
+    path = files[table]
+    idx = csv_columns(table, path).index(column)
+    lo = hi = None
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            if len(row) > idx and row[idx]:
+                d = datetime.fromisoformat(row[idx][:19]).date()
+                lo = d if lo is None or d < lo else lo
+                hi = d if hi is None or d > hi else hi
+    return lo, hi
+
+
+def prepare_partitions(conn):
+    """Для партиционированной схемы: партиции на весь диапазон дат из events.csv
+       (и на пару месяцев вперёд для auto_insert.py), до загрузки данных."""
+    from setup_db import add_months, ensure_partitions, is_partitioned
+
+    cur = conn.cursor()
+    partitioned = is_partitioned(cur, "events")
+    cur.close()
+    if not partitioned:
+        return
+    lo, hi = csv_date_range("events", "date")
+    today = date.today()
+    ensure_partitions(conn, min(lo or today, today), max(hi or today, add_months(today, 3)))
+
+
+def truncate_all(cur):
+    """Чистит таблицы и import_state в одной транзакции: если полная загрузка
+       упадёт на середине, --incremental не сочтёт пустые таблицы загруженными."""
+    for t in tables:
+        print(f"🧹 Чищу таблицу {t}...")
+        cur.execute(f"TRUNCATE TABLE {t} RESTART IDENTITY CASCADE;")
+    cur.execute("TRUNCATE TABLE import_state;")
+
+
+def foreign_keys(cur) -> dict:
+    """{таблица: {таблицы, на которые она ссылается}} — берём из pg_constraint,
+       то есть из реальной схемы, созданной setup_db.py."""
+    cur.execute("""
+        SELECT c.conrelid::regclass::text, c.confrelid::regclass::text
+        FROM pg_constraint c
+        WHERE c.contype = 'f'
+    """)
+    deps = {t: set() for t in files}
+    for child, parent in cur.fetchall():
+        if child in deps and parent in deps and parent != child:
+            deps[child].add(parent)
+    return deps
+
+
+def dependency_layers(deps: dict) -> list:
+    """Топологическая сортировка по слоям: в слое только таблицы,
+       все родители которых уже загружены в предыдущих слоях."""
+    remaining = {t: set(p) for t, p in deps.items()}
+    layers = []
+    while remaining:
+        layer = sorted(t for t, parents in remaining.items() if not parents)
+        if not layer:
+            raise RuntimeError(f"Cyclic foreign keys between: {sorted(remaining)}")
+        layers.append(layer)
+        for t in layer:
+            del remaining[t]
+        for parents in remaining.values():
+            parents.difference_update(layer)
+    return layers
+
+
+def load_table(pool, table: str, incremental: bool = False, **chunking) -> tuple:
+    """Возвращает (status, rows, seconds); status — loaded / merged / skipped."""
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        t0 = time.perf_counter()
+        path = files[table]
+        checksum = file_checksum(path)
+        if incremental and stored_checksum(cur, table) == checksum:
+            conn.rollback()
+            return "skipped", 0, time.perf_counter() - t0
+
+        if incremental:
+            inserted, updated = merge_table(cur, table, path, **chunking)
+            status, rows = f"merged +{inserted} ~{updated}", inserted + updated
+        else:
+            status, rows = "loaded", copy_table(cur, table, path, **chunking)
+        reset_sequence(cur, table)
+        save_state(cur, table, checksum)
+        conn.commit()
+        cur.close()
+        return status, rows, time.perf_counter() - t0
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def load_all(workers: int = 4, incremental: bool = False,
+             chunk_rows: int = 0, chunk_bytes: int = CHUNK_BYTES) -> list:
+    """Грузит таблицы слоями по FK; внутри слоя — параллельно, по соединению на таблицу.
+       В инкрементальном режиме ничего не чистит: неизменённые файлы (по sha256)
+       пропускаются, остальные сливаются upsert-ом по id.
+       Возвращает список (layer, table, rows, seconds) для отчёта."""
+    pool = ThreadedConnectionPool(1, workers, **dbapi_params("writer"))
+    timings = []
+    try:
+        conn = pool.getconn()
+        cur = conn.cursor()
+        ensure_state_table(cur)
+        if not incremental:
+            truncate_all(cur)
+        layers = dependency_layers(foreign_keys(cur))
+        conn.commit()
+        prepare_partitions(conn)
+        cur.close()
+        pool.putconn(conn)
+
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            for n, layer in enumerate(layers, start=1):
+                print(f"▶ Слой {n}: {', '.join(layer)}")
+                t0 = time.perf_counter()
+                futures = {t: ex.submit(load_table, pool, t, incremental,
+                                        chunk_rows=chunk_rows, chunk_bytes=chunk_bytes)
+                           for t in layer}
+                for table, fut in futures.items():
+                    status, rows, dt = fut.result()
+                    timings.append((n, table, rows, dt))
+                    print(f"[OK] {table}: {status}, {rows} rows in {dt:.2f}s "
+                          f"({rows / max(dt, 1e-9):,.0f} rows/s)")
+                print(f"   layer {n} done in {time.perf_counter() - t0:.2f}s")
+    finally:
+        pool.closeall()
+    return timings
+
+
+def print_timings(timings: list):
+    print("\nlayer  table             rows        seconds")
+    for layer, table, rows, dt in timings:
+        print(f"{layer:<6} {table:<17} {rows:<11} {dt:.2f}")
+    slowest = max(timings, key=lambda r: r[3], default=None)
+    if slowest:
+        print(f"Bottleneck: {slowest[1]} (layer {slowest[0]}, {slowest[3]:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load archive/*.csv into Postgres")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="connections used to load one FK layer in parallel")
+    parser.add_argument("--incremental", action="store_true",
+                        help="no TRUNCATE: skip unchanged files, upsert new/changed rows by id")
+    parser.add_argument("--chunk-rows", type=int, default=0,
+                        help="read CSVs in typed pandas chunks of N rows (0 = raw COPY stream)")
+    parser.add_argument("--chunk-bytes", type=int, default=CHUNK_BYTES,
+                        help="block size used to feed COPY")
+    parser.add_argument("--no-indexes", action="store_true",
+                        help="do not build the query indexes after loading")
+    args = parser.parse_args()
+
+    timings = load_all(workers=args.workers, incremental=args.incremental,
+                       chunk_rows=args.chunk_rows, chunk_bytes=args.chunk_bytes)
+    print_timings(timings)
+
+    conn = connect()
+    try:
+        if not args.no_indexes:
+            # индексы строим после загрузки: COPY в таблицу без индексов быстрее
+            from setup_db import create_indexes
+            create_indexes(conn)
+        import rollups
+        rollups.refresh(conn)
+    finally:
+        conn.close()
+    print("All the data have been succesfully imported!")
 
-    for i, row in df.iterrows():
-        cols = ','.join(df.columns)
-        vals = ','.join(['%s'] * len(row))
-        sql = f"INSERT INTO {table} ({cols}) VALUES ({vals})"
-        cur.execute(sql, tuple(row))
-    conn.commit()
 
-cur.close()
-conn.close()
-print("All the data have been succesfully imported!")
+if __name__ == "__main__":
+    main()
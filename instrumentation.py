@@ -0,0 +1,177 @@
+"""Метрики Prometheus для собственных SQL-запросов: латентность, строки, ошибки.
+
+instrument(engine, role) вешает обработчики событий SQLAlchemy на engine
+(config.get_engine делает это сам). Имя запроса берётся из execution option
+query_name или из контекста:
+
+    with instrumentation.query_name("q10_artist_popularity_by_country"):
+        df = query_cache.read_sql(sql, e)
+
+Потоковые запросы (server-side курсор, query_cache.stream_sql) отчитываются за весь
+поток через stream_finished(): время до последнего куска и число отданных строк.
+
+Отдать метрики: serve(port) — HTTP /metrics для долгоживущих процессов
+(auto_insert.py), push(job) — в Pushgateway для пакетных запусков (cli.py).
+prometheus_client — необязательная зависимость: без неё всё это ничего не делает.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("SQL_METRICS", "1") != "0"
+PUSHGATEWAY = os.environ.get("PUSHGATEWAY_URL", "")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current = contextvars.ContextVar("query_name", default="unnamed")
+_metrics = None
+
+
+@contextmanager
+def query_name(name: str):
+    token = _current.set(name)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def _prometheus_available() -> bool:
+    try:
+        import prometheus_client  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _PoolCollector:
+    """Состояние пулов из config.pool_status() в момент сбора метрик."""
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+
+        from config import pool_status
+
+        fields = ("checked_out", "idle", "overflow", "size", "connects", "checkouts", "invalidated")
+        families = {f: GaugeMetricFamily(f"techno_db_pool_{f}", f"SQLAlchemy pool: {f}",
+                                         labels=["role", "pool_size"]) for f in fields}
+        for s in pool_status():
+            for f in fields:
+                families[f].add_metric([s["role"], str(s["size"])], s[f])
+        return list(families.values())
+
+
+def metrics():
+    """Метрики создаются один раз на процесс, в отдельном реестре (его и пушим)."""
+    global _metrics
+    if _metrics is None:
+        from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+        registry = CollectorRegistry()
+        _metrics = dict(
+            registry=registry,
+            latency=Histogram("techno_sql_query_duration_seconds", "Named query latency",
+                              ["query", "role"], buckets=LATENCY_BUCKETS, registry=registry),
+            rows=Counter("techno_sql_query_rows_total", "Rows returned or affected by named queries",
+                         ["query", "role"], registry=registry),
+            last_rows=Gauge("techno_sql_query_last_rows", "Rows of the last execution",
+                            ["query", "role"], registry=registry),
+            errors=Counter("techno_sql_query_errors_total", "Failed named queries",
+                           ["query", "role", "error"], registry=registry),
+        )
+        registry.register(_PoolCollector())
+    return _metrics
+
+
+def instrument(e, role: str):
+    """Вешает before/after_cursor_execute и handle_error на engine. Дёшево: на запрос —
+       два perf_counter() и обновление уже созданных дочерних метрик."""
+    if not ENABLED or not _prometheus_available():
+        return e
+    from sqlalchemy import event
+
+    m = metrics()
+    children = {}  # (query) -> (latency, rows, last_rows): .labels() дорогой, кэшируем
+
+    def series(name):
+        s = children.get(name)
+        if s is None:
+            s = children[name] = (m["latency"].labels(name, role), m["rows"].labels(name, role),
+                                  m["last_rows"].labels(name, role))
+        return s
+
+    def name_of(context):
+        if context is not None:
+            name = context.execution_options.get("query_name")
+            if name:
+                return name
+        return _current.get()
+
+    @event.listens_for(e, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(e, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("query_start", time.perf_counter())
+        if context is not None and context.execution_options.get("stream_results"):
+            # server-side курсор: здесь только DECLARE и первый fetch, rowcount = -1;
+            # итог (время до последнего куска, строки) пишет stream_finished()
+            conn.info["stream_metrics"] = (name_of(context), role, start)
+            return
+        latency, rows, last_rows = series(name_of(context))
+        latency.observe(time.perf_counter() - start)
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            rows.inc(cursor.rowcount)
+            last_rows.set(cursor.rowcount)
+
+    @event.listens_for(e, "handle_error")
+    def _error(ctx):
+        if ctx.connection is not None:
+            ctx.connection.info.pop("query_start", None)
+            # ошибка при чтении потока: считаем её здесь, stream_finished() — уже нет
+            ctx.connection.info.pop("stream_metrics", None)
+        m["errors"].labels(name_of(ctx.execution_context), role,
+                           type(ctx.original_exception).__name__).inc()
+
+    return e
+
+
+def stream_finished(conn, rows: int, error: BaseException = None):
+    """Итог потокового запроса (query_cache.stream_sql): латентность — от execute до
+       последнего куска, строки — сколько отдал генератор; error — сбой не из БД
+       (ошибки курсора уже посчитал handle_error). Без instrument() ничего не делает."""
+    pending = conn.info.pop("stream_metrics", None)
+    if pending is None or _metrics is None:
+        return
+    name, role, start = pending
+    if error is not None:
+        _metrics["errors"].labels(name, role, type(error).__name__).inc()
+        return
+    _metrics["latency"].labels(name, role).observe(time.perf_counter() - start)
+    _metrics["rows"].labels(name, role).inc(rows)
+    _metrics["last_rows"].labels(name, role).set(rows)
+
+
+def serve(port: int = METRICS_PORT):
+    """HTTP /metrics в фоновом потоке (для долгоживущих процессов)."""
+    if not port or not _prometheus_available():
+        return
+    from prometheus_client import start_http_server
+
+    start_http_server(port, registry=metrics()["registry"])
+    print(f"[OK] SQL metrics on http://localhost:{port}/metrics")
+
+
+def push(job: str, gateway: str = PUSHGATEWAY):
+    """Для пакетных запусков: процесс завершится раньше, чем Prometheus его опросит."""
+    if not gateway or _metrics is None:
+        return
+    from prometheus_client import push_to_gateway
+
+    try:
+        push_to_gateway(gateway, job=job, registry=_metrics["registry"])
+        print(f"[OK] SQL metrics pushed to {gateway} (job={job})")
+    except OSError as ex:
+        print(f"[WARN] pushgateway {gateway}: {ex}")
@@ -1,9 +1,9 @@
 # main.py
-import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
-from sqlalchemy import create_engine
-from config import DB_URI
+import argparse
+from config import get_engine
+from chart_sql import value_counts_sql
+import query_cache
+import rollups
 from pathlib import Path
 
 SQL_FILE = Path(__file__).resolve().parent / "sql" / "new_queries.sql"
@@ -18,7 +18,7 @@ def load_queries(sql_path: Path) -> dict:
         body = []
         for ln in lines:
             if ln.lower().startswith("-- name:"):
-                qname = ln.split(":", 1)[1].strip()
+                qname = ln.split(":", 1)[1].split("(")[0].strip()
             else:
                 body.append(ln)
         if not qname:
@@ -26,20 +26,96 @@ def load_queries(sql_path: Path) -> dict:
         queries[qname] = "\n".join(body).strip()
     return queries
 
+# q4 и time slider с окном по времени: фильтр по e.date позволяет Postgres
+# отсечь лишние месячные партиции (setup_db.py --partitioned)
+EVENTS_BY_MONTH_SINCE = """
+SELECT DATE_TRUNC('month', e.date) AS month, COUNT(*) AS event_count
+FROM events e
+WHERE e.date >= %(since)s
+GROUP BY month
+ORDER BY month
+"""
+
+# since = None — вся история; с датой Postgres ещё на этапе планирования
+# сворачивает "IS NULL OR" и отсекает партиции (bench.py partitions)
+GENRES_BY_MONTH_SINCE = """
+WITH windowed AS (
+  SELECT * FROM events e
+  WHERE %(since)s::timestamp IS NULL OR e.date >= %(since)s::timestamp
+),
+months AS (
+  SELECT generate_series(
+    date_trunc('month', MIN(e.date)),
+    date_trunc('month', MAX(e.date)),
+    interval '1 month'
+  ) AS month
+  FROM windowed e
+),
+genres_used AS (
+  SELECT DISTINCT g.id, g.name
+  FROM windowed e
+  JOIN genres g ON e.genreid = g.id
+),
+counts AS (
+  SELECT date_trunc('month', e.date) AS month,
+         g.id AS genre_id,
+         COUNT(*)::int AS cnt
+  FROM windowed e
+  JOIN genres g ON e.genreid = g.id
+  GROUP BY month, g.id
+)
+SELECT m.month,
+       gu.name AS genre,
+       COALESCE(c.cnt, 0) AS cnt
+FROM months m
+CROSS JOIN genres_used gu
+LEFT JOIN counts c
+       ON c.month = m.month AND c.genre_id = gu.id
+ORDER BY m.month, gu.name;
+"""
+
+def window_start(months: int):
+    """Начало окна: первое число месяца months месяцев назад (None — вся история)."""
+    if not months:
+        return None
+    import pandas as pd
+
+    return (pd.Timestamp.today().to_period("M") - (months - 1)).to_timestamp()
+
 def main():
-    engine = create_engine(DB_URI)
+    parser = argparse.ArgumentParser(description="Interactive charts for the named queries")
+    parser.add_argument("--months", type=int, default=0,
+                        help="limit the monthly charts to the last N months (0 = all history)")
+    parser.add_argument("--hist-mode", choices=["server", "client"], default="server",
+                        help="count ratings in Postgres (server) or from raw rows (client)")
+    parser.add_argument("--scatter-threshold", type=int, default=20_000,
+                        help="above this many points the scatter is drawn as a hexbin density")
+    args = parser.parse_args()
+    # тяжёлые библиотеки — после разбора аргументов, чтобы --help отвечал сразу
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    since = window_start(args.months)
+
+    engine = get_engine("reader")
     queries = load_queries(SQL_FILE)
+    # сводки обновляет rollups.py по расписанию; устаревшие redirect() не использует
+    raw = engine.raw_connection()
+    try:
+        queries = rollups.redirect(queries, raw)
+    finally:
+        raw.close()
 
     print("Available queries:", list(queries.keys()))
 
     # 1. Pie chart
-    df = pd.read_sql(queries.get("q1_users_by_country", list(queries.values())[0]), engine)
+    df = query_cache.read_sql(queries.get("q1_users_by_country", list(queries.values())[0]), engine)
     df.set_index(df.columns[0]).plot.pie(y=df.columns[1], autopct="%1.1f%%", legend=False)
     plt.title("Users by Country")
     plt.show()
 
     # 2. Bar chart
-    df = pd.read_sql(queries.get("q2_events_by_genre", list(queries.values())[1]), engine)
+    df = query_cache.read_sql(queries.get("q2_events_by_genre", list(queries.values())[1]), engine)
     df.plot.bar(x=df.columns[0], y=df.columns[1], legend=False)
     plt.title("Events by Genre")
     plt.xlabel(df.columns[0]); plt.ylabel(df.columns[1])
@@ -47,14 +123,17 @@ def main():
     plt.show()
 
     # 3. Horizontal bar chart
-    df = pd.read_sql(queries.get("q3_top_artists_by_events", list(queries.values())[2]), engine)
+    df = query_cache.read_sql(queries.get("q3_top_artists_by_events", list(queries.values())[2]), engine)
     df.plot.barh(x=df.columns[0], y=df.columns[1], legend=False)
     plt.title("Top Artists by Events")
     plt.xlabel(df.columns[1]); plt.ylabel(df.columns[0])
     plt.show()
 
     # 4. Line chart
-    df = pd.read_sql(queries.get("q4_events_by_month", list(queries.values())[3]), engine)
+    if since is not None:
+        df = query_cache.read_sql(EVENTS_BY_MONTH_SINCE, engine, params={"since": since})
+    else:
+        df = query_cache.read_sql(queries.get("q4_events_by_month", list(queries.values())[3]), engine)
     if "month" in df.columns:
         df["month"] = pd.to_datetime(df["month"])
     df.plot(x=df.columns[0], y=df.columns[1], marker="o")
@@ -65,11 +144,23 @@ def main():
     
     
     # 5. Histogram (Rating distribution)
-    df = pd.read_sql(queries.get("q5_rating_distribution", list(queries.values())[4]), engine)
-    col = df.columns[0]  # "rate"
-
-    df[col].plot.hist(
-    bins=range(int(df[col].min()), int(df[col].max())+2), 
+    q5 = queries.get("q5_rating_distribution", list(queries.values())[4])
+    if args.hist_mode == "server":
+        # Postgres сам считает оценки: по сети идёт ~6 строк, а не все оценки
+        vc = query_cache.read_sql(value_counts_sql(q5, "rate"), engine)
+        counts = pd.Series(vc["n"].to_numpy(), index=vc["value"].astype(int))
+    else:
+        # сырые оценки читаем кусками через серверный курсор и сразу сворачиваем в счётчики
+        counts = None
+        for chunk in query_cache.stream_sql(q5, engine):
+            vc = chunk.iloc[:, 0].value_counts()
+            counts = vc if counts is None else counts.add(vc, fill_value=0)
+    counts = counts.sort_index().astype(int)
+    lo, hi = int(counts.index.min()), int(counts.index.max())
+
+    plt.hist(
+    counts.index, weights=counts.values,
+    bins=range(lo, hi+2), 
     align="left", 
     rwidth=0.8
     )
@@ -77,53 +168,28 @@ def main():
     plt.title("Rating Distribution")
     plt.xlabel("Rating")
     plt.ylabel("Count")
-    plt.xticks(range(int(df[col].min()), int(df[col].max())+1))
-    plt.yticks(range(0, df[col].value_counts().max()+1))
+    plt.xticks(range(lo, hi+1))
+    plt.yticks(range(0, counts.max()+1))
     plt.show()
 
 
 
     # 6. Scatter plot
-    df = pd.read_sql(queries.get("q6_rating_vs_attendance", list(queries.values())[5]), engine) 
-    df.plot.scatter(x=df.columns[1], y=df.columns[0])
+    df = query_cache.read_sql(queries.get("q6_rating_vs_attendance", list(queries.values())[5]), engine) 
+    if len(df) > args.scatter_threshold:
+        # миллион маркеров не читается и рисуется минутами — показываем плотность
+        df.plot.hexbin(x=df.columns[1], y=df.columns[0], gridsize=80, bins="log", mincnt=1, cmap="viridis")
+    else:
+        df.plot.scatter(x=df.columns[1], y=df.columns[0])
     plt.title("Avg Rating vs Attended Events")
     plt.xlabel(df.columns[1]); plt.ylabel(df.columns[0])
     plt.show()
 
     # 7. Time slider (Plotly)
-    sql = """
-    WITH months AS (
-      SELECT generate_series(
-        date_trunc('month', MIN(e.date)),
-        date_trunc('month', MAX(e.date)),
-        interval '1 month'
-      ) AS month
-      FROM events e
-    ),
-    genres_used AS (
-      SELECT DISTINCT g.id, g.name
-      FROM events e
-      JOIN genres g ON e.genreid = g.id
-    ),
-    counts AS (
-      SELECT date_trunc('month', e.date) AS month,
-             g.id AS genre_id,
-             COUNT(*)::int AS cnt
-      FROM events e
-      JOIN genres g ON e.genreid = g.id
-      GROUP BY month, g.id
-    )
-    SELECT m.month,
-           gu.name AS genre,
-           COALESCE(c.cnt, 0) AS cnt
-    FROM months m
-    CROSS JOIN genres_used gu
-    LEFT JOIN counts c
-           ON c.month = m.month AND c.genre_id = gu.id
-    ORDER BY m.month, gu.name;
-    """
-    df = pd.read_sql(sql, engine)
+    df = query_cache.read_sql(GENRES_BY_MONTH_SINCE, engine, params={"since": since})
     df["month_str"] = pd.to_datetime(df["month"]).dt.strftime("%Y-%m")
+    import plotly.express as px  # нужен только слайдеру, импорт ~0.5 с
+
     fig = px.bar(
         df, x="genre", y="cnt",
         animation_frame="month_str",
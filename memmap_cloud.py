@@ -0,0 +1,205 @@
+"""Облако точек вне памяти: numpy-файлы через mmap и обработка блоками.
+
+    cloud = MemmapCloud.from_array(points, "work/points")   # или MemmapCloud("work/points")
+    stats = cloud.voxelize(cloud.voxel_size_for(30.0))     # Step 4
+    clipped = cloud.clip_plane(p0, n, "work/clipped")        # Step 6
+    z_min, z_max, p_min, p_max = clipped.z_extremes()       # Step 7
+    clipped.write_z_gradient_colors(z_min, z_max)
+
+Вход может уже лежать на диске: MemmapCloud.from_array(np.load(path, mmap_mode="r"), ...)
+копирует его блоками, не поднимая в память (assn5.py --points-npy).
+
+Каталог облака: points.npy (N, 3) float64 и, если есть, colors.npy. Каждая операция
+проходит по блокам из block точек, в памяти — блок и результат (для вокселей —
+по строке на занятую ячейку, а не на точку), поэтому облако может быть больше RAM.
+Результаты совпадают с обработкой в памяти из assn5.py: ключи, count, min, max и
+экстремумы — точно, средние по вокселям — до округления (другой порядок сложения).
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+from voxels import VoxelStats, voxelize_points
+
+BLOCK_POINTS = int(os.environ.get("OOC_BLOCK_POINTS", 1 << 20))
+DISPLAY_POINTS = 2_000_000  # to_o3d(): больше в окно Open3D всё равно не стоит отдавать
+
+
+def z_gradient_colors(z: np.ndarray, z_min: float, z_max: float) -> np.ndarray:
+    """Цвет Step 7: синий внизу → красный вверху."""
+    z_norm = (z - z_min) / (z_max - z_min + 1e-12)
+    return np.vstack([z_norm, 0.3 * np.ones_like(z_norm), 1.0 - z_norm]).T
+
+
+def _open_out(path: Path, shape: tuple) -> np.memmap:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=shape)
+
+
+def _reduce(parts: list) -> tuple:
+    """Склеивает частичные агрегаты (lin, count, sum, min, max) по одинаковым ключам."""
+    lin, count, total, lo, hi = (np.concatenate(c) for c in zip(*parts))
+    order = np.argsort(lin, kind="stable")
+    lin = lin[order]
+    starts = np.flatnonzero(np.r_[True, lin[1:] != lin[:-1]])
+    return (lin[starts], np.add.reduceat(count[order], starts), np.add.reduceat(total[order], starts),
+            np.minimum.reduceat(lo[order], starts), np.maximum.reduceat(hi[order], starts))
+
+
+class MemmapCloud:
+    def __init__(self, path, block: int = BLOCK_POINTS):
+        self.path = Path(path)
+        self.block = block
+        self.points = np.load(self.path / "points.npy", mmap_mode="r")
+        colors = self.path / "colors.npy"
+        self.colors = np.load(colors, mmap_mode="r") if colors.exists() else None
+
+    @classmethod
+    def from_array(cls, points: np.ndarray, path, colors: np.ndarray = None, block: int = BLOCK_POINTS):
+        """Копирует массив (или другой memmap) в каталог path блоками."""
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError(f"points must have shape (N, 3), got {points.shape}")
+        path = Path(path)
+        out = _open_out(path / "points.npy", (len(points), 3))
+        out_c = _open_out(path / "colors.npy", (len(points), 3)) if colors is not None else None
+        for s in range(0, len(points), block):
+            out[s:s + block] = points[s:s + block]
+            if out_c is not None:
+                out_c[s:s + block] = colors[s:s + block]
+        out.flush()
+        if out_c is not None:
+            out_c.flush()
+        del out, out_c
+        return cls(path, block)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def blocks(self):
+        for s in range(0, len(self.points), self.block):
+            yield s, min(s + self.block, len(self.points))
+
+    def bounds(self) -> tuple:
+        if len(self) == 0:
+            raise ValueError("Point cloud is empty")
+        lo = np.full(3, np.inf)
+        hi = np.full(3, -np.inf)
+        for s, e in self.blocks():
+            p = self.points[s:e]
+            lo = np.minimum(lo, p.min(axis=0))
+            hi = np.maximum(hi, p.max(axis=0))
+        return lo, hi
+
+    def voxel_size_for(self, cubes: float = 30.0) -> float:
+        """Как voxels.voxel_size_for, но по блокам."""
+        lo, hi = self.bounds()
+        return float((hi - lo).max()) / cubes
+
+    def voxelize(self, voxel_size: float, origin=None) -> VoxelStats:
+        """Как voxels.voxelize_points (значение — Z), но по блокам: каждый блок группируется
+           на общей сетке, частичные count/sum/min/max сливаются по линейному ключу.
+           inverse не строится (это массив на N точек) — в результате он None."""
+        lo, hi = self.bounds()
+        origin = lo if origin is None else np.asarray(origin, dtype=float)
+        dims = np.floor((hi - origin) / voxel_size).astype(np.int64) + 1
+        acc, pending, pending_rows = [], [], 0
+        for s, e in self.blocks():
+            st = voxelize_points(self.points[s:e], voxel_size, origin=origin)
+            lin = (st.keys[:, 0] * dims[1] + st.keys[:, 1]) * dims[2] + st.keys[:, 2]
+            # сумма блока через inverse, а не mean * count — там уже лишнее округление деления
+            total = np.bincount(st.inverse, weights=self.points[s:e, 2], minlength=len(lin))
+            pending.append((lin, st.count, total, st.min, st.max))
+            pending_rows += len(lin)
+            if pending_rows > self.block:
+                acc = [_reduce(acc + pending)]
+                pending, pending_rows = [], 0
+        lin, count, total, vmin, vmax = _reduce(acc + pending)
+        keys = np.stack(np.unravel_index(lin, tuple(dims)), axis=1).astype(np.int64)
+        return VoxelStats(origin=origin, voxel_size=float(voxel_size), keys=keys, count=count,
+                          mean=total / count, min=vmin, max=vmax, inverse=None)
+
+    def clip_plane(self, p0, normal, path) -> "MemmapCloud":
+        """Точки с (p - p0)·n <= 0 в новый каталог path, в исходном порядке (Step 6).
+           Два прохода: подсчёт, затем запись в файл точного размера."""
+        p0 = np.asarray(p0, dtype=float)
+        n = np.asarray(normal, dtype=float)
+        n = n / np.linalg.norm(n)
+        total = sum(int(((self.points[s:e] - p0) @ n <= 0).sum()) for s, e in self.blocks())
+        path = Path(path)
+        out = _open_out(path / "points.npy", (total, 3))
+        out_c = _open_out(path / "colors.npy", (total, 3)) if self.colors is not None else None
+        pos = 0
+        for s, e in self.blocks():
+            keep = (self.points[s:e] - p0) @ n <= 0
+            k = int(keep.sum())
+            out[pos:pos + k] = self.points[s:e][keep]
+            if out_c is not None:
+                out_c[pos:pos + k] = self.colors[s:e][keep]
+            pos += k
+        out.flush()
+        if out_c is not None:
+            out_c.flush()
+        del out, out_c
+        return MemmapCloud(path, self.block)
+
+    def z_extremes(self) -> tuple:
+        """(z_min, z_max, p_min, p_max); при равных Z — первая точка, как у np.argmin/argmax."""
+        if len(self) == 0:
+            raise ValueError("Point cloud is empty")
+        z_min, z_max = np.inf, -np.inf
+        i_min = i_max = 0
+        for s, e in self.blocks():
+            z = self.points[s:e, 2]
+            a, b = int(np.argmin(z)), int(np.argmax(z))
+            if z[a] < z_min:
+                z_min, i_min = float(z[a]), s + a
+            if z[b] > z_max:
+                z_max, i_max = float(z[b]), s + b
+        return z_min, z_max, np.array(self.points[i_min]), np.array(self.points[i_max])
+
+    def write_z_gradient_colors(self, z_min: float, z_max: float):
+        """colors.npy по Z (Step 7), блоками; облако начинает отдавать эти цвета."""
+        self.colors = None  # старое отображение файла перезаписываем — отпускаем его
+        out = _open_out(self.path / "colors.npy", (len(self), 3))
+        for s, e in self.blocks():
+            out[s:e] = z_gradient_colors(self.points[s:e, 2], z_min, z_max)
+        out.flush()
+        del out
+        self.colors = np.load(self.path / "colors.npy", mmap_mode="r")
+
+    def write_ply(self, path):
+        """Бинарный PLY блоками: xyz double (+ red/green/blue uchar, как пишет Open3D)."""
+        fields = [("xyz", "<f8", (3,))]
+        props = ["property double x", "property double y", "property double z"]
+        if self.colors is not None:
+            fields.append(("rgb", "u1", (3,)))
+            props += ["property uchar red", "property uchar green", "property uchar blue"]
+        header = (f"ply\nformat binary_little_endian 1.0\nelement vertex {len(self)}\n"
+                  + "\n".join(props) + "\nend_header\n")
+        with open(path, "wb") as f:
+            f.write(header.encode("ascii"))
+            for s, e in self.blocks():
+                rec = np.empty(e - s, dtype=fields)
+                rec["xyz"] = self.points[s:e]
+                if self.colors is not None:
+                    rec["rgb"] = np.clip(np.round(self.colors[s:e] * 255.0), 0, 255)
+                f.write(rec.tobytes())
+
+    def write_npz(self, path):
+        """points (+ colors) в .npz; np.savez пишет memmap кусками, не копируя его целиком."""
+        arrays = dict(points=self.points)
+        if self.colors is not None:
+            arrays["colors"] = self.colors
+        np.savez(path, **arrays)
+
+    def to_o3d(self, max_points: int = DISPLAY_POINTS):
+        """o3d.geometry.PointCloud для окна или для Open3D-шагов (Poisson); большие
+           облака — каждая k-я точка. Файлы шагов пишутся из memmap (write_ply / write_npz)."""
+        import open3d as o3d
+
+        step = max(1, -(-len(self) // max_points))
+        pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(np.array(self.points[::step])))
+        if self.colors is not None:
+            pcd.colors = o3d.utility.Vector3dVector(np.array(self.colors[::step]))
+        return pcd
@@ -0,0 +1,158 @@
+"""Кэш очищенных мешей для Step 1 в assn5.py.
+
+Ключ — sha256 содержимого файла модели + параметры очистки (CLEAN_PARAMS) +
+версия формата. Значение — каталог .cache/meshes/<ключ>/ с сырыми массивами
+numpy (vertices.npy float64, triangles.npy int32, colors.npy при цветах вершин),
+которые читаются через mmap без разбора текста. Переименованный или
+скопированный файл находит ту же запись; изменённый — получает новую.
+
+Текстуры/материалы не сохраняются: дальше Step 1 в assn5.py используется только
+геометрия. assignment5/main.py кэш не использует — там Step 1 показывает модель с
+текстурами, как её читает Open3D.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+BASE = Path(__file__).resolve().parent
+CACHE_DIR = BASE / ".cache" / "meshes"
+MAX_BYTES = int(os.environ.get("MESH_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+ENABLED = os.environ.get("MESH_CACHE", "1") != "0"
+FORMAT_VERSION = 1
+
+# что делает load_and_triangulate; поменяли очистку — поменялся ключ
+CLEAN_PARAMS = dict(
+    force="mesh",
+    triangulate=True,
+    remove_infinite_values=True,
+    remove_duplicate_faces=True,
+    remove_degenerate_faces=True,
+)
+
+
+def file_digest(path: Path, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(chunk):
+            h.update(block)
+    return h.hexdigest()
+
+
+def mesh_key(path: Path, params: dict = None) -> str:
+    raw = json.dumps([file_digest(path), params or CLEAN_PARAMS, FORMAT_VERSION], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def clean_mesh(path: Path, params: dict = None) -> tuple:
+    """trimesh: загрузка, триангуляция, чистка. Возвращает (vertices, triangles, colors|None)."""
+    import trimesh
+
+    params = params or CLEAN_PARAMS
+    mesh = trimesh.load(path, force=params["force"])
+    if params["triangulate"]:
+        if hasattr(mesh, "triangulate"):
+            mesh = mesh.triangulate()
+            print("✅ Triangulated successfully.")
+        else:
+            print("⚠️ Triangulation not available.")
+    if params["remove_infinite_values"]:
+        mesh.remove_infinite_values()
+    if params["remove_duplicate_faces"]:
+        mesh.remove_duplicate_faces()
+    if params["remove_degenerate_faces"]:
+        mesh.remove_degenerate_faces()
+
+    colors = None
+    if getattr(mesh.visual, "kind", None) == "vertex":
+        colors = np.asarray(mesh.visual.vertex_colors, dtype=float)[:, :3] / 255.0
+    return (np.ascontiguousarray(mesh.vertices, dtype=np.float64),
+            np.ascontiguousarray(mesh.faces, dtype=np.int32), colors)
+
+
+def _read(entry: Path) -> tuple:
+    vertices = np.load(entry / "vertices.npy", mmap_mode="r")
+    triangles = np.load(entry / "triangles.npy", mmap_mode="r")
+    colors_path = entry / "colors.npy"
+    colors = np.load(colors_path, mmap_mode="r") if colors_path.exists() else None
+    return vertices, triangles, colors
+
+
+def _write(entry: Path, vertices, triangles, colors):
+    """Пишем во временный каталог и переименовываем: параллельные воркеры batch3d.py
+       не увидят половину записи; если запись уже есть — свою просто выбрасываем."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+    try:
+        tmp.mkdir()
+        np.save(tmp / "vertices.npy", vertices)
+        np.save(tmp / "triangles.npy", triangles)
+        if colors is not None:
+            np.save(tmp / "colors.npy", colors)
+        os.replace(tmp, entry)
+    except OSError as ex:
+        if not entry.exists():
+            print(f"[WARN] mesh cache skipped: {ex}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def evict(max_bytes: int = MAX_BYTES):
+    """LRU по времени последнего обращения к каталогу записи."""
+    entries = []
+    for d in CACHE_DIR.glob("*"):
+        if not d.is_dir() or d.suffix == ".tmp":
+            continue
+        try:
+            size = sum(f.stat().st_size for f in d.iterdir())
+            entries.append((d.stat().st_mtime, size, d))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, d in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(d, ignore_errors=True)
+        total -= size
+
+
+def clear():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def load_clean_arrays(path, params: dict = None) -> tuple:
+    """(vertices, triangles, colors|None, hit): из кэша или через clean_mesh()."""
+    path = Path(path)
+    if not ENABLED:
+        return (*clean_mesh(path, params), False)
+    entry = CACHE_DIR / mesh_key(path, params)
+    if entry.is_dir():
+        try:
+            arrays = _read(entry)
+            os.utime(entry)
+            return (*arrays, True)
+        except (OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+    arrays = clean_mesh(path, params)
+    _write(entry, *arrays)
+    evict()
+    return (*arrays, False)
+
+
+def load_mesh(path, params: dict = None):
+    """Очищенный меш как o3d.geometry.TriangleMesh (нормали не считаются)."""
+    import open3d as o3d
+
+    vertices, triangles, colors, hit = load_clean_arrays(path, params)
+    mesh = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(np.asarray(vertices)),
+        o3d.utility.Vector3iVector(np.asarray(triangles)),
+    )
+    if colors is not None:
+        mesh.vertex_colors = o3d.utility.Vector3dVector(np.asarray(colors))
+    print(f"{'✅ Mesh cache hit' if hit else '✅ Cleaned and cached'}: {Path(path).name} "
+          f"({len(vertices)} vertices, {len(triangles)} triangles)")
+    return mesh
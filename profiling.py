@@ -0,0 +1,204 @@
+"""Профиль запуска отчёта: время, CPU и пиковая память по этапам и по каждому запросу/графику.
+
+    profiling.start(cprofile_stage="export")
+    with profiling.stage("queries"):
+        with profiling.item("queries", "q1_users_by_country"):
+            ...
+    profiling.finish()   # -> exports/profile_<время>.json (+ .prof выбранного этапа)
+
+Пока start() не вызван, stage()/item() ничего не делают и почти ничего не стоят.
+Пиковая память этапа — tracemalloc (только аллокации Python/numpy, замедляет работу,
+поэтому включается лишь вместе с профилем). Элементы, которые выполняются в потоках,
+получают CPU своего потока (thread_time); графики из пула процессов присылают
+время из воркера (record()). cProfile этапа ловит и элементы в потоках пула
+(запросы): с Python 3.12 это делает сам профиль этапа (sys.monitoring общий для
+всех потоков), раньше — свой cProfile на каждый такой item(), при записи .prof
+всё сливается в один файл.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+EXPORTS = BASE / "exports"
+# с 3.12 cProfile работает через sys.monitoring: профиль этапа видит все потоки,
+# а второй Profile().enable() в потоке падает с "Another profiling tool is already active"
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+
+
+class Profiler:
+    def __init__(self, trace_memory: bool = True, cprofile_stage: str = None):
+        self.trace_memory = trace_memory
+        self.cprofile_stage = cprofile_stage
+        self.started_at = datetime.now()
+        self.stages = []
+        self.items = {}
+        self.prof_path = None
+        self._cprofiling = None     # этап, который сейчас под cProfile
+        self._stage_thread = None   # поток этого этапа: его и так видит общий профиль
+        self._thread_profs = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        prof = None
+        if name == self.cprofile_stage:
+            import cProfile
+            prof = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if prof:
+            self._cprofiling, self._stage_thread, self._thread_profs = name, threading.get_ident(), []
+            prof.enable()
+        try:
+            yield
+        finally:
+            if prof:
+                prof.disable()
+                self._cprofiling = None
+            entry = dict(name=name,
+                         wall_s=round(time.perf_counter() - wall, 4),
+                         cpu_s=round(time.process_time() - cpu, 4))
+            if self.trace_memory:
+                entry["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            with self._lock:
+                self.stages.append(entry)
+            if prof:
+                self._dump_cprofile(prof, name)
+
+    @contextmanager
+    def item(self, stage: str, name: str, **extra):
+        """Запрос / график внутри этапа; extra можно дополнить внутри блока."""
+        prof = None
+        if (PER_THREAD_CPROFILE and stage == self._cprofiling
+                and threading.get_ident() != self._stage_thread):
+            # до 3.12 профиль cProfile действует только в потоке, где включён
+            import cProfile
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError as ex:
+                # сбой профилировщика не должен ронять запрос, который он меряет
+                print(f"[WARN] cProfile in thread for {name}: {ex}")
+                prof = None
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield extra
+        finally:
+            if prof:
+                prof.disable()
+                with self._lock:
+                    self._thread_profs.append(prof)
+            self.record(stage, name, time.perf_counter() - wall, time.thread_time() - cpu, **extra)
+
+    def record(self, stage: str, name: str, wall_s: float, cpu_s: float, **extra):
+        entry = dict(name=name, wall_s=round(wall_s, 4), cpu_s=round(cpu_s, 4), **extra)
+        with self._lock:
+            self.items.setdefault(stage, []).append(entry)
+
+    def _dump_cprofile(self, prof, name: str):
+        import pstats
+
+        EXPORTS.mkdir(parents=True, exist_ok=True)
+        self.prof_path = EXPORTS / f"profile_{self.started_at:%Y%m%d_%H%M%S}_{name}.prof"
+        stats = pstats.Stats(prof)
+        for thread_prof in self._thread_profs:
+            stats.add(thread_prof)
+        stats.dump_stats(self.prof_path)
+        threads = f" + {len(self._thread_profs)} worker-thread items" if self._thread_profs else ""
+        print(f"[OK] cProfile of stage '{name}'{threads} -> {self.prof_path.name} "
+              f"(python -m pstats {self.prof_path.name}); top 15 by cumulative time:")
+        stats.sort_stats("cumulative").print_stats(15)
+
+    def report(self) -> dict:
+        out = dict(
+            started_at=self.started_at.isoformat(timespec="seconds"),
+            pid=os.getpid(),
+            total=dict(wall_s=round(time.perf_counter() - self._t0, 4),
+                       cpu_s=round(time.process_time() - self._cpu0, 4)),
+            stages=self.stages,
+            items=self.items,
+        )
+        if self.trace_memory:
+            # reset_peak() в каждом этапе: пик всего запуска — максимум по этапам
+            peaks = [s["peak_mb"] for s in self.stages] + [tracemalloc.get_traced_memory()[1] / 2**20]
+            out["total"]["peak_mb"] = round(max(peaks), 2)
+        if self.prof_path:
+            out["cprofile"] = {"stage": self.cprofile_stage, "path": self.prof_path.name}
+        return out
+
+    def print_summary(self):
+        print("\nstage              wall, s    cpu, s   peak, MB")
+        for s in self.stages:
+            peak = f"{s['peak_mb']:10.1f}" if "peak_mb" in s else f"{'-':>10}"
+            print(f"{s['name']:<17} {s['wall_s']:8.2f} {s['cpu_s']:9.2f} {peak}")
+        for stage, items in self.items.items():
+            slowest = max(items, key=lambda i: i["wall_s"])
+            print(f"slowest in {stage}: {slowest['name']} ({slowest['wall_s']:.2f}s)")
+
+    def write(self, path: Path = None) -> Path:
+        EXPORTS.mkdir(parents=True, exist_ok=True)
+        path = path or EXPORTS / f"profile_{self.started_at:%Y%m%d_%H%M%S}.json"
+        path.write_text(json.dumps(self.report(), indent=2, ensure_ascii=False), encoding="utf-8")
+        return path
+
+
+_active = None
+
+
+def start(trace_memory: bool = True, cprofile_stage: str = None) -> Profiler:
+    global _active
+    _active = Profiler(trace_memory=trace_memory, cprofile_stage=cprofile_stage)
+    return _active
+
+
+def active() -> bool:
+    return _active is not None
+
+
+@contextmanager
+def stage(name: str):
+    if _active is None:
+        yield
+        return
+    with _active.stage(name):
+        yield
+
+
+@contextmanager
+def item(stage_name: str, name: str, **extra):
+    if _active is None:
+        yield extra
+        return
+    with _active.item(stage_name, name, **extra) as extra:
+        yield extra
+
+
+def record(stage_name: str, name: str, wall_s: float, cpu_s: float, **extra):
+    if _active is not None:
+        _active.record(stage_name, name, wall_s, cpu_s, **extra)
+
+
+def finish(path: Path = None):
+    """Пишет JSON-отчёт и сводку в консоль; профиль выключается."""
+    global _active
+    if _active is None:
+        return None
+    prof, _active = _active, None
+    prof.print_summary()
+    path = prof.write(path)
+    if prof.trace_memory:
+        tracemalloc.stop()
+    print(f"[OK] Timing report -> {path.name}")
+    return path
@@ -0,0 +1,157 @@
+"""Чтение результатов SQL: дисковый кэш (Parquet) и потоковое чтение кусками.
+
+Ключ — нормализованный текст запроса + параметры + версии всех таблиц, из
+которых он читает (data_versions из setup_db.py, rollup_state из rollups.py).
+Любая запись в таблицу меняет версию, поэтому старые результаты просто перестают
+находиться и со временем вытесняются по LRU.
+
+Большие результаты лучше не кэшировать, а читать через stream_sql(): серверный
+курсор отдаёт строки кусками, память ограничена размером куска.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import instrumentation
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+BASE = Path(__file__).resolve().parent
+CACHE_DIR = BASE / ".cache" / "queries"
+MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+ENABLED = os.environ.get("QUERY_CACHE", "1") != "0"
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", 50_000))
+
+_RELATION = re.compile(r"\b(?:from|join)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+
+def normalize(sql: str) -> str:
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def relations(sql: str) -> list:
+    return sorted({m.lower() for m in _RELATION.findall(sql)})
+
+
+def fingerprint(conn, tables: list):
+    """Версии таблиц запроса или None, если счётчиков в базе нет (кэш не используем)."""
+    from sqlalchemy import text
+
+    if conn.execute(text("SELECT to_regclass('data_versions') IS NULL")).scalar():
+        return None
+    rows = conn.execute(text("""
+        SELECT table_name, version FROM data_versions WHERE table_name = ANY(:t)
+    """), {"t": tables}).fetchall()
+    if conn.execute(text("SELECT to_regclass('rollup_state') IS NOT NULL")).scalar():
+        rows += conn.execute(text("""
+            SELECT name, source_version FROM rollup_state WHERE name = ANY(:t)
+        """), {"t": tables}).fetchall()
+    return json.dumps(sorted((str(n), int(v)) for n, v in rows))
+
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def evict(max_bytes: int = MAX_BYTES):
+    """LRU по времени последнего обращения (mtime обновляется при попадании)."""
+    files = []
+    for p in CACHE_DIR.glob("*.parquet"):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        files.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files):
+        if total <= max_bytes:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+
+
+def clear():
+    for p in CACHE_DIR.glob("*.parquet"):
+        p.unlink(missing_ok=True)
+
+
+def read_sql(sql: str, e, params=None) -> "pd.DataFrame":
+    """Как pd.read_sql(sql, e, params=params), но с кэшем на диске."""
+    import pandas as pd
+
+    if not ENABLED or not _parquet_available():
+        return pd.read_sql(sql, e, params=params)
+
+    with e.connect() as conn, instrumentation.query_name("query_cache.fingerprint"):
+        fp = fingerprint(conn, relations(sql))
+    if fp is None:
+        return pd.read_sql(sql, e, params=params)
+
+    raw_key = json.dumps([normalize(sql), params, fp], sort_keys=True, default=str)
+    path = CACHE_DIR / (hashlib.sha256(raw_key.encode("utf-8")).hexdigest() + ".parquet")
+    if path.exists():
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path)
+            return df
+        except (OSError, ValueError):
+            path.unlink(missing_ok=True)
+
+    df = pd.read_sql(sql, e, params=params)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{id(df)}.tmp")
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    except (OSError, ValueError, TypeError, NotImplementedError) as ex:
+        # не всё сериализуется в Parquet (например, смешанные типы) — просто не кэшируем
+        tmp.unlink(missing_ok=True)
+        print(f"[WARN] query cache skipped: {ex}")
+    evict()
+    return df
+
+
+def stream_sql(sql: str, e, chunk_rows: int = STREAM_CHUNK_ROWS, params=None, name: str = None):
+    """Генератор DataFrame-кусков по chunk_rows строк.
+       stream_results=True заставляет psycopg2 открыть именованный (server-side)
+       курсор, так что весь результат никогда не лежит в памяти клиента."""
+    import pandas as pd
+
+    with e.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows)
+        if name:
+            # генератор живёт дольше любого with query_name(): имя передаём явно
+            conn = conn.execution_options(query_name=name)
+        # метрики запроса — за весь поток, а не за DECLARE (instrumentation.stream_finished)
+        total, error = 0, None
+        try:
+            result = conn.exec_driver_sql(sql, params) if params else conn.exec_driver_sql(sql)
+            columns = list(result.keys())
+            for rows in result.partitions(chunk_rows):
+                total += len(rows)
+                # coerce_float — как у pd.read_sql: Decimal из AVG() -> float
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            instrumentation.stream_finished(conn, total, error)
+
+
+class StreamedQuery:
+    """Повторно итерируемый stream_sql: каждый проход заново открывает курсор.
+       Подходит как значение dfs для export_to_excel / export_to_parquet."""
+
+    def __init__(self, sql: str, e, chunk_rows: int = STREAM_CHUNK_ROWS, name: str = None):
+        self.sql, self.e, self.chunk_rows, self.name = sql, e, chunk_rows, name
+
+    def __iter__(self):
+        return stream_sql(self.sql, self.e, self.chunk_rows, name=self.name)
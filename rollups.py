@@ -0,0 +1,219 @@
+"""Сводные таблицы (materialized views) для графиков и дашбордов.
+
+Каждый rollup заменяет один именованный запрос из sql/new_queries.sql:
+redirect() подменяет SQL на чтение из сводки, если она создана и не устарела.
+refresh() обновляет только те сводки, у которых поменялись исходные таблицы
+(по счётчикам data_versions из setup_db.py).
+
+refresh() — запись на primary, в пути отчёта его нет: сводки обновляет загрузка
+(import_data.py, cli.py load) и отдельный запуск по расписанию, например
+    */5 * * * *  python rollups.py
+или долгоживущий процесс рядом с auto_insert.py: python rollups.py --every 300.
+Тот же запуск сворачивает журнал data_changes, поэтому он нужен и без сводок.
+Пока сводка не обновлена, отчёт читает исходные таблицы — данные не устаревают.
+"""
+import argparse
+import time
+
+ROLLUPS = {
+    "rollup_users_by_country": dict(
+        replaces="q1_users_by_country",
+        sources=("users", "locations", "countries"),
+        unique=("country",),
+        sql="""
+            SELECT c.name AS country, COUNT(u.id) AS user_count
+            FROM users u
+            JOIN locations l ON u.locationid = l.id
+            JOIN countries c ON l.countryid = c.id
+            GROUP BY c.name
+        """,
+        select="SELECT country, user_count FROM rollup_users_by_country",
+    ),
+    "rollup_events_by_genre": dict(
+        replaces="q2_events_by_genre",
+        sources=("events", "genres"),
+        unique=("genre",),
+        sql="""
+            SELECT g.name AS genre, COUNT(e.id) AS event_count
+            FROM events e
+            JOIN genres g ON e.genreid = g.id
+            GROUP BY g.name
+        """,
+        select="SELECT genre, event_count FROM rollup_events_by_genre",
+    ),
+    "rollup_events_by_month": dict(
+        replaces="q4_events_by_month",
+        sources=("events",),
+        unique=("month",),
+        sql="""
+            SELECT DATE_TRUNC('month', e.date) AS month, COUNT(*) AS event_count
+            FROM events e
+            GROUP BY month
+        """,
+        select="SELECT month, event_count FROM rollup_events_by_month ORDER BY month",
+    ),
+    "rollup_rating_by_genre": dict(
+        replaces="q9_avg_rating_by_genre",
+        sources=("eventhistory", "events", "genres"),
+        unique=("genre",),
+        sql="""
+            SELECT g.name AS genre, SUM(eh.rate) AS rate_sum, COUNT(eh.rate) AS rate_count
+            FROM eventhistory eh
+            JOIN events e ON eh.eventid = e.id
+            JOIN genres g ON e.genreid = g.id
+            WHERE eh.rate IS NOT NULL
+            GROUP BY g.name
+        """,
+        select="SELECT genre, rate_sum::numeric / rate_count AS avg_rating FROM rollup_rating_by_genre",
+    ),
+    "rollup_artist_attendance_by_country": dict(
+        replaces="q10_artist_popularity_by_country",
+        sources=("eventhistory", "events", "eventartists", "artists", "locations", "countries"),
+        unique=("artist", "country"),
+        sql="""
+            SELECT a.name AS artist, c.name AS country, COUNT(eh.id) AS attendance
+            FROM eventhistory eh
+            JOIN events e ON eh.eventid = e.id
+            JOIN eventartists ea ON ea.eventid = e.id
+            JOIN artists a ON ea.artistid = a.id
+            JOIN locations l ON e.locationid = l.id
+            JOIN countries c ON l.countryid = c.id
+            WHERE eh.hasattended = 1
+            GROUP BY a.name, c.name
+        """,
+        select=("SELECT artist, country, attendance FROM rollup_artist_attendance_by_country "
+                "ORDER BY attendance DESC"),
+    ),
+}
+
+ROLLUP_STATE = """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+    name VARCHAR PRIMARY KEY,
+    source_version BIGINT NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+
+def base_name(qname: str) -> str:
+    """'q1_users_by_country(Pie Chart)' -> 'q1_users_by_country'."""
+    return qname.split("(")[0].strip()
+
+
+def install(conn):
+    """Создаёт сводки (если их ещё нет) и уникальные индексы для REFRESH CONCURRENTLY."""
+    from setup_db import create_data_versions
+
+    create_data_versions(conn)
+    cur = conn.cursor()
+    cur.execute(ROLLUP_STATE)
+    for name, r in ROLLUPS.items():
+        cur.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {r['sql']};")
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({', '.join(r['unique'])});")
+        print(f"[OK] {name}")
+    conn.commit()
+    cur.close()
+
+
+def installed(cur) -> set:
+    cur.execute("SELECT matviewname FROM pg_matviews WHERE ispopulated AND matviewname = ANY(%s);",
+                (list(ROLLUPS),))
+    return {r[0] for r in cur.fetchall()}
+
+
+def source_version(cur, tables) -> int:
+    cur.execute("SELECT COALESCE(SUM(version), 0) FROM data_versions WHERE table_name = ANY(%s);",
+                (list(tables),))
+    return int(cur.fetchone()[0])
+
+
+def refresh(conn, force: bool = False) -> list:
+    """Обновляет сводки, чьи исходные таблицы менялись с прошлого refresh.
+       CONCURRENTLY — дашборды продолжают читать старые данные, пока идёт пересчёт.
+       В конце сворачивает журнал data_changes — даже без сводок: его суммирует
+       каждая проверка версий (query_cache, cli.py), а растёт он на каждый оператор записи."""
+    from setup_db import compact_data_changes
+
+    cur = conn.cursor()
+    names = installed(cur)
+    if not names:
+        cur.close()
+        conn.rollback()
+        compact_data_changes(conn)
+        return []
+    cur.execute("SELECT name, source_version FROM rollup_state;")
+    seen = dict(cur.fetchall())
+    refreshed = []
+    for name in ROLLUPS:
+        if name not in names:
+            continue
+        version = source_version(cur, ROLLUPS[name]["sources"])
+        if not force and seen.get(name) == version:
+            continue
+        cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name};")
+        cur.execute("""
+            INSERT INTO rollup_state (name, source_version, refreshed_at) VALUES (%s, %s, now())
+            ON CONFLICT (name) DO UPDATE
+            SET source_version = EXCLUDED.source_version, refreshed_at = EXCLUDED.refreshed_at;
+        """, (name, version))
+        conn.commit()
+        refreshed.append(name)
+        print(f"[OK] refreshed {name}")
+    cur.close()
+    conn.commit()
+    compact_data_changes(conn)
+    return refreshed
+
+
+def fresh(cur) -> set:
+    """Созданные сводки, обновлённые после последнего изменения своих таблиц."""
+    names = installed(cur)
+    if not names:
+        return set()
+    cur.execute("SELECT to_regclass('rollup_state') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT name, source_version FROM rollup_state;")
+    seen = dict(cur.fetchall())
+    return {n for n in names if seen.get(n) == source_version(cur, ROLLUPS[n]["sources"])}
+
+
+def redirect(queries: dict, conn) -> dict:
+    """Возвращает копию queries, где запросы с актуальной сводкой читают из неё;
+       устаревшие сводки пропускаются (запрос идёт к исходным таблицам)."""
+    cur = conn.cursor()
+    names = fresh(cur)
+    cur.close()
+    conn.rollback()
+    by_query = {r["replaces"]: (name, r) for name, r in ROLLUPS.items() if name in names}
+    out = {}
+    for qname, sql in queries.items():
+        hit = by_query.get(base_name(qname))
+        out[qname] = hit[1]["select"] if hit else sql
+    return out
+
+
+def main():
+    from setup_db import connect
+
+    parser = argparse.ArgumentParser(description="Materialized rollups for the dashboard queries")
+    parser.add_argument("--install", action="store_true", help="create the rollup views")
+    parser.add_argument("--force", action="store_true", help="refresh every rollup")
+    parser.add_argument("--every", type=int, default=0, metavar="SECONDS",
+                        help="keep running and refresh changed rollups every N seconds")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.install:
+            install(conn)
+        refresh(conn, force=args.force)
+        while args.every:
+            time.sleep(args.every)
+            refresh(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
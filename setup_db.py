@@ -1,29 +1,13 @@
-import psycopg2
-
-hostname='localhost'
-database='techno musin events'
-username='postgres'
-pwd='1234'
-port_id=5432
-conn=None
-cur=None
-
-try:
-    conn = psycopg2.connect(
-            dbname=database,
-            user=username,
-            password=pwd,
-            host=hostname,
-            port=port_id)
-    
-    cur = conn.cursor()
+import argparse
+import json
+import re
+from datetime import date
 
+import psycopg2
 
-    
-
-    cur.execute("DROP TABLE IF EXISTS eventhistory CASCADE;")
+from config import dbapi_params
 
-    cur.execute("""
+SCHEMA = """
     CREATE TABLE countries (
     id SERIAL PRIMARY KEY,
     name VARCHAR NOT NULL
@@ -38,10 +22,10 @@ try:
     id SERIAL PRIMARY KEY,
     name VARCHAR NOT NULL,
     countryid INT REFERENCES countries(id) ON DELETE CASCADE
-);  
-    
-    
-    
+);
+
+
+
     CREATE TABLE users (
     id SERIAL PRIMARY KEY,
     username VARCHAR NOT NULL,
@@ -80,7 +64,7 @@ try:
     eventid INT REFERENCES events(id) ON DELETE CASCADE,
     artistid INT REFERENCES artists(id) ON DELETE CASCADE
 );
-    
+
     CREATE TABLE eventhistory (
     id SERIAL PRIMARY KEY,
     userid INT REFERENCES users(id) ON DELETE CASCADE,
@@ -101,15 +85,346 @@ try:
     userid INT REFERENCES users(id) ON DELETE CASCADE,
     genreid INT REFERENCES genres(id) ON DELETE CASCADE
 );
-""")
+"""
+
+# Вариант схемы с помесячными партициями: events по date, eventhistory по eventdate.
+# PK партиционированной таблицы обязан включать ключ партиционирования, поэтому
+# ссылки на events идут по (id, date), а eventhistory/eventartists хранят дату события
+# (ON UPDATE CASCADE — дата события меняется; перенос при загрузке см.
+# import_data.move_rescheduled).
+PARTITIONED_TABLES = """
+    CREATE TABLE events (
+    id SERIAL,
+    name VARCHAR NOT NULL,
+    description VARCHAR,
+    venue VARCHAR,
+    date TIMESTAMP NOT NULL,
+    coverurl VARCHAR,
+    locationid INT REFERENCES locations(id) ON DELETE SET NULL,
+    genreid INT REFERENCES genres(id) ON DELETE SET NULL,
+    PRIMARY KEY (id, date)
+) PARTITION BY RANGE (date);
+
+    CREATE TABLE events_default PARTITION OF events DEFAULT;
+
+    CREATE TABLE eventartists (
+    id SERIAL PRIMARY KEY,
+    eventid INT,
+    eventdate TIMESTAMP NOT NULL,
+    artistid INT REFERENCES artists(id) ON DELETE CASCADE,
+    FOREIGN KEY (eventid, eventdate) REFERENCES events(id, date) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+    CREATE TABLE eventhistory (
+    id SERIAL,
+    userid INT REFERENCES users(id) ON DELETE CASCADE,
+    eventid INT,
+    eventdate TIMESTAMP NOT NULL,
+    rate SMALLINT CHECK (rate BETWEEN 0 AND 5),
+    hasattended SMALLINT CHECK (hasattended IN (0,1)),
+    isinterested SMALLINT CHECK (isinterested IN (0,1)),
+    PRIMARY KEY (id, eventdate),
+    FOREIGN KEY (eventid, eventdate) REFERENCES events(id, date) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (eventdate);
+
+    CREATE TABLE eventhistory_default PARTITION OF eventhistory DEFAULT;
+"""
+
+# таблица -> колонка, по которой она режется на месяцы
+PARTITION_KEYS = {"events": "date", "eventhistory": "eventdate"}
+
+# Счётчик изменений по таблицам: statement-триггер при любом INSERT/UPDATE/DELETE/
+# TRUNCATE добавляет строку в журнал data_changes (одна строка на оператор, не на
+# строку данных). Только INSERT, без upsert одной «горячей» строки — параллельные
+# писатели в одну таблицу не ждут друг друга на её блокировке. version в
+# data_versions — число изменений (SUM(bumps)), а не максимум номера: изменение
+# из транзакции, закоммиченной позже, всё равно увеличит его. По нему rollups.py
+# понимает, что пора обновить сводные таблицы, а query_cache.py — что кэш устарел.
+# compact_data_changes() сворачивает журнал в одну строку на таблицу.
+DATA_CHANGES = """
+    CREATE TABLE IF NOT EXISTS data_changes (
+    id BIGSERIAL PRIMARY KEY,
+    table_name VARCHAR NOT NULL,
+    bumps BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+DATA_VERSIONS = DATA_CHANGES + """
+    CREATE INDEX IF NOT EXISTS idx_data_changes_table ON data_changes (table_name);
+
+    CREATE OR REPLACE VIEW data_versions AS
+    SELECT table_name, SUM(bumps)::bigint AS version, MAX(changed_at) AS changed_at
+    FROM data_changes
+    GROUP BY table_name;
+
+    CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO data_changes (table_name) VALUES (TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# прежняя схема: data_versions — таблица с одной строкой на таблицу (счётчик переносим)
+MIGRATE_DATA_VERSIONS = DATA_CHANGES + """
+    INSERT INTO data_changes (table_name, bumps, changed_at)
+    SELECT table_name, version, changed_at FROM data_versions WHERE version > 0;
+    DROP TABLE data_versions;
+"""
+
+DATA_TABLES = [
+    "countries", "genres", "locations", "users", "artists",
+    "events", "eventartists", "eventhistory", "favoriteartists", "favoritegenres",
+]
+
+# Индексы под запросы из sql/new_queries.sql (в комментарии — кому нужен).
+# Строятся CONCURRENTLY уже после загрузки данных, см. create_indexes().
+INDEXES = [
+    # q1, q8: users -> locations -> countries
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_locationid ON users (locationid)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_locations_countryid ON locations (countryid)",
+    # q2, q9: events -> genres;  q10: events -> locations
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_genreid ON events (genreid)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_locationid ON events (locationid)",
+    # q4 и окно по времени в main.py
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_date ON events (date)",
+    # q3, q10: eventartists в обе стороны
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventartists_eventid ON eventartists (eventid) INCLUDE (artistid)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventartists_artistid ON eventartists (artistid) INCLUDE (eventid)",
+    # q9: оценки по событию
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventhistory_eventid ON eventhistory (eventid) INCLUDE (rate)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventhistory_userid ON eventhistory (userid)",
+    # q6, q10: только посещённые события (hasattended = 1)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventhistory_attended_user ON eventhistory (userid) INCLUDE (rate, eventid) WHERE hasattended = 1",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_eventhistory_attended_event ON eventhistory (eventid) WHERE hasattended = 1",
+    # q7, q8
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_favoritegenres_userid ON favoritegenres (userid) INCLUDE (genreid)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_favoriteartists_userid ON favoriteartists (userid) INCLUDE (artistid)",
+]
+
+
+def connect():
+    # DDL и индексы — на primary (config.py, роль writer)
+    return psycopg2.connect(**dbapi_params("writer"))
+
 
+def partitioned_schema() -> str:
+    """SCHEMA, в котором events/eventartists/eventhistory заменены на PARTITIONED_TABLES."""
+    start = SCHEMA.index("    CREATE TABLE events (")
+    end = SCHEMA.index("    CREATE TABLE favoriteartists (")
+    return SCHEMA[:start] + PARTITIONED_TABLES + "\n" + SCHEMA[end:]
+
+
+def create_tables(conn, partitioned: bool = False):
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS eventhistory CASCADE;")
+    cur.execute(partitioned_schema() if partitioned else SCHEMA)
+    conn.commit()
+    cur.close()
+    create_data_versions(conn)
+    if partitioned:
+        today = date.today()
+        ensure_partitions(conn, today, add_months(today, 3))
+
+
+def create_data_versions(conn):
+    """Идемпотентно: можно вызывать и на уже существующей базе (в том числе со
+       старой таблицей data_versions — её счётчики переносятся в журнал)."""
+    cur = conn.cursor()
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('data_versions');")
+    row = cur.fetchone()
+    if row and row[0] == "r":
+        cur.execute(MIGRATE_DATA_VERSIONS)
+    cur.execute(DATA_VERSIONS)
+    for t in DATA_TABLES:
+        cur.execute(f"DROP TRIGGER IF EXISTS {t}_data_version ON {t};")
+        cur.execute(f"""
+            CREATE TRIGGER {t}_data_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {t}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+        """)
+    conn.commit()
+    cur.close()
+
+
+def compact_data_changes(conn) -> int:
+    """Сворачивает журнал data_changes в одну строку на таблицу; сумма bumps (то есть
+       version) не меняется. Ещё не закоммиченные строки других транзакций не видны
+       и не трогаются — они добавятся к сумме после коммита. Возвращает число удалённых строк."""
+    cur = conn.cursor()
+    cur.execute("""
+        WITH removed AS (
+            DELETE FROM data_changes RETURNING table_name, bumps, changed_at
+        ), folded AS (
+            INSERT INTO data_changes (table_name, bumps, changed_at)
+            SELECT table_name, SUM(bumps), MAX(changed_at) FROM removed GROUP BY table_name
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM removed) - (SELECT COUNT(*) FROM folded);
+    """)
+    removed = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return removed
+
+
+def is_partitioned(cur, table: str) -> bool:
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def add_months(d: date, n: int) -> date:
+    m = d.year * 12 + d.month - 1 + n
+    return date(m // 12, m % 12 + 1, 1)
+
+
+def month_range(start: date, end: date):
+    d = date(start.year, start.month, 1)
+    while d <= end:
+        yield d
+        d = add_months(d, 1)
+
+
+def ensure_partitions(conn, start: date, end: date):
+    """Создаёт недостающие месячные партиции events/eventhistory на [start, end].
+       Если за этот месяц уже есть строки в *_default, Postgres не даст создать
+       партицию — такой месяц пропускаем с предупреждением."""
+    cur = conn.cursor()
+    for table, key in PARTITION_KEYS.items():
+        if not is_partitioned(cur, table):
+            continue
+        for month in month_range(start, end):
+            name = f"{table}_{month:%Y_%m}"
+            lo, hi = month, add_months(month, 1)
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,))
+            if cur.fetchone()[0]:
+                continue
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table}_default "
+                        f"WHERE {key} >= %s AND {key} < %s);", (lo, hi))
+            if cur.fetchone()[0]:
+                print(f"[WARN] {table}_default already has rows for {month:%Y-%m}, partition not created")
+                continue
+            cur.execute(f"CREATE TABLE {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM (%s) TO (%s);", (lo, hi))
+            print(f"[OK] partition {name}")
     conn.commit()
-except Exception as error:
-    print(error)
-finally:
-    if cur is not None:
+    cur.close()
+
+
+def detach_old_partitions(conn, before: date) -> list:
+    """Отцепляет месячные партиции eventhistory старше before: это операция над
+       каталогом, данные не переписываются, таблицу потом можно архивировать/удалить.
+       Партиции events не трогаем — на них ссылается eventartists."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'eventhistory'::regclass
+          AND c.relname ~ '^eventhistory_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname;
+    """)
+    detached = []
+    for (name,) in cur.fetchall():
+        year, month = map(int, name.rsplit("_", 2)[1:])
+        if date(year, month, 1) < date(before.year, before.month, 1):
+            cur.execute(f"ALTER TABLE eventhistory DETACH PARTITION {name};")
+            detached.append(name)
+            print(f"[OK] detached {name}")
+    conn.commit()
+    cur.close()
+    return detached
+
+
+def create_indexes(conn):
+    """CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции,
+       поэтому временно включаем autocommit. На партиционированных таблицах
+       CONCURRENTLY не поддерживается — там индекс строится обычным образом."""
+    old = conn.autocommit
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        for ddl in INDEXES:
+            table = re.search(r" ON (\w+)", ddl).group(1)
+            if is_partitioned(cur, table):
+                ddl = ddl.replace(" CONCURRENTLY", "")
+            cur.execute(ddl)
+            print(f"[OK] {ddl.split(' IF NOT EXISTS ')[1].split(' ON ')[0]}")
+        cur.execute("ANALYZE;")
+    finally:
         cur.close()
-    if conn is not None:
-        conn.close()
+        conn.autocommit = old
+
+
+def _seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def check_plans(conn) -> dict:
+    """EXPLAIN для каждого именованного запроса; печатает, где остались Seq Scan.
+       На маленьком архиве планировщик честно выбирает seq scan — смотреть на больших данных."""
+    from analytics import SQL_FILE, load_queries
+
+    cur = conn.cursor()
+    report = {}
+    for name, sql in load_queries(SQL_FILE).items():
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        report[name] = _seq_scans(plan[0]["Plan"])
+        status = "seq scan on " + ", ".join(report[name]) if report[name] else "no seq scans"
+        print(f"{name:<45} {status}")
+    cur.close()
+    conn.rollback()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the techno events schema")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="create events/eventhistory as monthly range partitions")
+    parser.add_argument("--partitions", nargs=2, metavar=("FROM", "TO"),
+                        help="create missing monthly partitions, e.g. 2024-01 2026-12")
+    parser.add_argument("--detach-before", metavar="YYYY-MM",
+                        help="detach eventhistory partitions older than this month")
+    parser.add_argument("--indexes", action="store_true",
+                        help="build the query indexes (run after the data is loaded)")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="report which named queries still use sequential scans")
+    args = parser.parse_args()
+
+    conn = None
+    try:
+        conn = connect()
+        if args.partitions or args.detach_before or args.indexes or args.check_plans:
+            if args.partitions:
+                start, end = (date.fromisoformat(m + "-01") for m in args.partitions)
+                ensure_partitions(conn, start, end)
+            if args.detach_before:
+                detach_old_partitions(conn, date.fromisoformat(args.detach_before + "-01"))
+            if args.indexes:
+                create_indexes(conn)
+            if args.check_plans:
+                check_plans(conn)
+            return
+        create_tables(conn, partitioned=args.partitioned)
+    except Exception as error:
+        print(error)
+        return
+    finally:
+        if conn is not None:
+            conn.close()
+
+    print("All the tables have been created succesfully!")
+
 
-print("All the tables have been created succesfully!")
+if __name__ == "__main__":
+    main()
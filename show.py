@@ -1,10 +1,13 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from sqlalchemy import create_engine, text
 import uuid
-from config import DB_URI
+# matplotlib и sqlalchemy — внутри функций: import show не тянет их и не
+# подключается к базе (см. python bench.py importtime)
+from config import get_engine
+import query_cache
 
-engine = create_engine(DB_URI)
+def _engine():
+    # демо читает сразу после своей же записи: реплика могла ещё не догнать primary,
+    # поэтому и графики строим по writer
+    return get_engine("writer")
 
 sql_chart = """
 SELECT g.name AS genre, COUNT(e.id) AS events_count
@@ -15,7 +18,10 @@ ORDER BY events_count DESC;
 """
 
 def plot_events_by_genre(msg):
-    df = pd.read_sql(sql_chart, engine)
+    # кэш сам увидит вставку/удаление: триггер data_versions меняет ключ
+    import matplotlib.pyplot as plt
+
+    df = query_cache.read_sql(sql_chart, _engine())
     df.plot.bar(x="genre", y="events_count", legend=False)
     plt.title(f"Events by Genre ({msg})")
     plt.xlabel("Genre"); plt.ylabel("Events")
@@ -24,28 +30,36 @@ def plot_events_by_genre(msg):
     return df
 
 def insert_demo_event():
-    with engine.begin() as conn:
+    from sqlalchemy import text
+
+    with _engine().begin() as conn:
         conn.execute(text("""
             INSERT INTO events (name, description, venue, date, locationid, genreid)
             VALUES (:name, 'demo insert', 'Hall A', '2025-10-01', 6, 3);
         """), {"name": f"Demo-{uuid.uuid4().hex[:6]}"})   # уникальное имя
 
 def delete_demo_events():
-    with engine.begin() as conn:
+    from sqlalchemy import text
+
+    with _engine().begin() as conn:
         conn.execute(text("DELETE FROM events WHERE description = 'demo insert';"))
 
-# === Демонстрация ===
-print("До вставки:")
-plot_events_by_genre("Before")
+def main():
+    # === Демонстрация ===
+    print("До вставки:")
+    plot_events_by_genre("Before")
+
+    print("Добавляем событие...")
+    insert_demo_event()
 
-print("Добавляем событие...")
-insert_demo_event()
+    print("После вставки:")
+    plot_events_by_genre("After Insert")
 
-print("После вставки:")
-plot_events_by_genre("After Insert")
+    print("Удаляем событие...")
+    delete_demo_events()
 
-print("Удаляем событие...")
-delete_demo_events()
+    print("После удаления:")
+    plot_events_by_genre("After Delete")
 
-print("После удаления:")
-plot_events_by_genre("After Delete")
+if __name__ == "__main__":
+    main()
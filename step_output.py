@@ -0,0 +1,163 @@
+"""Вывод шагов 3D-пайплайна (assn5.py, assignment5/main.py): окно Open3D или файлы.
+
+    out = StepOutput(model_path, out_dir=None)      # None — как раньше, окно на каждом шаге
+    ...
+    out.show("step1_original", "Step 1 – Original Model", [mesh])
+    out.note(voxel_size=voxel_size)
+    out.finish()
+
+С out_dir (--headless OUTDIR) окон нет: геометрия шага пишется в OUTDIR/<модель>/
+(PLY или NPZ), а в stats.json — число вершин / треугольников / точек по шагам,
+время каждого шага и величины из note() (размер вокселя, экстремумы Z и т.п.).
+Время шага — от предыдущего show() до текущего, без отрисовки и записи файлов.
+Среди geoms может быть MemmapCloud (assn5.py --ooc): в файл и в stats.json идёт всё
+облако, в окно — прореженное to_o3d().
+"""
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from memmap_cloud import MemmapCloud
+
+FORMATS = ("ply", "npz")
+
+
+def _kind(g) -> str:
+    if isinstance(g, MemmapCloud):
+        return "points"
+    import open3d as o3d
+
+    if isinstance(g, o3d.geometry.TriangleMesh):
+        return "mesh"
+    if isinstance(g, o3d.geometry.PointCloud):
+        return "points"
+    if isinstance(g, o3d.geometry.VoxelGrid):
+        return "voxels"
+    raise TypeError(f"Unsupported geometry: {type(g).__name__}")
+
+
+def geometry_counts(g) -> dict:
+    if isinstance(g, MemmapCloud):
+        return dict(points=len(g))
+    kind = _kind(g)
+    if kind == "mesh":
+        return dict(vertices=len(g.vertices), triangles=len(g.triangles))
+    if kind == "points":
+        return dict(points=len(g.points))
+    return dict(voxels=len(g.get_voxels()))
+
+
+def _merge(geoms: list):
+    """Несколько мешей (или облаков) шага — в один файл: так он совпадает с окном."""
+    out = geoms[0]
+    for g in geoms[1:]:
+        out = out + g
+    return out
+
+
+def _write_npz(path: Path, g, kind: str):
+    if isinstance(g, MemmapCloud):
+        g.write_npz(path)
+        return
+    if kind == "mesh":
+        arrays = dict(vertices=np.asarray(g.vertices), triangles=np.asarray(g.triangles))
+        if g.has_vertex_colors():
+            arrays["colors"] = np.asarray(g.vertex_colors)
+        if g.has_vertex_normals():
+            arrays["normals"] = np.asarray(g.vertex_normals)
+    elif kind == "points":
+        arrays = dict(points=np.asarray(g.points))
+        if g.has_colors():
+            arrays["colors"] = np.asarray(g.colors)
+        if g.has_normals():
+            arrays["normals"] = np.asarray(g.normals)
+    else:
+        voxels = g.get_voxels()
+        arrays = dict(grid_index=np.array([v.grid_index for v in voxels], dtype=np.int32).reshape(-1, 3),
+                      colors=np.array([v.color for v in voxels], dtype=float).reshape(-1, 3),
+                      origin=np.asarray(g.origin), voxel_size=np.float64(g.voxel_size))
+    np.savez(path, **arrays)
+
+
+def _write_ply(path: Path, g, kind: str):
+    if isinstance(g, MemmapCloud):
+        g.write_ply(path)
+        return
+    import open3d as o3d
+
+    if kind == "mesh":
+        ok = o3d.io.write_triangle_mesh(str(path), g)
+    elif kind == "points":
+        ok = o3d.io.write_point_cloud(str(path), g)
+    else:
+        ok = o3d.io.write_voxel_grid(str(path), g)
+    if not ok:
+        raise OSError(f"Open3D failed to write {path}")
+
+
+class StepOutput:
+    def __init__(self, model_path, out_dir=None, fmt: str = "ply", pipeline: str = ""):
+        if fmt not in FORMATS:
+            raise ValueError(f"fmt must be one of {FORMATS}")
+        self.model_path = Path(model_path)
+        self.fmt = fmt
+        self.dir = Path(out_dir) / self.model_path.stem if out_dir else None
+        if self.dir:
+            self.dir.mkdir(parents=True, exist_ok=True)
+        self.stats = dict(model=str(self.model_path), pipeline=pipeline,
+                          started_at=datetime.now().isoformat(timespec="seconds"), steps={})
+        self._t0 = self._mark = time.perf_counter()
+
+    @property
+    def headless(self) -> bool:
+        return self.dir is not None
+
+    def note(self, **values):
+        """Величины для stats.json (numpy-скаляры и массивы приводятся к JSON)."""
+        for k, v in values.items():
+            self.stats[k] = v.tolist() if isinstance(v, (np.ndarray, np.generic)) else v
+
+    def show(self, step: str, window_name: str, geoms: list):
+        seconds = time.perf_counter() - self._mark
+        entry = self.stats["steps"][step] = dict(seconds=round(seconds, 4),
+                                                 geometry=[geometry_counts(g) for g in geoms])
+        if not self.headless:
+            import open3d as o3d
+
+            geoms = [g.to_o3d() if isinstance(g, MemmapCloud) else g for g in geoms]
+            o3d.visualization.draw_geometries(geoms, window_name=window_name)
+        else:
+            t = time.perf_counter()
+            entry["files"] = self._write(step, geoms)
+            entry["write_s"] = round(time.perf_counter() - t, 4)
+        self._mark = time.perf_counter()
+
+    def _write(self, step: str, geoms: list) -> list:
+        by_kind = {}
+        for g in geoms:
+            by_kind.setdefault(_kind(g), []).append(g)
+        files = []
+        for kind, items in by_kind.items():
+            # VoxelGrid и MemmapCloud не складываются через +: каждый — отдельным файлом
+            separate = kind == "voxels" or any(isinstance(g, MemmapCloud) for g in items)
+            groups = [[g] for g in items] if separate else [items]
+            for i, group in enumerate(groups):
+                suffix = f"_{i}" if len(groups) > 1 else ""
+                path = self.dir / f"{step}_{kind}{suffix}.{self.fmt}"
+                writer = _write_ply if self.fmt == "ply" else _write_npz
+                writer(path, _merge(group), kind)
+                files.append(path.name)
+        return files
+
+    def finish(self) -> Path:
+        """Пишет stats.json (только в headless); возвращает его путь."""
+        self.stats["total_s"] = round(time.perf_counter() - self._t0, 4)
+        if not self.headless:
+            return None
+        path = self.dir / "stats.json"
+        path.write_text(json.dumps(self.stats, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"[OK] {self.model_path.name}: {len(self.stats['steps'])} steps -> {self.dir}")
+        return path
@@ -0,0 +1,6 @@
+"""Режимы Step 4 (--voxel-mode) без numpy: их читают argparse в batch3d.py и
+assn5.py, а реализации — voxels.VOXEL_MESHERS.
+
+cubes — полный куб на воксель; surface — только грани наружу; greedy — ещё и полосы одного цвета.
+"""
+VOXEL_MODES = ("cubes", "surface", "greedy")
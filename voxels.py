@@ -0,0 +1,201 @@
+"""Воксели на чистом numpy: группировка точек по ячейкам и геометрия кубиков.
+
+Используется в assn5.py (Step 4). Open3D здесь не нужен, поэтому функции можно
+гонять на больших облаках и в bench.py (python bench.py voxel).
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from voxel_modes import VOXEL_MODES
+
+# единичный куб в том же порядке вершин и треугольников, что и
+# o3d.geometry.TriangleMesh.create_box(1, 1, 1); нормали смотрят наружу
+UNIT_CUBE_VERTICES = np.array([
+    [0, 0, 0], [1, 0, 0], [0, 0, 1], [1, 0, 1],
+    [0, 1, 0], [1, 1, 0], [0, 1, 1], [1, 1, 1],
+], dtype=float)
+UNIT_CUBE_TRIANGLES = np.array([
+    [4, 7, 5], [4, 6, 7], [0, 2, 4], [2, 6, 4], [0, 1, 2], [1, 3, 2],
+    [1, 5, 7], [1, 7, 3], [2, 3, 7], [2, 7, 6], [0, 4, 1], [1, 4, 5],
+], dtype=np.int32)
+
+
+def colormap01(t: np.ndarray) -> np.ndarray:
+    """Простой градиент R→Y→G→C→B для значений 0..1."""
+    t = np.clip(t, 0.0, 1.0)
+    c = np.zeros((t.size, 3), float)
+    seg = np.minimum(4, (t * 4).astype(int))
+    w = (t * 4) - seg
+
+    # R(1,0,0)->Y(1,1,0)
+    m = seg == 0
+    c[m] = np.stack([np.ones(m.sum()), w[m], np.zeros(m.sum())], 1)
+    # Y(1,1,0)->G(0,1,0)
+    m = seg == 1
+    c[m] = np.stack([1.0 - w[m], np.ones(m.sum()), np.zeros(m.sum())], 1)
+    # G(0,1,0)->C(0,1,1)
+    m = seg == 2
+    c[m] = np.stack([np.zeros(m.sum()), np.ones(m.sum()), w[m]], 1)
+    # C(0,1,1)->B(0,0,1)
+    m = seg >= 3
+    c[m] = np.stack([np.zeros(m.sum()), 1.0 - w[m], np.ones(m.sum())], 1)
+    return c
+
+
+class VoxelStats(NamedTuple):
+    origin: np.ndarray   # (3,) угол сетки
+    voxel_size: float
+    keys: np.ndarray     # (M, 3) int64: индексы i, j, k занятых ячеек, по возрастанию
+    count: np.ndarray    # (M,) точек в ячейке
+    mean: np.ndarray     # (M,) среднее значения (по умолчанию Z) в ячейке
+    min: np.ndarray
+    max: np.ndarray
+    inverse: np.ndarray  # (N,) номер ячейки для каждой точки
+
+
+def voxel_size_for(points: np.ndarray, cubes: float = 30.0) -> float:
+    """≈ cubes кубиков по максимальному измерению облака."""
+    extent = points.max(axis=0) - points.min(axis=0)
+    return float(extent.max()) / cubes
+
+
+def voxelize_points(points: np.ndarray, voxel_size: float, origin=None, values=None) -> VoxelStats:
+    """Группирует точки по вокселям за O(N log N): одна сортировка по линейному
+       ключу int64 вместо np.unique(axis=0), дальше — reduceat по отрезкам.
+       values — величина для mean/min/max (по умолчанию Z)."""
+    points = np.asarray(points, dtype=float)
+    if len(points) == 0:
+        raise ValueError("Point cloud is empty for voxelization")
+    origin = points.min(axis=0) if origin is None else np.asarray(origin, dtype=float)
+    values = points[:, 2] if values is None else np.asarray(values, dtype=float)
+
+    ijk = np.floor((points - origin) / voxel_size).astype(np.int64)
+    if (ijk < 0).any():
+        raise ValueError("points lie below the grid origin")
+    dims = tuple(int(d) for d in ijk.max(axis=0) + 1)
+    lin = (ijk[:, 0] * dims[1] + ijk[:, 1]) * dims[2] + ijk[:, 2]
+
+    order = np.argsort(lin, kind="stable")
+    lin_sorted = lin[order]
+    starts = np.flatnonzero(np.r_[True, lin_sorted[1:] != lin_sorted[:-1]])
+    count = np.diff(np.r_[starts, len(lin_sorted)])
+    v = values[order]
+
+    inverse = np.empty(len(points), dtype=np.int64)
+    inverse[order] = np.repeat(np.arange(len(starts)), count)
+    # порядок ячеек лексикографический по (i, j, k) — как у np.unique(ijk, axis=0)
+    keys = np.stack(np.unravel_index(lin_sorted[starts], dims), axis=1).astype(np.int64)
+    return VoxelStats(
+        origin=origin,
+        voxel_size=float(voxel_size),
+        keys=keys,
+        count=count,
+        mean=np.add.reduceat(v, starts) / count,
+        min=np.minimum.reduceat(v, starts),
+        max=np.maximum.reduceat(v, starts),
+        inverse=inverse,
+    )
+
+
+def cube_mesh_arrays(keys: np.ndarray, origin: np.ndarray, voxel_size: float,
+                     colors: np.ndarray) -> tuple:
+    """(V, F, C) для кубика на каждую ячейку, без цикла по вокселям:
+       8 вершин и 12 треугольников на куб, цвет ячейки — на все её вершины."""
+    corners = np.asarray(origin, dtype=float) + keys * voxel_size                      # (M, 3)
+    V = (corners[:, None, :] + UNIT_CUBE_VERTICES[None] * voxel_size).reshape(-1, 3)  # (8M, 3)
+    offsets = (np.arange(len(keys), dtype=np.int32) * len(UNIT_CUBE_VERTICES))[:, None, None]
+    F = (UNIT_CUBE_TRIANGLES[None] + offsets).reshape(-1, 3)                         # (12M, 3)
+    C = np.repeat(np.asarray(colors, dtype=float), len(UNIT_CUBE_VERTICES), axis=0)   # (8M, 3)
+    return V, F, C
+
+
+# грани единичного куба: (ось, знак) для пар треугольников UNIT_CUBE_TRIANGLES[2f:2f+2]
+CUBE_FACES = ((1, +1), (0, -1), (1, -1), (0, +1), (2, +1), (2, -1))
+
+
+def _padded_linear(keys: np.ndarray) -> tuple:
+    """Линейные ключи в сетке с рамкой в одну ячейку: у соседа граничной ячейки
+       тоже есть валидный ключ. Для отсортированных keys ключи тоже отсортированы."""
+    dims = keys.max(axis=0) + 3
+    lin = ((keys[:, 0] + 1) * dims[1] + keys[:, 1] + 1) * dims[2] + keys[:, 2] + 1
+    strides = np.array([dims[1] * dims[2], dims[2], 1], dtype=np.int64)
+    return lin, strides
+
+
+def exposed_faces(keys: np.ndarray) -> np.ndarray:
+    """(M, 6) bool: грань CUBE_FACES[f] ячейки граничит с пустой ячейкой.
+       keys должны быть отсортированы (как в VoxelStats)."""
+    lin, strides = _padded_linear(keys)
+    exposed = np.empty((len(keys), len(CUBE_FACES)), dtype=bool)
+    for f, (axis, sign) in enumerate(CUBE_FACES):
+        nb = lin + sign * strides[axis]
+        pos = np.minimum(np.searchsorted(lin, nb), len(lin) - 1)
+        exposed[:, f] = lin[pos] != nb
+    return exposed
+
+
+def surface_mesh_arrays(keys: np.ndarray, origin: np.ndarray, voxel_size: float,
+                        colors: np.ndarray) -> tuple:
+    """Как cube_mesh_arrays, но только грани, смежные с пустыми ячейками;
+       внутренние грани и лишние вершины отбрасываются. Форма и цвета те же, а
+       нормали вершин — нет: compute_vertex_normals() усредняет по оставшимся
+       граням кубика, поэтому затенение у рёбер рядом с соседями отличается."""
+    V, F, C = cube_mesh_arrays(keys, origin, voxel_size, colors)
+    keep = np.repeat(exposed_faces(keys), 2, axis=1).reshape(-1)  # 2 треугольника на грань
+    F = F[keep]
+    used, F = np.unique(F, return_inverse=True)
+    return V[used], F.reshape(-1, 3).astype(np.int32), C[used]
+
+
+def greedy_mesh_arrays(keys: np.ndarray, origin: np.ndarray, voxel_size: float,
+                       colors: np.ndarray) -> tuple:
+    """Открытые грани + слияние в полосы: соседние вдоль одной оси грани одного
+       направления и одного цвета становятся одним прямоугольником (2 треугольника).
+       Сливаются только точно равные цвета — цвета стоит квантовать заранее."""
+    origin = np.asarray(origin, dtype=float)
+    colors = np.asarray(colors, dtype=float)
+    _, color_id = np.unique(colors, axis=0, return_inverse=True)
+    color_id = color_id.reshape(-1)
+    exposed = exposed_faces(keys)
+    all_v, all_f, all_c = [], [], []
+    n_verts = 0
+    for f, (axis, sign) in enumerate(CUBE_FACES):
+        cells = np.flatnonzero(exposed[:, f])
+        if len(cells) == 0:
+            continue
+        m_axis, o_axis = [a for a in range(3) if a != axis]  # полосы идут вдоль m_axis
+        k = keys[cells]
+        order = np.lexsort((k[:, m_axis], color_id[cells], k[:, o_axis], k[:, axis]))
+        k, cells = k[order], cells[order]
+        same_line = ((k[1:, axis] == k[:-1, axis]) & (k[1:, o_axis] == k[:-1, o_axis])
+                     & (color_id[cells[1:]] == color_id[cells[:-1]]))
+        contiguous = same_line & (k[1:, m_axis] == k[:-1, m_axis] + 1)
+        starts = np.flatnonzero(np.r_[True, ~contiguous])
+        ends = np.r_[starts[1:], len(k)] - 1
+
+        first = k[starts].astype(float)
+        plane = first[:, axis] + (1.0 if sign > 0 else 0.0)
+        m0, m1 = first[:, m_axis], k[ends, m_axis] + 1.0
+        o0, o1 = first[:, o_axis], first[:, o_axis] + 1.0
+        quad = np.empty((len(starts), 4, 3))
+        quad[:, :, axis] = plane[:, None]
+        quad[:, :, m_axis] = np.stack([m0, m1, m1, m0], axis=1)
+        quad[:, :, o_axis] = np.stack([o0, o0, o1, o1], axis=1)
+
+        # обход (0,1,2),(0,2,3) даёт нормаль e_m × e_o; разворачиваем, если она внутрь
+        normal = np.cross(np.eye(3)[m_axis], np.eye(3)[o_axis])
+        tris = np.array([[0, 1, 2], [0, 2, 3]]) if normal[axis] * sign > 0 \
+            else np.array([[0, 2, 1], [0, 3, 2]])
+        base = n_verts + 4 * np.arange(len(starts))[:, None, None]
+        all_v.append(origin + quad.reshape(-1, 3) * voxel_size)
+        all_f.append((tris[None] + base).reshape(-1, 3))
+        all_c.append(np.repeat(colors[cells[starts]], 4, axis=0))
+        n_verts += 4 * len(starts)
+    return (np.vstack(all_v), np.vstack(all_f).astype(np.int32), np.vstack(all_c))
+
+
+# режимы описаны в voxel_modes.py; имена должны совпадать с VOXEL_MODES
+VOXEL_MESHERS = {"cubes": cube_mesh_arrays, "surface": surface_mesh_arrays, "greedy": greedy_mesh_arrays}
+if set(VOXEL_MESHERS) != set(VOXEL_MODES):
+    raise ImportError(f"voxel_modes.VOXEL_MODES {VOXEL_MODES} != VOXEL_MESHERS {tuple(VOXEL_MESHERS)}")